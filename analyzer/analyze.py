@@ -1,6 +1,8 @@
 import pymc as pm
 import numpy as np
+import numpy.linalg as npl
 import markov
+import markov_sparse
 import markov_symbolic
 import math
 import itertools
@@ -54,6 +56,102 @@ def reorder(players, winning_team, order_variation):
     deque.rotate(order_variation-len(players))
     return (list(deque), winning_team)
 
+def order_cycle(num_players, winning_team, order_variation):
+    """
+    Describe an ordering from reorder as a rotation of a shooting cycle.
+    Return (cycle, start, cycle_winning_team), where cycle lists the player
+    positions in shooting order beginning with the first player, start is the
+    position in cycle of the player who breaks and cycle_winning_team is the
+    winning team when the teams are labelled by their positions in cycle.
+    Orderings with the same cycle only differ by who breaks.
+    """
+    (order, order_winning_team) = reorder(range(num_players), winning_team,
+                                          order_variation)
+    first = order.index(0)
+    cycle = tuple(order[first:] + order[:first])
+    start = (num_players - first) % num_players
+    if start % 2 == 0:
+        cycle_winning_team = order_winning_team
+    else:
+        cycle_winning_team = (order_winning_team + 1) % 2
+    return (cycle, start, cycle_winning_team)
+
+_order_cycle_tables = {}
+
+def order_cycles(num_players, winning_team, order_variation):
+    """
+    The array version of order_cycle for many matches with the same number of
+    players.  Return (cycles, starts, cycle_winning_teams) where cycles has a
+    row for each match.
+    """
+    table = _order_cycle_tables.get(num_players)
+    if table is None:
+        if num_players <= 2:
+            orderings = range(num_players)
+        else:
+            orderings = range(num_players * 2)
+        entries = [[order_cycle(num_players, team, ordering)
+                    for ordering in orderings]
+                   for team in (0, 1)]
+        table = tuple(np.array([[entry[field] for entry in team_entries]
+                                for team_entries in entries])
+                      for field in range(3))
+        _order_cycle_tables[num_players] = table
+
+    (cycles, starts, cycle_winning_teams) = table
+    order_variation = np.asarray(order_variation, dtype=np.intp)
+    if np.any(order_variation < 0) or \
+       np.any(order_variation >= starts.shape[1]):
+        raise ValueError("There are only " + str(starts.shape[1]) +
+                         " possible orderings with " + str(num_players) +
+                         " players")
+    winning_team = np.asarray(winning_team, dtype=np.intp)
+    return (cycles[winning_team, order_variation],
+            starts[winning_team, order_variation],
+            cycle_winning_teams[winning_team, order_variation])
+
+def batch_arrays(sink, foul, winning_team, order, foul_end):
+    """
+    Convert and check the arguments of MatchEvaluator.eval_batch
+    """
+    sink = np.asarray(sink, dtype=np.float64)
+    foul = np.asarray(foul, dtype=np.float64)
+    winning_team = np.asarray(winning_team, dtype=np.intp)
+    order = np.asarray(order, dtype=np.intp)
+    foul_end = np.asarray(foul_end, dtype=bool)
+
+    if sink.ndim != 2 or sink.shape != foul.shape:
+        raise ValueError("The sink and foul arrays must both be matches x " +
+                         "players")
+    for match_values in (winning_team, order, foul_end):
+        if match_values.shape != (sink.shape[0],):
+            raise ValueError("There must be one winning_team, order and " +
+                             "foul_end for each match")
+    if sink.shape[1] % 2 != 0:
+        raise ValueError("The number of players must be even")
+    if np.any((winning_team != 0) & (winning_team != 1)):
+        raise ValueError("The winning_team must be either 0 or 1")
+
+    return (sink, foul, winning_team, order, foul_end)
+
+def checked_chances(sink, foul):
+    """
+    Return the players' sink, foul_end and miss chances as float64 arrays,
+    with the players along the last axis, after checking them with
+    markov.check_chances.  A ValueError is raised if none of the players of
+    a match can sink a ball or foul, since the match would never end.
+    """
+    sink = markov.check_chances(sink)
+    foul = markov.check_chances(foul)
+    miss = markov.check_chances(1 - (sink + foul))
+    if np.any(np.all(miss == 1, axis=-1)):
+        raise _never_ends_error()
+    return (sink, foul, miss)
+
+def _never_ends_error():
+    return ValueError("The match never ends, because none of the players " +
+                      "can sink a ball or foul")
+
 def value(v):
     if isinstance(v, pm.Variable):
         return v.value
@@ -65,24 +163,61 @@ class MatchEvaluator(object):
 
     def eval_unordered(self, players, winning_team, foul_end):
         orderings = range(len(players) * 2)
-        return self._eval_with_orderings(players, winning_team,
-                                         orderings, foul_end)
+        return self.eval_with_orderings(players, winning_team,
+                                        orderings, foul_end)
 
     def eval_partial_ordered(self, players, winning_team, foul_end):
         orderings = range(len(players))
-        return self._eval_with_orderings(players, winning_team,
-                                         orderings, foul_end)
+        return self.eval_with_orderings(players, winning_team,
+                                        orderings, foul_end)
 
-    def _eval_with_orderings(self, players, winning_team, orderings, foul_end):
-        count=0
-        total=0
-    
-        for ordering in orderings:
-            total += self.eval_with_order(players, winning_team,
-                                          ordering, foul_end)
-            count += 1
-            
-        return total/count
+    def eval_with_orderings(self, players, winning_team, orderings, foul_end):
+        """
+        Return the chance of the outcome averaged over the orderings
+        """
+        chances = self.eval_orderings(players, winning_team, orderings,
+                                      foul_end)
+        return chances.sum()/len(chances)
+
+    def eval_orderings(self, players, winning_team, orderings, foul_end):
+        """
+        Return an array with the chance of the outcome for each of the
+        orderings.  Orderings that are rotations of the same shooting cycle
+        are evaluated together by eval_starts.
+        """
+        chances = np.zeros(len(orderings))
+        cycles = collections.OrderedDict()
+        for (i, ordering) in enumerate(orderings):
+            (cycle, start, cycle_winning_team) = order_cycle(len(players),
+                                                             winning_team,
+                                                             ordering)
+            cycles.setdefault((cycle, cycle_winning_team), []).append(
+                (i, start))
+
+        for ((cycle, cycle_winning_team), entries) in cycles.items():
+            cycle_players = [players[position] for position in cycle]
+            start_chances = self.eval_starts(cycle_players, cycle_winning_team,
+                                             foul_end)
+            for (i, start) in entries:
+                chances[i] = start_chances[start]
+
+        return chances
+
+    def eval_starts(self, players, winning_team, foul_end):
+        """
+        Return the chance of the outcome for each choice of the player who
+        breaks, keeping the players in the same shooting order.  The teams are
+        labelled by the players' positions in the list, not by who breaks.
+        """
+        chances = []
+        for start in range(len(players)):
+            rotated = players[start:] + players[:start]
+            if start % 2 == 0:
+                rotated_winning_team = winning_team
+            else:
+                rotated_winning_team = (winning_team + 1) % 2
+            chances.append(self.eval(rotated, rotated_winning_team, foul_end))
+        return chances
 
     def eval_with_order(self, players, winning_team, order, foul_end):
         (players, winning_team) = reorder(players, winning_team, order)
@@ -91,108 +226,355 @@ class MatchEvaluator(object):
     def eval(self, players, winning_team, foul_end):
         raise Exception("The eval method must be implemented")
 
-class MarkovMatchEvaluator(MatchEvaluator):
+    def eval_batch(self, sink, foul, winning_team, order, foul_end):
+        """
+        Evaluate many matches with the same number of players at once.  sink
+        and foul are matches x players arrays of the players' sink and
+        foul_end chances, and winning_team, order and foul_end have the
+        eval_with_order argument for each match.  Return an array with the
+        chance of each match.
+        """
+        (sink, foul, winning_team, order, foul_end) = batch_arrays(
+            sink, foul, winning_team, order, foul_end)
+        chances = np.zeros(len(sink))
+        for match in range(len(sink)):
+            players = [{'sink': sink[match, i], 'foul_end': foul[match, i]}
+                       for i in range(sink.shape[1])]
+            chances[match] = self.eval_with_order(players,
+                                                  winning_team[match],
+                                                  order[match],
+                                                  foul_end[match])
+        return chances
 
-    def _build_uninitialized_chain(self, num_players,
-                                   markov=markov, ballsPerTeam=8):
-        chain = self._create_new_chain()
+def outcome_index(winning_team, foul_end):
+    """
+    Return the position of an outcome in the four outcomes of a match, which
+    are ordered as a win for team 0, a win for team 1, a foul win for team 0
+    and a foul win for team 1
+    """
+    if foul_end:
+        return 2 + winning_team
+    else:
+        return winning_team
+
+# The kinds of edges of a ChainTemplate
+EDGE_KINDS = ('miss', 'foul_end', 'sink')
+
+class ChainTemplate(object):
+    """
+    The state layout and transition edges of a match chain.  The layout only
+    depends on the number of players and the number of balls per team, so a
+    template is built once per topology and shared by every chain built from
+    it.  Each kind of edge (miss, foul end and sink) is stored as three
+    parallel index arrays: the state the edge leaves, the state it enters and
+    the player whose probability is placed on it.
+
+    By default there is an end state for every ball count a match can end
+    with.  With collapse_end_states there are only the four outcomes, labelled
+    (team, 'win') and (team, 'foul-win').
+    """
 
+    def __init__(self, num_players, ballsPerTeam=8, collapse_end_states=False):
+        self.num_players = num_players
+        self.ballsPerTeam = ballsPerTeam
+        self.collapse_end_states = collapse_end_states
+
+        labels = []
+        if collapse_end_states:
+            labels.extend(self._end_label(team, end, 0, 0)
+                          for end in ('win', 'foul-win') for team in (0, 1))
         for team_a_balls in range(ballsPerTeam):
-            chain.new_state( (0, 'win', 0, team_a_balls) )
-            chain.new_state( (1, 'win', team_a_balls, 0) )
+            if not collapse_end_states:
+                labels.append( (0, 'win', 0, team_a_balls) )
+                labels.append( (1, 'win', team_a_balls, 0) )
             for team_b_balls in range(ballsPerTeam):
-                chain.new_state( (0, 'foul-win', team_a_balls, team_b_balls) )
-                chain.new_state( (1, 'foul-win', team_a_balls, team_b_balls) )
+                if not collapse_end_states:
+                    labels.append( (0, 'foul-win', team_a_balls,
+                                    team_b_balls) )
+                    labels.append( (1, 'foul-win', team_a_balls,
+                                    team_b_balls) )
                 for player_num in range(num_players):
-                    chain.new_state( (player_num, team_a_balls, team_b_balls) )
+                    labels.append( (player_num, team_a_balls, team_b_balls) )
 
-        return chain
+        self.labels = tuple(labels)
+        self.index_by_label = dict((label, index)
+                                   for (index, label) in enumerate(labels))
 
-    def _win_states(self, winning_team, foul_end):
-        def _create_state(winning_balls, losing_balls):
-            state_label = 'foul-win' if foul_end else 'win'
-            if winning_team == 0:
-                team_a_balls = winning_balls
-                team_b_balls = losing_balls
-            else:
-                team_a_balls = losing_balls
-                team_b_balls = winning_balls
-            
-            return (winning_team, state_label, team_a_balls, team_b_balls)
-        
-        for losing_team_balls in range(8):
-            if foul_end:
-                for winning_team_balls in range(8):
-                    yield _create_state(winning_team_balls, losing_team_balls)
-            else:
-                yield _create_state(0, losing_team_balls)
+        miss = ([], [], [])
+        foul_end = ([], [], [])
+        sink = ([], [], [])
 
-    def _set_state_transitions(self, players, chain, ballsPerTeam=8):
-        for i in range(len(players)):
-            next_player_index = (i+1) % len(players)
-        
-            chance_of_sink = players[i]['sink']
-            chance_of_foul_end = players[i]['foul_end']
-            chance_of_miss = 1 - (chance_of_sink + chance_of_foul_end)
+        def add_edge(edges, from_label, to_label, player_num):
+            edges[0].append(self.index_by_label[from_label])
+            edges[1].append(self.index_by_label[to_label])
+            edges[2].append(player_num)
 
+        for i in range(num_players):
+            next_player_index = (i+1) % num_players
             for team_a_balls in range(ballsPerTeam):
                 for team_b_balls in range(ballsPerTeam):
-                    next_player_state = chain.get_state(
-                        (next_player_index, team_a_balls, team_b_balls)
-                    )
-                    
-                    player_state = chain.get_state(
-                        (i, team_a_balls, team_b_balls)
-                    )
-                    # Create the player miss transition
-                    chain.set_transition(player_state, 
-                                         next_player_state,
-                                         chance_of_miss)
-                    
-                    # Create the foul win transition
-                    foul_end_state = chain.get_state(
-                        ((i+1) % 2, 'foul-win', team_a_balls, team_b_balls)
-                    )
-                    chain.set_transition(player_state, foul_end_state,
-                                         chance_of_foul_end)
-                    
-                    # Create the sink transition
+                    player_label = (i, team_a_balls, team_b_balls)
+                    add_edge(miss, player_label,
+                             (next_player_index, team_a_balls, team_b_balls),
+                             i)
+                    add_edge(foul_end, player_label,
+                             self._end_label((i+1) % 2, 'foul-win',
+                                             team_a_balls, team_b_balls),
+                             i)
+
                     if i % 2 == 0:
                         if team_a_balls == 0:
-                            sink_label = (0, 'win', 0, team_b_balls)
+                            sink_label = self._end_label(0, 'win', 0,
+                                                         team_b_balls)
                         else:
                             sink_label = (i, team_a_balls-1, team_b_balls)
                     else:
                         if team_b_balls == 0:
-                            sink_label = (1, 'win', team_a_balls, 0)
+                            sink_label = self._end_label(1, 'win',
+                                                         team_a_balls, 0)
                         else:
                             sink_label = (i, team_a_balls, team_b_balls-1)
-                            
-                    sink_state = chain.get_state(sink_label)
-                    chain.set_transition(player_state, sink_state,
-                                         chance_of_sink)
+                    add_edge(sink, player_label, sink_label, i)
+
+        (self.miss_from, self.miss_to, self.miss_player) = \
+            self._freeze(miss)
+        (self.foul_end_from, self.foul_end_to, self.foul_end_player) = \
+            self._freeze(foul_end)
+        (self.sink_from, self.sink_to, self.sink_player) = \
+            self._freeze(sink)
+        self._check_edges()
+
+        # Every edge at once, with the position of its kind in EDGE_KINDS
+        (self.edge_from, self.edge_to, self.edge_player, self.edge_kind) = \
+            self._freeze(
+                [np.concatenate([self.edge_arrays(kind)[field]
+                                 for kind in EDGE_KINDS])
+                 for field in range(3)] +
+                [np.concatenate([np.repeat(k, len(self.edge_arrays(kind)[0]))
+                                 for (k, kind) in enumerate(EDGE_KINDS)])])
+
+        start_indices = [self.index_by_label[(player_num, ballsPerTeam-1,
+                                               ballsPerTeam-1)]
+                         for player_num in range(num_players)]
+        (self.start_indices,) = self._freeze([start_indices])
+        self.start_index = self.start_indices[0]
+
+        outcomes = [[], [], [], []]
+        for (index, label) in enumerate(self.labels):
+            if label[1] == 'win' or label[1] == 'foul-win':
+                foul = label[1] == 'foul-win'
+                outcomes[outcome_index(label[0], foul)].append(index)
+        self.outcome_indices = self._freeze(outcomes)
+
+        # Positions of the states within the transient (player) and absorbing
+        # (end) blocks of the matrix, used to solve many matches at once
+        absorbing = np.zeros(len(self.labels), dtype=bool)
+        for indices in self.outcome_indices:
+            absorbing[indices] = True
+        (self.transient_indices, self.absorbing_indices) = self._freeze(
+            [np.flatnonzero(~absorbing), np.flatnonzero(absorbing)])
+        block_positions = np.zeros(len(self.labels), dtype=np.intp)
+        block_positions[self.transient_indices] = \
+            np.arange(len(self.transient_indices))
+        block_positions[self.absorbing_indices] = \
+            np.arange(len(self.absorbing_indices))
+
+        self._block_edges = {}
+        for kind in EDGE_KINDS:
+            (from_indices, to_indices, player_nums) = self.edge_arrays(kind)
+            (into_transient,) = self._freeze([~absorbing[to_indices]], bool)
+            self._block_edges[kind] = self._freeze(
+                [block_positions[from_indices], block_positions[to_indices],
+                 player_nums]) + (into_transient,)
+        (self.start_positions,) = self._freeze(
+            [block_positions[self.start_indices]])
+
+        outcome_blocks = np.zeros((4, len(self.absorbing_indices)))
+        for (outcome, indices) in enumerate(self.outcome_indices):
+            outcome_blocks[outcome, block_positions[indices]] = 1
+        (self.outcome_blocks,) = self._freeze([outcome_blocks], np.float64)
+
+    def _check_edges(self):
+        """
+        Check that every edge joins two different states of the layout, once
+        for the template, so that chains built from it can set the edges'
+        transitions with Chain.set_known_transitions
+        """
+        for kind in EDGE_KINDS:
+            (from_indices, to_indices, player_nums) = self.edge_arrays(kind)
+            if np.any(from_indices == to_indices):
+                raise Exception("The from_state and to_state much be " +
+                                "different")
+            for indices in (from_indices, to_indices):
+                if np.any(indices < 0) or np.any(indices >= len(self.labels)):
+                    raise Exception("The state indices must be part of " +
+                                    "the chain")
+
+    def _end_label(self, team, end, team_a_balls, team_b_balls):
+        if self.collapse_end_states:
+            return (team, end)
+        else:
+            return (team, end, team_a_balls, team_b_balls)
+
+    def outcome_states(self, winning_team, foul_end):
+        """
+        Return the indices of the end states where winning_team wins, either
+        by a foul or not
+        """
+        return self.outcome_indices[outcome_index(winning_team, foul_end)]
+
+    def _freeze(self, edges, dtype=np.intp):
+        arrays = []
+        for indices in edges:
+            array = np.array(indices, dtype=dtype)
+            array.flags.writeable = False
+            arrays.append(array)
+        return tuple(arrays)
+
+    @property
+    def key(self):
+        return (self.num_players, self.ballsPerTeam, self.collapse_end_states)
+
+    def edge_arrays(self, kind):
+        """
+        Return the (from_indices, to_indices, player_nums) arrays for the kind
+        of edge, which is one of 'miss', 'foul_end' or 'sink'
+        """
+        return (getattr(self, kind + '_from'), getattr(self, kind + '_to'),
+                getattr(self, kind + '_player'))
+
+    def block_edges(self, kind):
+        """
+        Return the (from_positions, to_positions, player_nums, into_transient)
+        arrays for the kind of edge.  The positions are within the transient
+        block for from_positions, and within the transient or absorbing block
+        for to_positions, depending on into_transient.
+        """
+        return self._block_edges[kind]
+
+_chain_templates = {}
+
+def chain_template(num_players, ballsPerTeam=8, collapse_end_states=False):
+    """
+    Return the shared ChainTemplate for the topology, creating it on first use
+    """
+    key = (num_players, ballsPerTeam, collapse_end_states)
+    template = _chain_templates.get(key)
+    if template is None:
+        template = ChainTemplate(num_players, ballsPerTeam,
+                                 collapse_end_states)
+        _chain_templates[key] = template
+    return template
+
+class MarkovMatchEvaluator(MatchEvaluator):
+
+    def __init__(self, collapse_end_states=False):
+        """
+        With collapse_end_states, the chains used by eval only have the four
+        outcomes as end states.  build_chain keeps every ball count unless it
+        is asked not to.
+        """
+        self.collapse_end_states = collapse_end_states
+        self._empty_chains = {}
+
+    def _build_uninitialized_chain(self, num_players,
+                                   markov=markov, ballsPerTeam=8,
+                                   collapse_end_states=False):
+        template = chain_template(num_players, ballsPerTeam,
+                                  collapse_end_states)
+        empty_chain = self._empty_chains.get(template.key)
+        if empty_chain is None:
+            empty_chain = self._create_new_chain()
+            empty_chain.new_states(template.labels)
+            self._empty_chains[template.key] = empty_chain
+
+        return empty_chain.empty_copy()
+
+    def _set_state_transitions(self, players, chain, ballsPerTeam=8,
+                               collapse_end_states=False):
+        template = chain_template(len(players), ballsPerTeam,
+                                  collapse_end_states)
+        chances = {}
+        for (i, player) in enumerate(players):
+            chance_of_sink = player['sink']
+            chance_of_foul_end = player['foul_end']
+            chance_of_miss = 1 - (chance_of_sink + chance_of_foul_end)
+            chances[i] = {'miss': chance_of_miss,
+                          'foul_end': chance_of_foul_end,
+                          'sink': chance_of_sink}
+
+        for kind in EDGE_KINDS:
+            (from_indices, to_indices, player_nums) = template.edge_arrays(kind)
+            chain.set_transitions(from_indices, to_indices,
+                                  [chances[player_num][kind]
+                                   for player_num in player_nums])
 
     def _create_new_chain(self):
         raise Exception("The _create_new_chain method must be implemented")
 
-    def build_chain(self, players, ballsPerTeam=8):
+    def build_chain(self, players, ballsPerTeam=8, collapse_end_states=False):
         if len(players) % 2 != 0:
             raise ValueError("The number of players must be even")
 
             
         # Create states before the transition probabilities so they'll be ready
         # to reference
-        chain = self._build_uninitialized_chain(len(players),
-                                                ballsPerTeam=ballsPerTeam)
+        chain = self._build_uninitialized_chain(
+            len(players), ballsPerTeam=ballsPerTeam,
+            collapse_end_states=collapse_end_states)
         self._set_state_transitions(players,
                                     chain,
-                                    ballsPerTeam=ballsPerTeam)
+                                    ballsPerTeam=ballsPerTeam,
+                                    collapse_end_states=collapse_end_states)
         
         return chain
         
 class NumericMarkovMatchEvaluator(MarkovMatchEvaluator):
+    def __init__(self, collapse_end_states=True):
+        MarkovMatchEvaluator.__init__(self, collapse_end_states)
+        self._eval_chains = {}
+
     def _create_new_chain(self):
         return markov.Chain()
+
+    def _set_state_transitions(self, players, chain, ballsPerTeam=8,
+                               collapse_end_states=False):
+        template = chain_template(len(players), ballsPerTeam,
+                                  collapse_end_states)
+        sinks = np.array([value(player['sink']) for player in players],
+                         dtype=np.float64)
+        foul_ends = np.array([value(player['foul_end']) for player in players],
+                             dtype=np.float64)
+        misses = 1 - (sinks + foul_ends)
+        # Rows in the order of EDGE_KINDS
+        chances = np.array([misses, foul_ends, sinks])
+
+        # The template checked its edges when it was built, and they are all
+        # of the chain's transitions
+        chain.replace_transitions(template.edge_from, template.edge_to,
+                                  chances[template.edge_kind,
+                                          template.edge_player])
+
+    def _eval_chain(self, players):
+        """
+        Return the chain of the players for eval and eval_starts.  Unlike
+        build_chain, the evaluator keeps a single chain for each template
+        and replaces its transitions on every call, so the chain must not be
+        used after the next call.
+        """
+        if len(players) % 2 != 0:
+            raise ValueError("The number of players must be even")
+
+        template = chain_template(len(players),
+                                  collapse_end_states=self.collapse_end_states)
+        chain = self._eval_chains.get(template.key)
+        if chain is None:
+            chain = self._build_uninitialized_chain(
+                len(players), collapse_end_states=self.collapse_end_states)
+            self._eval_chains[template.key] = chain
+        self._set_state_transitions(
+            players, chain, collapse_end_states=self.collapse_end_states)
+        return chain
         
     def eval(self, players, winning_team, foul_end):
         if winning_team != 0 and winning_team != 1:
@@ -207,21 +589,408 @@ class NumericMarkovMatchEvaluator(MarkovMatchEvaluator):
             new_player['foul_end'] = value(player['foul_end'])
             new_players.append(new_player)
                 
-        chain = self.build_chain(new_players)
-        player_0_start = chain.get_state( (0, 7, 7) )
-
-        result = chain.steady_state(player_0_start)
-   
-        total = 0
-        for end_state in self._win_states(winning_team, foul_end):
-            total += result[chain.get_state(end_state)]
-        
-        return total
+        chain = self._eval_chain(new_players)
+        template = chain_template(len(new_players),
+                                  collapse_end_states=self.collapse_end_states)
+
+        result = chain.absorption_vector(template.start_index)
+        return result[template.outcome_states(winning_team, foul_end)].sum()
+
+    def eval_starts(self, players, winning_team, foul_end):
+        if winning_team != 0 and winning_team != 1:
+            raise ValueError("The winning_team must be either 0 or 1 " +
+                             "but was " + str(winning_team))
+
+        chain = self._eval_chain(players)
+        template = chain_template(len(players),
+                                  collapse_end_states=self.collapse_end_states)
+
+        # A single solve covers every player breaking
+        results = chain.absorption_vectors(template.start_indices)
+        end_states = template.outcome_states(winning_team, foul_end)
+        return results[end_states].sum(axis=0)
+
+    def eval_batch(self, sink, foul, winning_team, order, foul_end,
+                   chunk_size=64):
+        """
+        Evaluate many matches with stacked linear solves against the
+        transient block of each match's chain, chunk_size matches at a time
+        """
+        (sink, foul, winning_team, order, foul_end) = batch_arrays(
+            sink, foul, winning_team, order, foul_end)
+        (num_matches, num_players) = sink.shape
+        template = chain_template(num_players,
+                                  collapse_end_states=self.collapse_end_states)
+
+        (cycles, starts, cycle_winning_team) = order_cycles(num_players,
+                                                            winning_team,
+                                                            order)
+        matches = np.arange(num_matches)[:, np.newaxis]
+        cycle_sink = sink[matches, cycles]
+        cycle_foul = foul[matches, cycles]
+        cycle_miss = 1 - (cycle_sink + cycle_foul)
+        for chances in (cycle_sink, cycle_foul, cycle_miss):
+            markov.check_chances(chances)
+        outcomes = cycle_winning_team + 2 * foul_end
+
+        result = np.zeros(num_matches)
+        for first in range(0, num_matches, chunk_size):
+            chunk = slice(first, first + chunk_size)
+            result[chunk] = self._solve_batch(template, cycle_sink[chunk],
+                                              cycle_foul[chunk],
+                                              cycle_miss[chunk],
+                                              starts[chunk], outcomes[chunk])
+        return result
+
+    def _solve_batch(self, template, sink, foul, miss, starts, outcomes):
+        num_matches = len(sink)
+        num_transient = len(template.transient_indices)
+        num_absorbing = len(template.absorbing_indices)
+        q = np.zeros((num_matches, num_transient, num_transient))
+        r = np.zeros((num_matches, num_absorbing, num_transient))
+
+        matches = np.arange(num_matches)[:, np.newaxis]
+        for (kind, chances) in (('miss', miss), ('foul_end', foul),
+                                ('sink', sink)):
+            (from_positions, to_positions, player_nums, into_transient) = \
+                template.block_edges(kind)
+            values = chances[:, player_nums]
+            into_absorbing = ~into_transient
+            q[matches, to_positions[into_transient],
+              from_positions[into_transient]] = values[:, into_transient]
+            r[matches, to_positions[into_absorbing],
+              from_positions[into_absorbing]] = values[:, into_absorbing]
+
+        # Solve (I - Q) x = e_start for every match at once
+        q *= -1
+        diagonal = np.arange(num_transient)
+        q[:, diagonal, diagonal] += 1
+        start_vectors = np.zeros((num_matches, num_transient, 1))
+        start_vectors[np.arange(num_matches),
+                      template.start_positions[starts], 0] = 1
+        try:
+            visits = npl.solve(q, start_vectors)[:, :, 0]
+        except npl.LinAlgError:
+            raise ValueError("The matrix is not an absorbing matrix")
+
+        absorbed = np.einsum('nat,nt->na', r, visits)
+        return (absorbed * template.outcome_blocks[outcomes]).sum(axis=1)
+
+class SparseMarkovMatchEvaluator(NumericMarkovMatchEvaluator):
+    """
+    Evaluates matches with chains stored as sparse matrices, which scales to
+    bigger racks and more players than the dense chains
+    """
+    def _create_new_chain(self):
+        return markov_sparse.Chain()
+
+    def eval_batch(self, sink, foul, winning_team, order, foul_end):
+        # The stacked solves use dense blocks, so solve each sparse chain
+        # on its own instead
+        return MatchEvaluator.eval_batch(self, sink, foul, winning_team, order,
+                                         foul_end)
 
 class SymbolicMarkovMatchEvaluator(MarkovMatchEvaluator):
     def _create_new_chain(self):
         return markov_symbolic.Chain()
 
+def ball_count_outcome(sinks, foul_ends, winning_team, foul_end,
+                       ballsPerTeam=8, bind=None):
+    """
+    Return the chance of the outcome (winning_team winning, by a foul or not)
+    for each choice of the player who breaks, without building a chain.
+
+    Sinks only ever lower the ball counts, so the cells of (team a balls,
+    team b balls) are solved from the end of the match backwards.  Within a
+    cell, misses just pass the shot around the players and that cycle has a
+    closed form, so each cell costs O(players).  Only arithmetic is used, so
+    the chances can be floats, numpy arrays or sympy expressions.  When they
+    are arrays of many matches, winning_team and foul_end can be arrays too.
+
+    If bind is given, it is called with every intermediate value that is
+    used more than once and its result is used in place of the value.  This
+    lets symbolic callers name the intermediate values instead of building
+    one huge expression.
+
+    A ValueError is raised if no player can ever sink a ball or foul, as
+    NumericMarkovMatchEvaluator does.
+    """
+    num_players = len(sinks)
+    misses = [1 - (sinks[i] + foul_ends[i]) for i in range(num_players)]
+    if bind is not None:
+        misses = [bind(miss) for miss in misses]
+
+    # A foul ends the match with a win for the other team at any ball count
+    if np.ndim(winning_team) == 0 and np.ndim(foul_end) == 0:
+        fouls = []
+        for i in range(num_players):
+            if foul_end and (i+1) % 2 == winning_team:
+                fouls.append(foul_ends[i])
+            else:
+                fouls.append(0)
+
+        clean_win = [0, 0]
+        if not foul_end:
+            clean_win[winning_team] = 1
+    else:
+        winning_team = np.asarray(winning_team)
+        foul_end = np.asarray(foul_end, dtype=bool)
+        fouls = [foul_ends[i] * (foul_end & (winning_team == (i+1) % 2))
+                 for i in range(num_players)]
+        clean_win = [(~foul_end & (winning_team == team)).astype(np.float64)
+                     for team in (0, 1)]
+
+    cycle = 1
+    for miss in misses:
+        cycle = cycle * miss
+    # Like a chain that isn't absorbing, a match where every shot misses
+    # never ends
+    if np.any(np.asarray(cycle == 1)):
+        raise _never_ends_error()
+    # The shot comes back around to the same player with the chance cycle
+    around_cycle = 1 / (1 - cycle)
+    if bind is not None:
+        around_cycle = bind(around_cycle)
+
+    previous_row = None
+    for team_a_balls in range(ballsPerTeam):
+        row = []
+        for team_b_balls in range(ballsPerTeam):
+            # The chance of the outcome from everything but a miss
+            chances = []
+            for i in range(num_players):
+                if i % 2 == 0:
+                    if team_a_balls == 0:
+                        after_sink = clean_win[0]
+                    else:
+                        after_sink = previous_row[team_b_balls][i]
+                else:
+                    if team_b_balls == 0:
+                        after_sink = clean_win[1]
+                    else:
+                        after_sink = row[team_b_balls-1][i]
+                chances.append(sinks[i] * after_sink + fouls[i])
+
+            first = 0
+            reach = 1
+            for i in range(num_players):
+                first = first + reach * chances[i]
+                reach = reach * misses[i]
+            first = first * around_cycle
+            if bind is not None:
+                first = bind(first)
+
+            values = [first] * num_players
+            following = first
+            for i in reversed(range(1, num_players)):
+                following = chances[i] + misses[i] * following
+                if bind is not None:
+                    following = bind(following)
+                values[i] = following
+            row.append(values)
+        previous_row = row
+
+    return previous_row[ballsPerTeam-1]
+
+class BallCountMatchEvaluator(MatchEvaluator):
+    """
+    Gives the same results as NumericMarkovMatchEvaluator, but walks the ball
+    counts with ball_count_outcome instead of solving a chain
+    """
+
+    def __init__(self, ballsPerTeam=8):
+        self.ballsPerTeam = ballsPerTeam
+
+    def eval(self, players, winning_team, foul_end):
+        return self.eval_starts(players, winning_team, foul_end)[0]
+
+    def eval_starts(self, players, winning_team, foul_end):
+        if winning_team != 0 and winning_team != 1:
+            raise ValueError("The winning_team must be either 0 or 1 " +
+                             "but was " + str(winning_team))
+        if len(players) % 2 != 0:
+            raise ValueError("The number of players must be even")
+
+        (sinks, foul_ends, misses) = checked_chances(
+            [value(player['sink']) for player in players],
+            [value(player['foul_end']) for player in players])
+        return ball_count_outcome(sinks.tolist(), foul_ends.tolist(),
+                                  winning_team, foul_end, self.ballsPerTeam)
+
+    def eval_batch(self, sink, foul, winning_team, order, foul_end):
+        """
+        Evaluate many matches with one ball-count recursion over arrays
+        """
+        (sink, foul, winning_team, order, foul_end) = batch_arrays(
+            sink, foul, winning_team, order, foul_end)
+        (num_matches, num_players) = sink.shape
+        if num_matches == 0:
+            return np.zeros(0)
+        checked_chances(sink, foul)
+
+        (cycles, starts, cycle_winning_team) = order_cycles(num_players,
+                                                            winning_team,
+                                                            order)
+        matches = np.arange(num_matches)[:, np.newaxis]
+        cycle_sink = sink[matches, cycles]
+        cycle_foul = foul[matches, cycles]
+        outcome = ball_count_outcome(list(cycle_sink.T), list(cycle_foul.T),
+                                     cycle_winning_team, foul_end,
+                                     self.ballsPerTeam)
+        return np.array(outcome)[starts, np.arange(num_matches)]
+
+CacheInfo = collections.namedtuple('CacheInfo',
+                                   ['hits', 'misses', 'maxsize', 'currsize'])
+
+class CachedMatchEvaluator(MatchEvaluator):
+    """
+    Wraps another evaluator and remembers the most recent maxsize results of
+    eval and eval_starts, keyed on the players' sink and foul_end values.  The
+    other eval methods are built on those two, so they are cached as well,
+    except for eval_batch, which caches the chance of each of its matches.
+
+    Values are matched exactly unless quantum is given, in which case values
+    that round to the same multiple of quantum share a result.  Halves round
+    up, the same way for eval and eval_batch.  The result is
+    still calculated from the first values seen, so quantizing trades
+    accuracy for reuse.
+    """
+
+    def __init__(self, evaluator, maxsize=10000, quantum=None):
+        self.evaluator = evaluator
+        self.maxsize = maxsize
+        self.quantum = quantum
+        self.hits = 0
+        self.misses = 0
+        self._results = collections.OrderedDict()
+
+    def _quantize(self, v):
+        """
+        Return the multiple of quantum nearest to v, as the number of quanta
+        """
+        return np.floor(v / self.quantum + 0.5)
+
+    def _key_value(self, v):
+        v = float(value(v))
+        if self.quantum is not None:
+            return int(self._quantize(v))
+        return v
+
+    def _key(self, method, players, winning_team, foul_end):
+        values = tuple((self._key_value(player['sink']),
+                        self._key_value(player['foul_end']))
+                       for player in players)
+        return (method, values, winning_team, bool(foul_end))
+
+    def _lookup(self, key):
+        """
+        Return whether the key is cached and its result, counting the hit or
+        miss
+        """
+        results = self._results
+        if key in results:
+            self.hits += 1
+            # Move the result to the most recently used end
+            result = results.pop(key)
+            results[key] = result
+            return (True, result)
+        self.misses += 1
+        return (False, None)
+
+    def _store(self, key, result):
+        results = self._results
+        if self.maxsize > 0:
+            results[key] = result
+            if len(results) > self.maxsize:
+                results.popitem(last=False)
+
+    def _cached(self, key, calculate):
+        (found, result) = self._lookup(key)
+        if not found:
+            result = calculate()
+            self._store(key, result)
+        return result
+
+    def eval(self, players, winning_team, foul_end):
+        key = self._key('eval', players, winning_team, foul_end)
+        return self._cached(key, lambda: self.evaluator.eval(players,
+                                                              winning_team,
+                                                              foul_end))
+
+    def eval_starts(self, players, winning_team, foul_end):
+        key = self._key('eval_starts', players, winning_team, foul_end)
+        return self._cached(key, lambda: tuple(self.evaluator.eval_starts(
+            players, winning_team, foul_end)))
+
+    def eval_batch(self, sink, foul, winning_team, order, foul_end):
+        """
+        Look up each match in the cache, keyed on its row of the arguments,
+        and evaluate the matches that aren't cached in a single eval_batch of
+        the wrapped evaluator
+        """
+        (sink, foul, winning_team, order, foul_end) = batch_arrays(
+            sink, foul, winning_team, order, foul_end)
+        chances = np.zeros(len(sink))
+        keys = self._batch_keys(sink, foul, winning_team, order, foul_end)
+        results = self._results
+        # The first match with each key that isn't cached, and for every
+        # match with such a key, the position of that first match
+        (first_matches, first_by_key) = ([], {})
+        (sharing, shared) = ([], [])
+        for (match, key) in enumerate(keys):
+            if key in results:
+                self.hits += 1
+                # Move the result to the most recently used end
+                result = results.pop(key)
+                results[key] = result
+                chances[match] = result
+                continue
+            position = first_by_key.get(key)
+            if position is None:
+                self.misses += 1
+                position = first_by_key[key] = len(first_matches)
+                first_matches.append(match)
+            else:
+                self.hits += 1
+            sharing.append(match)
+            shared.append(position)
+
+        if len(first_matches) > 0:
+            rows = np.array(first_matches, dtype=np.intp)
+            new_chances = self.evaluator.eval_batch(
+                sink[rows], foul[rows], winning_team[rows], order[rows],
+                foul_end[rows])
+            chances[sharing] = new_chances[shared]
+            for (match, chance) in zip(first_matches, new_chances):
+                self._store(keys[match], chance)
+        return chances
+
+    def _batch_keys(self, sink, foul, winning_team, order, foul_end):
+        """
+        Return the cache key of each match of eval_batch.  The rows of the
+        arguments are joined into one array, the chances quantized like
+        _key_value does, and each row's bytes are its key.
+        """
+        if self.quantum is not None:
+            sink = self._quantize(sink)
+            foul = self._quantize(foul)
+        rows = np.column_stack((sink, foul, winning_team, order, foul_end))
+        rows = np.ascontiguousarray(rows, dtype=np.float64)
+        # Give -0.0 the same key as 0.0
+        rows += 0.0
+        row_type = np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))
+        return [('eval_batch', row) for row in
+                [bytes(row) for row in rows.view(row_type).ravel()]]
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize,
+                         len(self._results))
+
+    def cache_clear(self):
+        self._results.clear()
+        self.hits = 0
+        self.misses = 0
+
 def sum_less_than_one(vars):
     if sum(vars) <= 1:
         return 0.0
@@ -229,11 +998,23 @@ def sum_less_than_one(vars):
         return -pm.inf
 
 
-def new_player(name, sink=0.5, foul=1e-10): 
+# The chances new players start from and the (alpha, beta) of their Beta
+# priors, unless they are given
+DEFAULT_SINK = 0.5
+DEFAULT_FOUL = 1e-10
+DEFAULT_PRIOR = (3, 3)
+
+def new_player(name, sink=DEFAULT_SINK, foul=DEFAULT_FOUL,
+               sink_prior=DEFAULT_PRIOR, foul_prior=DEFAULT_PRIOR):
+    """
+    Create the sink and foul_end stochastics of a player, starting at sink
+    and foul, with Beta priors given as (alpha, beta)
+    """
     player = {}
-    player['sink'] = pm.Beta(name + "_sink", alpha=3, beta=3, value=sink)
-    player['foul_end'] = pm.Beta(name + "_foul_end", alpha=3,
-                                 beta=3, value=foul)
+    player['sink'] = pm.Beta(name + "_sink", alpha=sink_prior[0],
+                             beta=sink_prior[1], value=sink)
+    player['foul_end'] = pm.Beta(name + "_foul_end", alpha=foul_prior[0],
+                                 beta=foul_prior[1], value=foul)
     vars = player.values()
     player['balance'] = pm.Potential(logp = sum_less_than_one,
                                      name = name + "_balance",
@@ -242,30 +1023,203 @@ def new_player(name, sink=0.5, foul=1e-10):
         
     return player
 
-def all_matches(matches, match_evaluator):
+def sums_less_than_one(sink, foul_end):
+    if np.all(sink + foul_end <= 1):
+        return 0.0
+    else:
+        return -pm.inf
+
+class PlayerPool(object):
+    """
+    The sink and foul_end chances of every player as two array valued Beta
+    stochastics, with one Potential keeping each player's chances from adding
+    up to more than 1.  Matches using a pool refer to their players by index
+    into the arrays.  The starting chances and the (alpha, beta) of the
+    priors are either shared by every player or arrays with one per player.
+    """
+
+    def __init__(self, names, sink=DEFAULT_SINK, foul=DEFAULT_FOUL,
+                 sink_prior=DEFAULT_PRIOR, foul_prior=DEFAULT_PRIOR):
+        self.names = list(names)
+        self.index_by_name = dict((name, i)
+                                  for (i, name) in enumerate(self.names))
+        count = len(self.names)
+        self.sink = pm.Beta("players_sink", alpha=sink_prior[0],
+                            beta=sink_prior[1], value=np.ones(count) * sink)
+        self.foul_end = pm.Beta("players_foul_end", alpha=foul_prior[0],
+                                beta=foul_prior[1],
+                                value=np.ones(count) * foul)
+        self.balance = pm.Potential(logp = sums_less_than_one,
+                                    name = "players_balance",
+                                    parents = {'sink': self.sink,
+                                               'foul_end': self.foul_end},
+                                    doc = "players_balance")
+
+    def __len__(self):
+        return len(self.names)
+
+    def nodes(self):
+        return [self.sink, self.foul_end, self.balance]
+
+    def player(self, index):
+        """
+        Return the player at index as a dict of its current chances, like
+        the players the evaluators take
+        """
+        return {'sink': self.sink.value[index],
+                'foul_end': self.foul_end.value[index]}
+
+def match_orderings(match):
+    """
+    Return the orderings, as used by reorder, that the match could have been
+    played in
+    """
+    if match.order == "unordered":
+        return range(len(match.players) * 2)
+    elif match.order == "total":
+        return [0]
+    else:
+        return range(len(match.players))
+
+class IndexedMatches(object):
+    """
+    Matches whose players are given as indices into arrays of the players'
+    chances.  The matches and their orderings are grouped by the number of
+    players once, up front, so evaluating them for new chances only takes
+    array operations and a call to eval_batch for each group.
+    """
+
+    def __init__(self, player_indices, winning_teams, foul_ends, orderings):
+        self.num_matches = len(player_indices)
+        rows_by_size = collections.defaultdict(list)
+        for (match, indices) in enumerate(player_indices):
+            for order in orderings[match]:
+                rows_by_size[len(indices)].append((match, order))
+
+        self.groups = []
+        for rows in rows_by_size.values():
+            match_indices = np.array([row[0] for row in rows], dtype=np.intp)
+            self.groups.append(
+                (match_indices,
+                 np.array([player_indices[row[0]] for row in rows],
+                          dtype=np.intp),
+                 np.array([winning_teams[row[0]] for row in rows]),
+                 np.array([row[1] for row in rows]),
+                 np.array([foul_ends[row[0]] for row in rows], dtype=bool)))
+        self.counts = np.bincount(
+            np.concatenate([group[0] for group in self.groups] +
+                           [np.zeros(0, dtype=np.intp)]),
+            minlength=self.num_matches)
+
+    def eval(self, match_evaluator, sink, foul, orders=None):
+        """
+        Return an array with the chance of each match, averaged over its
+        orderings, for the arrays of the players' sink and foul_end chances.
+        If the matches were grouped with a single ordering each, orders can
+        give a new order for every match.
+        """
+        sink = np.asarray(sink, dtype=np.float64)
+        foul = np.asarray(foul, dtype=np.float64)
+        totals = np.zeros(self.num_matches)
+        for (match_indices, players, winning_teams, group_orders,
+             foul_ends) in self.groups:
+            if orders is not None:
+                group_orders = np.asarray(orders)[match_indices]
+            chances = match_evaluator.eval_batch(sink[players], foul[players],
+                                                 winning_teams, group_orders,
+                                                 foul_ends)
+            totals += np.bincount(match_indices, weights=chances,
+                                  minlength=self.num_matches)
+        return totals / self.counts
+
+def eval_matches(match_evaluator, players, winning_teams, foul_ends,
+                 orderings):
+    """
+    Evaluate many matches with match_evaluator.eval_batch.  Each argument has
+    an entry for every match: its players, winning team, whether it ended
+    with a foul and the orderings to average its chance over.  Matches with
+    the same number of players are evaluated in the same batch.  Return an
+    array with the chance of each match.
+    """
+    sinks = []
+    fouls = []
+    player_indices = []
+    for match_players in players:
+        player_indices.append(range(len(sinks),
+                                    len(sinks) + len(match_players)))
+        sinks.extend(value(player['sink']) for player in match_players)
+        fouls.extend(value(player['foul_end']) for player in match_players)
+
+    matches = IndexedMatches(player_indices, winning_teams, foul_ends,
+                             orderings)
+    return matches.eval(match_evaluator, sinks, fouls)
+
+def match_order(i, match):
+    if match.order == "unordered":
+        return pm.DiscreteUniform('match_%i_order' % i,
+                                  lower=0,
+                                  upper=len(match.players)*2 - 1)
+    else:
+        observed = match.order == "total"
+        return pm.DiscreteUniform('match_%i_order' % i,
+                                  value=0,
+                                  lower=0,
+                                  observed=observed,
+                                  upper=len(match.players) - 1)
+
+def all_matches(matches, match_evaluator, batch=False,
+                marginalize_orders=False):
+    """
+    Create a Deterministic with the chance of each match.  With batch, a single
+    array valued Deterministic named match_probabilities evaluates every
+    match through eval_matches instead, and is the only entry in the list.
+
+    With marginalize_orders, no order variables are created and the chance
+    of a match is averaged over every order it could have been played in.
+    """
+    if marginalize_orders:
+        orders = [None] * len(matches)
+    else:
+        orders = [match_order(i, matches[i]) for i in range(len(matches))]
+    if batch:
+        def eval_func(players, winning_teams, orders, foul_ends):
+            if marginalize_orders:
+                orderings = [match_orderings(match) for match in matches]
+            else:
+                orderings = [[order] for order in orders]
+            return eval_matches(match_evaluator, players, winning_teams,
+                                foul_ends, orderings)
+
+        parents = {'players': [match.players for match in matches],
+                   'winning_teams': [match.winning_team for match in matches],
+                   'orders': orders,
+                   'foul_ends': [match.foul_end for match in matches]}
+        match_var = pm.Deterministic(eval = eval_func,
+                                     doc = 'match_probabilities',
+                                     name = 'match_probabilities',
+                                     parents = parents,
+                                     plot=False,
+                                     dtype=float)
+        return [match_var]
+
     match_vars = []
     
     for i in range(0,len(matches)):
         match=matches[i]
         match_name = 'match_%i' % i
 
-        if match.order == "unordered":
-            order = pm.DiscreteUniform('match_%i_order' % i,
-                                       lower=0,
-                                       upper=len(match.players)*2 - 1)
+        if marginalize_orders:
+            eval_func = match_evaluator.eval_with_orderings
+            parents = {'players': match.players,
+                       'winning_team': match.winning_team,
+                       'orderings': match_orderings(match),
+                       'foul_end': match.foul_end}
         else:
-            observed = match.order == "total"
-            order = pm.DiscreteUniform('match_%i_order' % i,
-                                       value=0,
-                                       lower=0,
-                                       observed=observed,
-                                       upper=len(match.players) - 1)
-
-        eval_func = match_evaluator.eval_with_order
-        parents = {'players': match.players,
-                   'winning_team': match.winning_team,
-                   'order': order,
-                   'foul_end': match.foul_end}
+            eval_func = match_evaluator.eval_with_order
+            parents = {'players': match.players,
+                       'winning_team': match.winning_team,
+                       'order': orders[i],
+                       'foul_end': match.foul_end}
         match_var = pm.Deterministic(eval = eval_func,
                                      doc = match_name,
                                      name = match_name,
@@ -281,10 +1235,193 @@ def outcomes(match_vars):
     outcome_vars = []
     
     for i in range(0,len(match_vars)):
+        # An array valued match variable, from all_matches with batch, is
+        # observed with a single array of outcomes
+        if np.ndim(match_vars[i].value) > 0:
+            observed_value = np.ones(len(match_vars[i].value), dtype=bool)
+        else:
+            observed_value = [True]
         outcome_vars.append(pm.Bernoulli('outcome_%i' % i, 
                                          match_vars[i], 
-                                         value=[True], 
+                                         value=observed_value, 
                                          observed=True, 
                                          plot=False))
 
     return outcome_vars
+
+def latent_match_orders(matches, candidate_chances):
+    """
+    Create a single array valued DiscreteUniform, named match_orders, with the
+    order of every match that wasn't totally ordered.  Return it with the
+    indices of those matches, or None and no indices when every match is
+    totally ordered.
+
+    candidate_chances(match_indices, orders) is called once, with parallel
+    arrays of every order each of those matches could have been played in.
+    It must return a function without arguments that returns the chance of
+    each of those matches in its order with the current players, which lets
+    MatchOrderGibbs update each of the orders on its own.  The totally
+    ordered matches aren't among them, so they are never evaluated for the
+    orders.
+    """
+    latent = np.array([i for (i, match) in enumerate(matches)
+                       if match.order != "total"], dtype=np.intp)
+    if len(latent) == 0:
+        return (None, latent)
+
+    upper = np.array([len(match_orderings(matches[i])) - 1 for i in latent])
+    orders = pm.DiscreteUniform('match_orders',
+                                lower=np.zeros(len(latent), dtype=int),
+                                upper=upper,
+                                value=np.zeros(len(latent), dtype=int),
+                                plot=False)
+
+    possible = np.arange(upper.max() + 1) <= upper[:, np.newaxis]
+    (rows, candidate_orders) = np.nonzero(possible)
+    chances = candidate_chances(latent[rows], candidate_orders)
+
+    def order_chances():
+        table = np.zeros(possible.shape)
+        table[possible] = chances()
+        return table
+    orders.order_chances = order_chances
+    return (orders, latent)
+
+class MatchOrderGibbs(pm.StepMethod):
+    """
+    Draws every order of the match_orders from latent_match_orders from its
+    chance given the players.  The orders only depend on each other through
+    the players, so each is drawn on its own, instead of proposing a new
+    order for every match at once as a Metropolis step on the array would.
+    """
+
+    def __init__(self, stochastic, verbose=-1):
+        pm.StepMethod.__init__(self, [stochastic], verbose=verbose)
+        self.stochastic = stochastic
+
+    @staticmethod
+    def competence(stochastic):
+        if getattr(stochastic, 'order_chances', None) is not None:
+            return 3
+        return 0
+
+    def step(self):
+        cumulative = np.cumsum(self.stochastic.order_chances(), axis=1)
+        totals = cumulative[:, -1]
+        # Matches that are impossible in every order keep the one they have
+        possible = totals > 0
+        draws = np.random.random_sample(len(totals)) * totals
+        orders = (cumulative <= draws[:, np.newaxis]).sum(axis=1)
+        value = np.copy(self.stochastic.value)
+        value[possible] = np.minimum(orders, cumulative.shape[1] - 1)[possible]
+        self.stochastic.value = value
+
+def match_likelihood(matches, match_evaluator, marginalize_orders=False,
+                     pool=None):
+    """
+    Model the outcomes of all of the matches with a single Potential, named
+    match_likelihood, instead of a Deterministic and a Bernoulli for each
+    match.  Its log-probability is the log of the chance of every match
+    outcome, summed, and is evaluated in one call to eval_matches.  The
+    orders of matches that weren't totally ordered come from a single array
+    valued DiscreteUniform, which MatchOrderGibbs updates, or with
+    marginalize_orders the chance of those matches is averaged over all of
+    their orders instead, so the sampler only sees the players.
+
+    If pool is given, the players of the matches are indices into the
+    PlayerPool instead of dicts.
+
+    Return the list of new nodes, to be added to the model with the players.
+    """
+    if pool is not None:
+        return _pool_match_likelihood(matches, match_evaluator,
+                                      marginalize_orders, pool)
+
+    def candidate_chances(match_indices, orders):
+        orderings = [[order] for order in orders]
+        def chances():
+            values = likelihood.parents.value
+            return eval_matches(match_evaluator,
+                                [values['players'][i] for i in match_indices],
+                                [values['winning_teams'][i]
+                                 for i in match_indices],
+                                [values['foul_ends'][i] for i in match_indices],
+                                orderings)
+        return chances
+
+    if marginalize_orders:
+        orders = None
+        all_orderings = [match_orderings(match) for match in matches]
+    else:
+        (orders, latent) = latent_match_orders(matches, candidate_chances)
+
+    def logp(players, winning_teams, foul_ends, orders):
+        if marginalize_orders:
+            orderings = all_orderings
+        else:
+            match_orders = np.zeros(len(players), dtype=int)
+            if orders is not None:
+                match_orders[latent] = orders
+            orderings = [[order] for order in match_orders]
+        chances = eval_matches(match_evaluator, players, winning_teams,
+                               foul_ends, orderings)
+        if np.any(chances <= 0):
+            return -pm.inf
+        return np.log(chances).sum()
+
+    parents = {'players': [match.players for match in matches],
+               'winning_teams': [match.winning_team for match in matches],
+               'foul_ends': [match.foul_end for match in matches],
+               'orders': orders}
+    likelihood = pm.Potential(logp = logp,
+                              name = 'match_likelihood',
+                              parents = parents,
+                              doc = 'match_likelihood')
+    if orders is None:
+        return [likelihood]
+    return [orders, likelihood]
+
+def _pool_match_likelihood(matches, match_evaluator, marginalize_orders, pool):
+    player_indices = [match.players for match in matches]
+    winning_teams = [match.winning_team for match in matches]
+    foul_ends = [match.foul_end for match in matches]
+
+    if marginalize_orders:
+        orders = None
+        orderings = [match_orderings(match) for match in matches]
+    else:
+        def candidate_chances(match_indices, candidate_orders):
+            candidates = IndexedMatches(
+                [player_indices[i] for i in match_indices],
+                [winning_teams[i] for i in match_indices],
+                [foul_ends[i] for i in match_indices],
+                [[order] for order in candidate_orders])
+            return lambda: candidates.eval(match_evaluator, pool.sink.value,
+                                           pool.foul_end.value)
+        (orders, latent) = latent_match_orders(matches, candidate_chances)
+        orderings = [[0]] * len(matches)
+    indexed = IndexedMatches(player_indices, winning_teams, foul_ends,
+                             orderings)
+
+    def logp(sink, foul_end, orders):
+        if marginalize_orders:
+            chances = indexed.eval(match_evaluator, sink, foul_end)
+        else:
+            match_orders = np.zeros(len(matches), dtype=int)
+            if orders is not None:
+                match_orders[latent] = orders
+            chances = indexed.eval(match_evaluator, sink, foul_end,
+                                   match_orders)
+        if np.any(chances <= 0):
+            return -pm.inf
+        return np.log(chances).sum()
+
+    likelihood = pm.Potential(logp = logp,
+                              name = 'match_likelihood',
+                              parents = {'sink': pool.sink,
+                                         'foul_end': pool.foul_end,
+                                         'orders': orders},
+                              doc = 'match_likelihood')
+    if orders is None:
+        return [likelihood]
+    return [orders, likelihood]
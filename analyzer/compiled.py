@@ -0,0 +1,218 @@
+"""
+Match evaluators backed by kernels generated from the ball-count recursion.
+
+The outcome chances are derived with sympy, but instead of simplifying and
+lambdifying them as whole expressions, the module generates straight-line
+Python source in which every intermediate value gets its own name.  The
+solved 8-ball chain is far too large to simplify, or to run cse over, in
+reasonable time, and as one expression it would be slow to evaluate.  The
+source also loads on later runs without importing sympy at all.
+
+Kernels can be cached as .py files named after a hash of the code that
+derives them, in a directory the caller chooses.  The first line of a cached
+kernel records that hash and a hash of the rest of the file, and a kernel
+that doesn't match them is derived again instead of being run.  The hashes
+are written by the same code that checks them, so they only catch stale or
+corrupted files, not changed ones.  Cached kernels are run as Python code, so
+only cache them in a directory that nobody else can write to.
+"""
+
+import analyzer.analyze as analyze
+import analyzer.files as files
+import numpy as np
+import hashlib
+import inspect
+import os
+
+def derive_kernel_source(num_players, ballsPerTeam=8):
+    """
+    Derive the chances of every match outcome as sympy expressions of the
+    players' sink and foul_end chances and return the Python source of a
+    function computing them.
+
+    The expressions come from running analyze.ball_count_outcome over sympy
+    symbols.  Every intermediate value is bound to its own symbol, and
+    identical expressions share a symbol, so the generated function is
+    straight-line arithmetic instead of one huge expression.  It is named
+    kernel, takes sequences of the sink and foul_end chances in player order
+    and returns the chances as [outcome][player who breaks], with outcomes
+    ordered as by analyze.outcome_index.
+    """
+    import sympy
+    from sympy.printing.lambdarepr import lambdarepr
+
+    sinks = sympy.symbols('sink_0:%d' % num_players)
+    foul_ends = sympy.symbols('foul_end_0:%d' % num_players)
+
+    assignments = []
+    bound = {}
+    def bind(expr):
+        if not isinstance(expr, sympy.Basic) or expr.is_Atom:
+            return expr
+        symbol = bound.get(expr)
+        if symbol is None:
+            symbol = sympy.Symbol('v%d' % len(assignments))
+            bound[expr] = symbol
+            assignments.append((symbol, expr))
+        return symbol
+
+    outcomes = []
+    for foul_end in (False, True):
+        for winning_team in (0, 1):
+            outcomes.append(analyze.ball_count_outcome(list(sinks),
+                                                       list(foul_ends),
+                                                       winning_team,
+                                                       foul_end,
+                                                       ballsPerTeam,
+                                                       bind))
+
+    def code(expr):
+        return lambdarepr(sympy.sympify(expr))
+
+    lines = ['# Generated by analyzer.compiled for %d players and %d balls '
+             'per team' % (num_players, ballsPerTeam),
+             'from __future__ import division',
+             '',
+             'def kernel(sinks, foul_ends):',
+             '    (%s,) = sinks' % ', '.join(map(str, sinks)),
+             '    (%s,) = foul_ends' % ', '.join(map(str, foul_ends))]
+    for (symbol, expr) in assignments:
+        lines.append('    %s = %s' % (symbol, code(expr)))
+    lines.append('    return [%s]' % ', '.join(
+        '[%s]' % ', '.join(code(chance) for chance in outcome)
+        for outcome in outcomes))
+    lines.append('')
+    return '\n'.join(lines)
+
+def _hash_code(digest, code):
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names))
+    for constant in code.co_consts:
+        if inspect.iscode(constant):
+            _hash_code(digest, constant)
+        else:
+            digest.update(repr(constant))
+
+def kernel_hash():
+    """
+    Return a hash of the code of the functions that derive the kernels, so
+    that kernels cached before any change to how they are derived are not
+    loaded.  The compiled code is hashed instead of the source, which isn't
+    there when only .pyc files are installed.
+    """
+    digest = hashlib.sha1()
+    for function in (derive_kernel_source, analyze.ball_count_outcome):
+        _hash_code(digest, function.func_code)
+    return digest.hexdigest()[:12]
+
+def _kernel_path(cache_dir, num_players, ballsPerTeam):
+    name = 'kernel_%s_%d_players_%d_balls.py' % (kernel_hash(), num_players,
+                                                 ballsPerTeam)
+    return os.path.join(cache_dir, name)
+
+def _kernel_file(source):
+    """
+    Return the contents of the cached kernel file for the source
+    """
+    return '# kernel %s sha1 %s\n%s' % (kernel_hash(),
+                                        hashlib.sha1(source).hexdigest(),
+                                        source)
+
+def _read_kernel(path):
+    """
+    Return the source of the kernel cached at path, or None if there isn't
+    one or it doesn't match the hashes on its first line.  The hashes are
+    only a check against corruption, not against a changed file.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as kernel_file:
+        contents = kernel_file.read()
+    source = contents.partition('\n')[2]
+    if contents != _kernel_file(source):
+        return None
+    return source
+
+def load_kernel(num_players, ballsPerTeam=8, cache_dir=None):
+    """
+    Return the kernel function for the topology.  The source is read from
+    cache_dir if an earlier run saved it there, which avoids importing sympy
+    at all.  Otherwise, or if the saved kernel doesn't match its hashes, it
+    is derived and, if cache_dir is given, saved.
+    """
+    source = None
+    path = '<kernel>'
+    if cache_dir is not None:
+        path = _kernel_path(cache_dir, num_players, ballsPerTeam)
+        source = _read_kernel(path)
+
+    if source is None:
+        source = derive_kernel_source(num_players, ballsPerTeam)
+        if cache_dir is not None:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            files.replace_file(path, _kernel_file(source))
+
+    namespace = {}
+    exec(compile(source, path, 'exec'), namespace)
+    return namespace['kernel']
+
+class CompiledMatchEvaluator(analyze.MatchEvaluator):
+    """
+    A drop-in replacement for NumericMarkovMatchEvaluator that evaluates the
+    generated kernel for the number of players.  The chances are checked
+    with analyze.checked_chances first, since the kernel doesn't check
+    them.  Kernels are only kept in
+    memory, unless cache_dir is given to save them in and load them from.
+    """
+
+    def __init__(self, ballsPerTeam=8, cache_dir=None):
+        self.ballsPerTeam = ballsPerTeam
+        self.cache_dir = cache_dir
+        self._kernels = {}
+
+    def kernel(self, num_players):
+        kernel = self._kernels.get(num_players)
+        if kernel is None:
+            kernel = load_kernel(num_players, self.ballsPerTeam,
+                                 self.cache_dir)
+            self._kernels[num_players] = kernel
+        return kernel
+
+    def eval(self, players, winning_team, foul_end):
+        return self.eval_starts(players, winning_team, foul_end)[0]
+
+    def eval_starts(self, players, winning_team, foul_end):
+        if winning_team != 0 and winning_team != 1:
+            raise ValueError("The winning_team must be either 0 or 1 " +
+                             "but was " + str(winning_team))
+        if len(players) % 2 != 0:
+            raise ValueError("The number of players must be even")
+
+        (sinks, foul_ends, misses) = analyze.checked_chances(
+            [analyze.value(player['sink']) for player in players],
+            [analyze.value(player['foul_end']) for player in players])
+        outcomes = self.kernel(len(players))(sinks.tolist(),
+                                             foul_ends.tolist())
+        return outcomes[analyze.outcome_index(winning_team, foul_end)]
+
+    def eval_batch(self, sink, foul, winning_team, order, foul_end):
+        (sink, foul, winning_team, order, foul_end) = analyze.batch_arrays(
+            sink, foul, winning_team, order, foul_end)
+        (num_matches, num_players) = sink.shape
+        if num_matches == 0:
+            return np.zeros(0)
+        analyze.checked_chances(sink, foul)
+
+        (cycles, starts, cycle_winning_team) = analyze.order_cycles(
+            num_players, winning_team, order)
+        matches = np.arange(num_matches)[:, np.newaxis]
+        outcomes = self.kernel(num_players)(list(sink[matches, cycles].T),
+                                            list(foul[matches, cycles].T))
+
+        chances = np.zeros((4, num_players, num_matches))
+        for (outcome, start_chances) in enumerate(outcomes):
+            for (start, chance) in enumerate(start_chances):
+                chances[outcome, start] = chance
+        return chances[cycle_winning_team + 2 * foul_end, starts,
+                       np.arange(num_matches)]
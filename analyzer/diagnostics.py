@@ -0,0 +1,122 @@
+import numpy as np
+
+def _check_chains(chains):
+    chains = np.asarray(chains, dtype=np.float64)
+    if chains.ndim < 2:
+        raise ValueError("The traces must have a chain and a draw axis")
+    if chains.shape[0] < 2:
+        raise ValueError("At least 2 chains are needed")
+    if chains.shape[1] < 4:
+        raise ValueError("At least 4 draws are needed in each chain")
+    return chains
+
+def _variances(chains):
+    """
+    Return the within chain variance, W, and the pooled estimate of the
+    posterior variance for the chains
+    """
+    draws = chains.shape[1]
+    between = draws * np.var(chains.mean(axis=1), axis=0, ddof=1)
+    within = np.var(chains, axis=1, ddof=1).mean(axis=0)
+    pooled = (draws - 1.) / draws * within + between / draws
+    return (within, pooled)
+
+def gelman_rubin(chains):
+    """
+    Return the Gelman-Rubin potential scale reduction factor, R-hat, of the
+    traces.  chains is an array of chains x draws, with any further axes for
+    array valued variables, which get an R-hat each.  Values close to 1 mean
+    the chains agree with each other.
+    """
+    chains = _check_chains(chains)
+    (within, pooled) = _variances(chains)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(pooled / within)
+
+def _autocovariance(chains):
+    """
+    Return the autocovariance of each chain at every lag, along the draw
+    axis, using an FFT
+    """
+    draws = chains.shape[1]
+    centered = chains - chains.mean(axis=1)[:, np.newaxis]
+    size = 2 ** int(np.ceil(np.log2(2 * draws)))
+    transform = np.fft.rfft(centered, n=size, axis=1)
+    autocovariance = np.fft.irfft(transform * np.conjugate(transform),
+                                  n=size, axis=1)[:, :draws]
+    return autocovariance / draws
+
+def effective_sample_size(chains):
+    """
+    Return the effective sample size of the traces, which are shaped as for
+    gelman_rubin.  The autocorrelations of the chains are combined and summed
+    in pairs of lags until a pair is negative, as described in Gelman et al.,
+    Bayesian Data Analysis.
+    """
+    chains = _check_chains(chains)
+    (num_chains, draws) = chains.shape[:2]
+    (within, pooled) = _variances(chains)
+    mean_autocovariance = _autocovariance(chains).mean(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rho = 1. - (within - mean_autocovariance) / pooled
+    rho[0] = 1.
+
+    return num_chains * draws / _autocorrelation_time(rho)
+
+def _autocorrelation_time(rho):
+    """
+    Return the integrated autocorrelation time for the autocorrelations rho,
+    with lags along the first axis, by summing them in pairs of lags until a
+    pair is negative
+    """
+    draws = rho.shape[0]
+    flat_rho = rho.reshape(draws, -1)
+    times = np.zeros(flat_rho.shape[1])
+    for i in range(flat_rho.shape[1]):
+        total = 0.
+        for lag in range(0, draws - 1, 2):
+            pair = flat_rho[lag, i] + flat_rho[lag + 1, i]
+            if not pair > 0:
+                break
+            total += pair
+        times[i] = 2. * total - 1. if total > 0 else np.nan
+    return times.reshape(rho.shape[1:])
+
+def split_chains(trace, pieces=2):
+    """
+    Split a single chain's trace, of draws followed by the variable's shape,
+    into pieces chains of equal length, dropping the first draws if they
+    don't divide evenly.  Comparing the pieces as separate chains detects a
+    chain that is still drifting.
+    """
+    trace = np.asarray(trace)
+    length = len(trace) // pieces
+    trace = trace[len(trace) - length * pieces:]
+    return trace.reshape((pieces, length) + trace.shape[1:])
+
+def geweke(trace, first=0.1, last=0.5):
+    """
+    Return the Geweke z-score comparing the mean of the first part of a single
+    chain's trace with the mean of its last part.  Scores far from 0, in
+    either direction, mean the chain hadn't settled by the start.  The
+    variances of the means account for the autocorrelation of each part.
+    """
+    trace = np.asarray(trace, dtype=np.float64)
+    start = trace[:int(first * len(trace))]
+    end = trace[len(trace) - int(last * len(trace)):]
+    if len(start) < 2 or len(end) < 2:
+        raise ValueError("The trace is too short for the Geweke diagnostic")
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (start.mean(axis=0) - end.mean(axis=0)) / np.sqrt(
+            _variance_of_mean(start) + _variance_of_mean(end))
+
+def _variance_of_mean(trace):
+    """
+    Return the variance of the mean of a single chain's trace, inflated by
+    its autocorrelation time
+    """
+    autocovariance = _autocovariance(trace[np.newaxis])[0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rho = autocovariance / autocovariance[0]
+    return autocovariance[0] * _autocorrelation_time(rho) / len(trace)
@@ -0,0 +1,34 @@
+import os
+import stat
+import tempfile
+
+def file_mode(path):
+    """
+    Return the permissions of the file at path, or those of a new file under
+    the current umask if there isn't one
+    """
+    if os.path.exists(path):
+        return stat.S_IMODE(os.stat(path).st_mode)
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0666 & ~umask
+
+def replace_file(path, contents):
+    """
+    Write contents to the file at path, keeping its permissions if it exists.
+    The contents go to a temporary file in the same directory first, which is
+    then renamed over path, so a failed write never loses the old file and
+    nothing ever reads a partial one.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    mode = file_mode(path)
+    (fd, temp_path) = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as temp_file:
+            temp_file.write(contents)
+        # mkstemp makes the file readable only by its owner
+        os.chmod(temp_path, mode)
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
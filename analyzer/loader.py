@@ -1,5 +1,7 @@
 import simplejson as json
 import analyzer.analyze as analyze
+import analyzer.posterior as posterior
+import numpy as np
 import itertools
 
 def zip_lists(list_a, list_b):
@@ -39,12 +41,20 @@ def json_to_match(player_lookup, match):
             
     return analyze.Match(players, winning_team, ordered, foul_end)
 
-def json_to_matches(matches_json):
+def json_to_matches(matches_json, summary=None):
+    """
+    Load the matches with a new player for each name.  Players in summary,
+    an analyzer.posterior summary of an earlier run, start from their
+    posterior and use it as their prior.
+    """
     players_for_each_match = map(players_from_match, matches_json)
     all_player_names = set(itertools.chain(*players_for_each_match))
     player_lookup = {}
     for name in all_player_names:
-        player_lookup[name] = analyze.new_player(name)
+        arguments = {}
+        if summary is not None:
+            arguments = posterior.player_arguments(summary, name)
+        player_lookup[name] = analyze.new_player(name, **arguments)
         
     matches = []
     for match in matches_json:
@@ -52,3 +62,45 @@ def json_to_matches(matches_json):
         matches.append(newMatch)
 
     return matches
+
+def pool_arguments(summary, names):
+    """
+    Return the keyword arguments of analyze.PlayerPool that start each of
+    the players in the summary from their posterior, with it as their prior.
+    The other players get the pool's defaults.
+    """
+    count = len(names)
+    (sink, foul) = ([analyze.DEFAULT_SINK] * count,
+                    [analyze.DEFAULT_FOUL] * count)
+    (sink_prior, foul_prior) = ([analyze.DEFAULT_PRIOR] * count,
+                                [analyze.DEFAULT_PRIOR] * count)
+    for (i, name) in enumerate(names):
+        arguments = posterior.player_arguments(summary, name)
+        if arguments:
+            sink[i] = arguments['sink']
+            foul[i] = arguments['foul']
+            sink_prior[i] = arguments['sink_prior']
+            foul_prior[i] = arguments['foul_prior']
+    return {'sink': np.array(sink), 'foul': np.array(foul),
+            'sink_prior': tuple(np.array(sink_prior, dtype=float).T),
+            'foul_prior': tuple(np.array(foul_prior, dtype=float).T)}
+
+def json_to_pool_matches(matches_json, summary=None):
+    """
+    Load the matches with all of the players in a single analyze.PlayerPool.
+    The players of each match are their indices in the pool.  Players in
+    summary start from their posterior and use it as their prior, as with
+    json_to_matches.  Return the pool and the matches.
+    """
+    players_for_each_match = map(players_from_match, matches_json)
+    all_player_names = sorted(set(itertools.chain(*players_for_each_match)))
+    arguments = {}
+    if summary is not None:
+        arguments = pool_arguments(summary, all_player_names)
+    pool = analyze.PlayerPool(all_player_names, **arguments)
+
+    matches = []
+    for match in matches_json:
+        matches.append(json_to_match(pool.index_by_name, match))
+
+    return (pool, matches)
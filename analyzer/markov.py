@@ -1,35 +1,57 @@
 import numpy as np
 import numpy.linalg as npl
+import collections
 import sys
 
 npf64_zero = np.float64(0.)
 npf64_one = np.float64(1.)
 
+def check_chances(chances):
+    """
+    Return the transition chances as a float64 array, after checking that
+    none of them is NaN, less than 0 or greater than 1
+    """
+    checked = np.asarray(chances, np.float64)
+    # NaN fails every comparison, so it is checked for separately
+    if checked.size > 0 and (np.isnan(checked).any() or
+                             checked.min() < npf64_zero or
+                             checked.max() > npf64_one):
+        raise Exception("The chance of the state transition must not be " +
+                        "NaN, less than 0 or greater than 1, but " +
+                        repr(chances) + " was provided")
+    return checked
+
 class Chain(object):
     def __init__(self):
         self.matrix = None
         self.states = {}
         self.states_by_label = {}
+        # The states in index order
+        self.state_list = []
+        # True while the state containers are shared with another chain
+        self._shared_states = False
+        self._workspaces = {}
 
-    def _create_matrix(self):
+    def _create_matrix(self, size=1):
         """
-        Create a 1x1 matrix with the initial value of 0.  Return the
+        Create a size x size matrix with the initial values of 0.  Return the
         newly created matrix
         """
-        return np.matrix(np.array([0]), np.float64)
+        return np.zeros((size, size), np.float64)
 
-    def _grow_matrix(self, matrix):
+    def _grow_matrix(self, matrix, count=1):
         """
-        Increase the size of the matrix by one row and one column without
-        disturbing the rest of the matrix.  The new elements should all 
-        default to a 0 value.
+        Increase the size of the matrix by count rows and count columns
+        without disturbing the rest of the matrix.  The new elements should
+        all default to a 0 value.
 
         Return the newly grown matrix.  It is ok to modify the matrix object
         in place and return that for efficiency.
         """
-        (x,y) = matrix.shape
-        matrix.resize((x+1,y+1), refcheck=False)
-        return matrix
+        size = self._matrix_size(matrix)
+        grown = self._create_matrix(size + count)
+        grown[:size,:size] = matrix
+        return grown
 
     def _matrix_size(self, matrix):
         """
@@ -38,27 +60,80 @@ class Chain(object):
         (x,y) = matrix.shape
         return x
 
-    def new_state(self, label=None):
-        new_state = State(label)
-        if label is not None:
-            if label in self.states_by_label:
+    @classmethod
+    def with_states(cls, labels):
+        """
+        Create a chain with a state for each of the labels, allocating the
+        matrix for all of them at once
+        """
+        chain = cls()
+        chain.new_states(labels)
+        return chain
+
+    def new_states(self, labels):
+        """
+        Create a new state for each of the labels and return the new states in
+        the same order.  The matrix is only grown once, no matter how many
+        states are created.
+        """
+        labels = list(labels)
+        new_labels = set()
+        for label in labels:
+            if label is None:
+                continue
+            if label in self.states_by_label or label in new_labels:
                 label_str = str(label)
                 raise ValueError("The state label " + label_str + " is " + 
                                  "already taken")
-        
-            self.states_by_label[label] = new_state
+            new_labels.add(label)
+
+        if len(labels) == 0:
+            return []
 
-        new_index = 0
+        if self._shared_states:
+            self.states = dict(self.states)
+            self.states_by_label = dict(self.states_by_label)
+            self.state_list = list(self.state_list)
+            self._shared_states = False
 
         if self.matrix is None:
-            self.matrix = self._create_matrix() 
+            first_index = 0
+            self.matrix = self._create_matrix(len(labels))
         else:
-            new_index = self._matrix_size(self.matrix)
-            self.matrix = self._grow_matrix(self.matrix)
+            first_index = self._matrix_size(self.matrix)
+            self.matrix = self._grow_matrix(self.matrix, len(labels))
+
+        new_states = []
+        for (offset, label) in enumerate(labels):
+            new_state = State(label)
+            if label is not None:
+                self.states_by_label[label] = new_state
+            new_state.index = first_index + offset
+            self.states[new_state] = new_state.index
+            self.state_list.append(new_state)
+            new_states.append(new_state)
+
+        return new_states
+
+    def new_state(self, label=None):
+        return self.new_states([label])[0]
 
-        new_state.index = new_index
-        self.states[new_state] = new_index
-        return new_state
+    def empty_copy(self):
+        """
+        Return a new chain with the same states as this chain but without any
+        transitions.  The State objects and the maps from labels and indices
+        to them are shared between the two chains until either one adds a
+        state, so the copy costs nothing per state.
+        """
+        chain = self.__class__()
+        chain.states = self.states
+        chain.states_by_label = self.states_by_label
+        chain.state_list = self.state_list
+        chain._shared_states = True
+        self._shared_states = True
+        if self.matrix is not None:
+            chain.matrix = self._create_matrix(self._matrix_size(self.matrix))
+        return chain
 
     def is_absorbing(self):
         """
@@ -71,103 +146,108 @@ class Chain(object):
         (absorbing, transient, unknown) = self._analyze_for_absorbing()
         return len(unknown) == 0
 
+    def _reachability(self):
+        """
+        Return boolean arrays that are True for the index of every absorbing
+        state and of every state that can reach an absorbing state.  The
+        states that reach one are found with a breadth first search backwards
+        along the transitions, which visits every transition once.
+        """
+        (from_indices, to_indices) = self._transitions()
+        size = 0 if self.matrix is None else self._matrix_size(self.matrix)
+        absorbing = np.ones(size, bool)
+        absorbing[from_indices] = False
+
+        # The states with a transition into state are
+        # predecessors[starts[state]:starts[state + 1]]
+        order = np.argsort(to_indices, kind='mergesort')
+        predecessors = from_indices[order].tolist()
+        starts = np.zeros(size + 1, np.intp)
+        np.cumsum(np.bincount(to_indices, minlength=size), out=starts[1:])
+        starts = starts.tolist()
+
+        reached = absorbing.tolist()
+        queue = collections.deque(np.flatnonzero(absorbing).tolist())
+        while queue:
+            state = queue.popleft()
+            for predecessor in predecessors[starts[state]:starts[state + 1]]:
+                if not reached[predecessor]:
+                    reached[predecessor] = True
+                    queue.append(predecessor)
+        return (absorbing, np.array(reached, bool))
+
+    def _checked_absorbing_mask(self):
+        """
+        Return the same array as _absorbing_mask, after checking that every
+        state can reach an absorbing state so that the chain can be solved
+        """
+        (absorbing, reached) = self._reachability()
+        if not reached.all():
+            raise _not_absorbing_error(
+                [self.state_list[index]
+                 for index in np.flatnonzero(np.logical_not(reached))])
+        return absorbing
+
     def _analyze_for_absorbing(self):
-        absorbing_states = set([state for state in self.states
-                                if self._is_absorbing_state(state)])
-        
-        transient_states = set()
-        
-        progress=True
-        while progress:
-            unknown_states = set(self.states) - absorbing_states \
-                             - transient_states
-            known_states = absorbing_states | transient_states
-            progress=False
-            for state in unknown_states:
-                for known in known_states:
-                    trans = self.get_transition(state, known)
-                    if not self._is_zero(trans):
-                        transient_states.add(state)
-                        progress=True
-                        break
-       
-        return (absorbing_states, transient_states, unknown_states)
-        
-    def _swap_indices(self, matrix, index1, index2):
-        # Swap rows
-        temp = np.copy(matrix[index2,:])
-        matrix[index2,:] = matrix[index1,:]
-        matrix[index1,:] = temp
-        
-        # Swap columns
-        temp = np.copy(matrix[:,index2])
-        matrix[:,index2] = matrix[:,index1]
-        matrix[:,index1] = temp
-        
-    def _inverse(self, matrix):
-        return npl.inv(matrix)
+        """
+        Split the states into absorbing states, transient states that can
+        reach an absorbing state and unknown states that never can
+        """
+        (absorbing, reached) = self._reachability()
+
+        def states_for(mask):
+            return set(self.state_list[index] for index in np.flatnonzero(mask))
+
+        return (states_for(absorbing),
+                states_for(reached & np.logical_not(absorbing)),
+                states_for(np.logical_not(reached)))
         
     def _eye(self, size):
         return np.eye(size)
-                
-    def get_absorbing_probabilities(self):
+
+    def get_absorbing_probabilities_array(self):
+        """
+        Return the transient states, the absorbing states, both ordered by
+        index, and an array where element [t, a] is the chance of ending in
+        absorbing state a when starting in transient state t.
+
+        The canonical form is taken with a single permutation of the matrix,
+        and the chances come from an LU solve against (I - Q)^T instead of
+        inverting I - Q.
+        """
         (absorbing, transient, unknown) = self._analyze_for_absorbing()
         if len(unknown) != 0:
-            raise Error("The matrix is not an absorbing matrix")
-        
+            raise _not_absorbing_error(unknown)
+
+        transient_states = sorted(transient, key=lambda s: s.index)
+        absorbing_states = sorted(absorbing, key=lambda s: s.index)
+        permutation = [s.index for s in transient_states + absorbing_states]
+
         matrix = self._fill_in_diagonal_transistions(self.matrix)
-            
-        state_to_index = {}
-        index_to_state = {}
-        for state in self.states:
-            state_to_index[state] = state.index
-            index_to_state[state.index] = state
-            
-        cannonical = matrix.copy()
-
-        def move_state_to_index(s, new_index):
-            old_index = state_to_index[s]
-            old_state = index_to_state[new_index]
-            index_to_state[new_index] = s
-            state_to_index[s] = new_index
-            index_to_state[old_index] = old_state
-            state_to_index[old_state] = old_index
-            self._swap_indices(cannonical, new_index, old_index)
-
-        new_index = 0
-        for s in transient:
-            move_state_to_index(s, new_index)
-            new_index = new_index + 1
-
-        for a in absorbing:
-            move_state_to_index(a, new_index)
-            new_index = new_index + 1
-            
-        trans_count = len(transient)
+        cannonical = matrix[np.ix_(permutation, permutation)]
+
+        trans_count = len(transient_states)
         q = cannonical[:trans_count,:trans_count]
-        fund = self._inverse(self._eye(trans_count) - q)
         r = cannonical[trans_count:,:trans_count]
-        
-        probs = (r * fund)
+        if trans_count == 0:
+            probs = np.zeros((0, len(absorbing_states)))
+        else:
+            probs = npl.solve((self._eye(trans_count) - q).T, r.T)
+        return (transient_states, absorbing_states, probs)
+
+    def get_absorbing_probabilities(self):
+        (transient_states, absorbing_states, probs) = \
+            self.get_absorbing_probabilities_array()
         result = {}
-        for t in transient:
-            result[t] = {}
-            for a in absorbing:
-                absorbing_index=state_to_index[a]-trans_count
-                result[t][a] = probs[absorbing_index, state_to_index[t]] 
+        for (t, transient_state) in enumerate(transient_states):
+            result[transient_state] = dict(zip(absorbing_states, probs[t]))
         return result
-                
 
     def _is_zero(self, trans):
         return np.float64(trans) == self._get_zero()
         
     def _is_absorbing_state(self, state):
-        for end_state in [x for x in self.states if x != state]:
-            trans = self.get_transition(state, end_state) 
-            if not self._is_zero(trans):
-                return False
-                
-        return True
+        return bool(self._absorbing_mask()[self.states[state]])
             
     def get_state(self, label):
         if label in self.states_by_label:
@@ -179,13 +259,7 @@ class Chain(object):
         return npf64_zero
 
     def _set_transition(self, matrix, row, col, chance):
-        npf64_chance = np.float64(chance)
-        if npf64_chance < npf64_zero or npf64_chance > npf64_chance:
-            raise Exception("The chance of the state transition must not be " +
-                            "less than 0 or greater than 1, but the value " + 
-                            repr(chance) + " was provided")
-        
-        matrix[row, col] = npf64_chance
+        matrix[row, col] = np.float64(check_chances(chance))
         
     def set_transition(self, from_state, to_state, chance):
         if from_state.index == to_state.index:
@@ -194,6 +268,49 @@ class Chain(object):
         self._set_transition(self.matrix, to_state.index,
                              from_state.index, chance)
 
+    def _set_transitions(self, matrix, rows, cols, chances):
+        matrix[rows, cols] = check_chances(chances)
+
+    def set_transitions(self, from_indices, to_indices, chances):
+        """
+        Set many transitions at once.  The arguments are parallel arrays of
+        the state index each transition leaves, the state index it enters and
+        its chance.  The whole batch is validated before anything is changed.
+        """
+        from_indices = np.asarray(from_indices, np.intp)
+        to_indices = np.asarray(to_indices, np.intp)
+        if from_indices.shape != to_indices.shape:
+            raise ValueError("The from_indices and to_indices must be the " +
+                             "same shape")
+        if np.any(from_indices == to_indices):
+            raise Exception("The from_state and to_state much be different")
+
+        size = 0 if self.matrix is None else self._matrix_size(self.matrix)
+        for indices in (from_indices, to_indices):
+            if np.any(indices < 0) or np.any(indices >= size):
+                raise Exception("The state indices must be part of this " +
+                                "chain")
+
+        self._set_transitions(self.matrix, to_indices, from_indices, chances)
+
+    def set_known_transitions(self, from_indices, to_indices, chances):
+        """
+        The same as set_transitions for index arrays that are already known
+        to join different states of this chain, such as the edges of a chain
+        template, so only the chances are checked
+        """
+        self._set_transitions(self.matrix, to_indices, from_indices, chances)
+
+    def replace_transitions(self, from_indices, to_indices, chances):
+        """
+        Replace every transition of the chain with the given ones, which are
+        known to join different states as for set_known_transitions.  The
+        matrix is set to 0 and filled in place, without allocating a new one.
+        """
+        chances = check_chances(chances)
+        self.matrix.fill(npf64_zero)
+        self.matrix[to_indices, from_indices] = chances
+
     def get_transition(self, from_state, to_state):
         if from_state not in self.states:
             raise Exception("The from_state is not part of this chain")
@@ -206,12 +323,23 @@ class Chain(object):
         to_index = self.states[to_state]
         return self.matrix[to_index,from_index]
 
-    def _create_start_vector(self, start_state=None):
-        (rows,cols) = self.matrix.shape
+    def _workspace(self, name, shape):
+        """
+        Return a scratch array that is kept between calls and only allocated
+        again when the shape changes.  Its contents are whatever the last user
+        left in it.  Every chain has its own scratch arrays and the public
+        methods never return one, so their results stay valid after later
+        calls, but a chain can't be used by several threads at once.
+        """
+        workspace = self._workspaces.get(name)
+        if workspace is None or workspace.shape != shape:
+            workspace = np.empty(shape, np.float64)
+            self._workspaces[name] = workspace
+        return workspace
 
-        pi = np.matrix(np.ones(rows), np.float64)
-        # Use copy() to ensure that pi is a C-continuous matrix and not a view
-        pi = pi.transpose().copy()
+    def _create_start_vector(self, start_state=None):
+        rows = self._matrix_size(self.matrix)
+        pi = self._workspace('pi', (rows,))
 
         if start_state is not None:
             if isinstance(start_state, dict):
@@ -220,9 +348,9 @@ class Chain(object):
                                     "probabilities must add up to 1")
                 
                 
-                pi = pi * 0.
+                pi.fill(npf64_zero)
                 for start in start_state:
-                    pi[self.states[start], 0] = start_state[start]
+                    pi[self.states[start]] = start_state[start]
 
             else:
                 if start_state not in self.states:
@@ -230,60 +358,61 @@ class Chain(object):
             
                 # Build an initial distribution vector based on the 
                 # starting state provided
-                pi = pi * 0.
-                pi[self.states[start_state], 0] = 1.
+                pi.fill(npf64_zero)
+                pi[self.states[start_state]] = npf64_one
         else:
             # Build an initial distribution with an even distribution
             # across all states
-            pi = pi * (1./rows)
+            pi.fill(npf64_one / rows)
         
         return pi
 
 
     def find_state_by_index(self, index):
-        for (state, i) in self.states.items():
-            if index == i:
-                return state
+        if 0 <= index < len(self.state_list):
+            return self.state_list[index]
         return None
 
-    def _raise_error_for_column_greater_than_one(self, cols, col_sums):
-        for col in range(cols):
-            sum = col_sums[0, col]
-            if sum > npf64_one:
-                if (sum - sys.float_info.epsilon) > npf64_one:
-                    col_state = self.find_state_by_index(col)
-                    raise Exception("The probabilities for transtion " + 
-                                    "from state " + str(col_state) + " are " +
-                                    repr(trans[:,col]) + " total " + repr(sum) +
-                                    " which is larger than 1")
-        
+    def _raise_error_for_column_greater_than_one(self, trans, col_sums):
+        for col in np.flatnonzero(col_sums > npf64_one):
+            sum = col_sums[col]
+            if (sum - sys.float_info.epsilon) > npf64_one:
+                col_state = self.find_state_by_index(col)
+                raise Exception("The probabilities for transtion " + 
+                                "from state " + str(col_state) + " are " +
+                                repr(np.asarray(trans[:,col]).ravel()) +
+                                " total " + repr(sum) +
+                                " which is larger than 1")
 
     def _fill_in_diagonal_transistions(self, trans):
-        # Make a copy of the matrix before it's modified
-        trans = self.matrix.copy()
-
+        # Work on a copy so the matrix itself isn't modified, reusing the
+        # same buffer every call
         (rows,cols) = self.matrix.shape
+        trans = self._workspace('filled', (rows, cols))
+        np.copyto(trans, self.matrix)
         
         # Verify transition probiblites and calculate the diagonal
         np.fill_diagonal(trans, npf64_zero)
-        col_sums = np.squeeze(np.asarray(np.sum(trans, axis=0)))
+        col_sums = np.sum(trans, axis=0, out=self._workspace('sums', (cols,)))
         max = col_sums.max()
         if max > npf64_one:
             if (max - sys.float_info.epsilon) > npf64_one:
-                self._raise_error_for_column_greater_than_one(cols, col_sums)
+                self._raise_error_for_column_greater_than_one(trans, col_sums)
         
-        new_diags = npf64_one - col_sums
-        trans[np.diag_indices(cols)] = new_diags
+        np.subtract(npf64_one, col_sums, out=col_sums)
+        np.fill_diagonal(trans, col_sums)
         
         return trans
 
     def _iterate_until_stable(self, trans, start_state, threshold=10e-10):
         state = self._create_start_vector(start_state)
-        state_temp = state.copy()
+        state_temp = self._workspace('state', state.shape)
+        difference = self._workspace('difference', state.shape)
         while True:
             np.dot(trans, state, state_temp)
             np.dot(trans, state_temp, state)
-            if np.linalg.norm(state-state_temp) < threshold:
+            np.subtract(state, state_temp, difference)
+            if np.sqrt(np.dot(difference, difference)) < threshold:
                 break
         
         return state
@@ -299,33 +428,152 @@ class Chain(object):
         result = {}
         for state in self.states:
             state_index = self.states[state]
-            result[state] = steady_state[state_index,0]
+            result[state] = steady_state[state_index]
             
         return result
 
-    def get_end_states(self):
+    def _transitions(self):
         """
-        Return the states that have no outgoing transistions
+        Return parallel arrays of the from and to state indices of every
+        non-zero transition between different states
         """
-        end_states = []
-        for start in self.states:
-            is_end = True
-            for end in self.states:
-                if end == start:
-                    continue
+        if self.matrix is None:
+            return (np.zeros(0, np.intp), np.zeros(0, np.intp))
+        outgoing = self.matrix != npf64_zero
+        np.fill_diagonal(outgoing, False)
+        (to_indices, from_indices) = np.nonzero(outgoing)
+        return (from_indices, to_indices)
 
-                if self.get_transition(start,end) != self._get_zero():
-                    is_end = False
-                    break
-            
-            if is_end:
-                end_states.append(start)
+    def _absorbing_mask(self):
+        """
+        Return a boolean array that is True for the index of every state
+        without outgoing transitions
+        """
+        size = 0 if self.matrix is None else self._matrix_size(self.matrix)
+        absorbing = np.ones(size, bool)
+        absorbing[self._transitions()[0]] = False
+        return absorbing
 
-        return end_states 
+    def absorption_distribution(self, start_state=None, check=False):
+        """
+        Return a map of states to the chance of the chain ending in them when
+        it begins at start_state, which can be anything steady_state accepts.
+        The chain must be absorbing, so only absorbing states end up with a
+        non-zero chance.
+
+        Instead of iterating until the distribution settles, the chances are
+        found with a single linear solve against the transient states, so the
+        result is exact and the work doesn't depend on how slowly the chain
+        converges.
+
+        With check, every state is checked to reach an absorbing state before
+        solving.  Otherwise that is only looked into when the solve fails,
+        which saves a walk over the whole chain for chains that are known to
+        be absorbing.
+        """
+        distribution = self._absorb(self._create_start_vector(start_state),
+                                    check)
+
+        result = {}
+        for state in self.states:
+            result[state] = distribution[self.states[state]]
+
+        return result
+
+    def absorption_vector(self, start_index, check=False):
+        """
+        The same as absorption_distribution for a single start state, but the
+        start state is given by index and the chances are returned as an array
+        indexed by state index
+        """
+        return self.absorption_vectors([start_index], check)[:,0]
+
+    def absorption_vectors(self, start_indices, check=False):
+        """
+        The same as absorption_vector for several start states at once.  Column
+        i of the returned array holds the chances for start_indices[i], and all
+        of the columns come from a single solve.
+        """
+        pi = np.zeros((self._matrix_size(self.matrix), len(start_indices)))
+        pi[start_indices, np.arange(len(start_indices))] = npf64_one
+        return self._absorb(pi, check)
+
+    def _absorb(self, pi, check=False):
+        """
+        Return the distribution over the absorbing states the chain ends in
+        when it starts from pi, checking that the chain is absorbing first if
+        check is given.  I - Q, R and the right hand side are built in
+        scratch arrays, so only the result is allocated once the shapes have
+        been seen.
+        """
+        if check:
+            mask = self._checked_absorbing_mask()
+        else:
+            mask = self._absorbing_mask()
+        trans = self._fill_in_diagonal_transistions(self.matrix)
+        absorbing = np.flatnonzero(mask)
+        transient = np.flatnonzero(np.logical_not(mask))
+        size = len(trans)
+        extra = pi.shape[1:]
+
+        distribution = np.zeros(pi.shape)
+        distribution[absorbing] = pi[absorbing]
+        if len(transient) > 0:
+            transient_rows = self._workspace('transient_rows',
+                                             (len(transient), size))
+            system = self._workspace('system',
+                                     (len(transient), len(transient)))
+            np.take(trans, transient, axis=0, out=transient_rows)
+            np.take(transient_rows, transient, axis=1, out=system)
+            np.negative(system, out=system)
+            system.flat[::len(transient) + 1] += npf64_one
+
+            absorbing_rows = self._workspace('absorbing_rows',
+                                             (len(absorbing), size))
+            r = self._workspace('r', (len(absorbing), len(transient)))
+            np.take(trans, absorbing, axis=0, out=absorbing_rows)
+            np.take(absorbing_rows, transient, axis=1, out=r)
+
+            rhs = self._workspace('rhs', (len(transient),) + extra)
+            np.take(pi, transient, axis=0, out=rhs)
+            try:
+                visits = npl.solve(system, rhs)
+            except npl.LinAlgError:
+                # I - Q is singular when some states never reach an absorbing
+                # state, so name them if that's why
+                self._checked_absorbing_mask()
+                raise
+            absorbed = self._workspace('absorbed', (len(absorbing),) + extra)
+            np.dot(r, visits, out=absorbed)
+            distribution[absorbing] += absorbed
+
+        return distribution
+
+    def get_end_states(self):
+        """
+        Return the states that have no outgoing transistions
+        """
+        absorbing = self._absorbing_mask()
+        return [state for state in self.states if absorbing[self.states[state]]]
                 
+def _not_absorbing_error(unknown):
+    """
+    Return the ValueError for a chain where the unknown states can never
+    reach an absorbing state
+    """
+    labels = sorted(str(state) for state in unknown)
+    if len(labels) > 5:
+        labels = labels[:5] + ['...']
+    return ValueError("The matrix is not an absorbing matrix, because " +
+                      str(len(unknown)) + " states never reach an " +
+                      "absorbing state: " + ", ".join(labels))
+
 class State(object):
+    __slots__ = ('label', 'index')
+
     def __init__(self, label=None):
         self.label = label
+        self.index = None
     
     def __str__(self):
         if self.label is not None:
@@ -0,0 +1,158 @@
+import analyzer.markov as markov
+import numpy as np
+import scipy.sparse as sps
+import scipy.sparse.linalg as spsl
+import sys
+import warnings
+
+class Chain(markov.Chain):
+    """
+    A numeric chain that keeps its transitions in a scipy sparse matrix.  A
+    match chain only has a few transitions out of each state, so memory and
+    solve time grow with the number of transitions instead of the square and
+    cube of the number of states.
+    """
+
+    def _create_matrix(self, size=1):
+        return sps.lil_matrix((size, size), dtype=np.float64)
+
+    def _grow_matrix(self, matrix, count=1):
+        size = self._matrix_size(matrix) + count
+        coo = matrix.tocoo()
+        return sps.coo_matrix((coo.data, (coo.row, coo.col)),
+                              shape=(size, size)).tolil()
+
+    def replace_transitions(self, from_indices, to_indices, chances):
+        """
+        Replace every transition of the chain with the given ones, building
+        a CSC matrix straight from them instead of filling in a lil_matrix
+        """
+        chances = markov.check_chances(chances)
+        size = self._matrix_size(self.matrix)
+        self.matrix = sps.csc_matrix((chances, (to_indices, from_indices)),
+                                     shape=(size, size))
+
+    def _make_editable(self):
+        """
+        Turn the matrix back into a lil_matrix, which is the fastest to set
+        transitions in one at a time, if replace_transitions built another
+        format
+        """
+        if self.matrix is not None and not sps.isspmatrix_lil(self.matrix):
+            self.matrix = self.matrix.tolil()
+
+    def set_transition(self, from_state, to_state, chance):
+        self._make_editable()
+        markov.Chain.set_transition(self, from_state, to_state, chance)
+
+    def set_transitions(self, from_indices, to_indices, chances):
+        self._make_editable()
+        markov.Chain.set_transitions(self, from_indices, to_indices, chances)
+
+    def set_known_transitions(self, from_indices, to_indices, chances):
+        self._make_editable()
+        markov.Chain.set_known_transitions(self, from_indices, to_indices,
+                                           chances)
+
+    def _off_diagonal(self):
+        """
+        Return the transitions between different states as a CSC matrix
+        without any stored zeros
+        """
+        coo = self.matrix.tocoo()
+        keep = (coo.row != coo.col) & (coo.data != markov.npf64_zero)
+        return sps.csc_matrix((coo.data[keep], (coo.row[keep], coo.col[keep])),
+                              shape=coo.shape)
+
+    def _fill_in_diagonal_transistions(self, trans):
+        trans = self._off_diagonal()
+        col_sums = np.asarray(trans.sum(axis=0)).ravel()
+        size = self._matrix_size(trans)
+        if size > 0:
+            max = col_sums.max()
+            if max > markov.npf64_one:
+                if (max - sys.float_info.epsilon) > markov.npf64_one:
+                    self._raise_error_for_column_greater_than_one(
+                        trans.toarray(), col_sums)
+
+        return (trans + sps.diags([markov.npf64_one - col_sums], [0])).tocsc()
+
+    def _transitions(self):
+        trans = self._off_diagonal().tocoo()
+        return (trans.col, trans.row)
+
+    def _solve(self, matrix, rhs):
+        """
+        Solve matrix * x = rhs with a sparse direct solver, raising a
+        ValueError if the solution isn't finite, which happens when the chain
+        isn't absorbing or the solve itself broke down.
+        """
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            solution = spsl.spsolve(matrix.tocsc(), rhs)
+        if sps.issparse(solution):
+            solution = solution.toarray()
+        solution = np.asarray(solution).reshape(rhs.shape)
+        if not np.all(np.isfinite(solution)):
+            raise ValueError("The absorbing chances could not be solved for")
+        return solution
+
+    def _transient_blocks(self, check=True):
+        """
+        Return the masks of the absorbing and transient states with the Q and
+        R blocks of the canonical form, after checking that the chain is
+        absorbing if check is given
+        """
+        if check:
+            absorbing = self._checked_absorbing_mask()
+        else:
+            absorbing = self._absorbing_mask()
+        trans = self._fill_in_diagonal_transistions(self.matrix)
+        transient = np.logical_not(absorbing)
+        transient_indices = np.flatnonzero(transient)
+        q = trans[transient_indices][:, transient_indices]
+        r = trans[np.flatnonzero(absorbing)][:, transient_indices]
+        return (absorbing, transient, q, r)
+
+    def _absorb(self, pi, check=False):
+        (absorbing, transient, q, r) = self._transient_blocks(check)
+
+        distribution = np.zeros(pi.shape)
+        distribution[absorbing] = pi[absorbing]
+        if transient.any():
+            identity = sps.identity(q.shape[0], format='csc')
+            try:
+                visits = self._solve(identity - q, pi[transient])
+            except ValueError:
+                # Name the states that never reach an absorbing state if
+                # that's why the solve failed
+                self._checked_absorbing_mask()
+                raise
+            distribution[absorbing] += r.dot(visits)
+
+        return distribution
+
+    def get_absorbing_probabilities_array(self):
+        (absorbing, transient, q, r) = self._transient_blocks()
+        absorbing_states = [self.state_list[index]
+                            for index in np.flatnonzero(absorbing)]
+        transient_states = [self.state_list[index]
+                            for index in np.flatnonzero(transient)]
+        if len(transient_states) == 0:
+            return (transient_states, absorbing_states,
+                    np.zeros((0, len(absorbing_states))))
+
+        # Row t of (R (I - Q)^-1)^T holds the chances for transient state t
+        identity = sps.identity(q.shape[0], format='csc')
+        probs = self._solve((identity - q).T, r.T.toarray())
+        return (transient_states, absorbing_states, probs)
+
+    def _iterate_until_stable(self, trans, start_state, threshold=10e-10):
+        state = self._create_start_vector(start_state)
+        while True:
+            state_temp = trans.dot(state)
+            state = trans.dot(state_temp)
+            if np.linalg.norm(state-state_temp) < threshold:
+                break
+
+        return state
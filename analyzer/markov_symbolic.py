@@ -1,60 +1,233 @@
 import analyzer.markov as markov
+import numpy as np
 import sympy
 from sympy.matrices import SparseMatrix
 
 class Chain(markov.Chain):
     
-    def _create_matrix(self):
-        return SparseMatrix([0])
+    def _create_matrix(self, size=1):
+        return SparseMatrix(size, size, {})
 
-    def _grow_matrix(self, matrix):
-        new_row = sympy.zeros(1, matrix.cols)
-        matrix = matrix.row_insert(matrix.rows, new_row)
-        new_col = sympy.zeros(matrix.rows, 1)
-        matrix = matrix.col_insert(matrix.cols, new_col)
-        return matrix
+    def _elements(self, matrix):
+        """
+        Return the non-zero elements of the matrix as a dict of (row, col) to
+        value, which is cheap to edit and build a new matrix from
+        """
+        return dict(((row, col), value)
+                    for (row, col, value) in matrix.row_list())
+
+    def _grow_matrix(self, matrix, count=1):
+        size = matrix.cols + count
+        return SparseMatrix(size, size, self._elements(matrix))
 
     def _matrix_size(self, matrix):
         return matrix.cols
 
     def _zero_diagnoal(self, matrix):
-        matrix = matrix.copy()
+        elements = self._elements(matrix)
         for row in range(matrix.rows):
-            matrix[row, row] = 0
-        return matrix
+            elements.pop((row, row), None)
+        return SparseMatrix(matrix.rows, matrix.cols, elements)
         
     def _fill_in_diagonal_transistions(self, trans):
-        matrix = self._zero_diagnoal(self.matrix)
-        for col in range(matrix.cols):
-            matrix[col, col] = 1 - sum(matrix[:,col])
-        return matrix
+        elements = self._elements(self.matrix)
+        col_sums = [0] * self.matrix.cols
+        for ((row, col), value) in list(elements.items()):
+            if row == col:
+                del elements[(row, col)]
+            else:
+                col_sums[col] += value
+        for (col, col_sum) in enumerate(col_sums):
+            elements[(col, col)] = 1 - col_sum
+        return SparseMatrix(self.matrix.rows, self.matrix.cols, elements)
 
     def _set_transition(self, matrix, row, col, chance):
         matrix[row, col] = chance
+
+    def _set_transitions(self, matrix, rows, cols, chances):
+        for (row, col, chance) in zip(rows, cols, chances):
+            matrix[int(row), int(col)] = chance
         
     def _is_zero(self, trans):
         return trans.is_zero
         
-    def _inverse(self, matrix):
-        return matrix.inv()
-        
     def _eye(self, size):
         return sympy.eye(size)
         
+    def _transitions(self):
+        from_indices = []
+        to_indices = []
+        if self.matrix is not None:
+            for (row, col, value) in self.matrix.row_list():
+                if row != col and not self._is_zero(value):
+                    from_indices.append(col)
+                    to_indices.append(row)
+        return (np.array(from_indices, np.intp), np.array(to_indices, np.intp))
+
+    def _successors(self):
+        """
+        Return a list with the (to index, chance) of every outgoing transition
+        for each state index
+        """
+        successors = [[] for i in range(self.matrix.cols)]
+        for (row, col, value) in self.matrix.row_list():
+            if row != col and not self._is_zero(value):
+                successors[col].append((row, value))
+        return successors
+
+    def _components(self, successors):
+        """
+        Split the state indices into strongly connected components with
+        Tarjan's algorithm.  A component is only returned after every
+        component it can transition to, so the components come out in an
+        order they can be solved in.
+        """
+        size = len(successors)
+        order = [None] * size
+        low = [None] * size
+        on_stack = [False] * size
+        stack = []
+        components = []
+        counter = 0
+        for root in range(size):
+            if order[root] is not None:
+                continue
+            order[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [(root, 0)]
+            while work:
+                (index, edge) = work.pop()
+                if edge < len(successors[index]):
+                    work.append((index, edge + 1))
+                    to_index = successors[index][edge][0]
+                    if order[to_index] is None:
+                        order[to_index] = low[to_index] = counter
+                        counter += 1
+                        stack.append(to_index)
+                        on_stack[to_index] = True
+                        work.append((to_index, 0))
+                    elif on_stack[to_index]:
+                        low[index] = min(low[index], order[to_index])
+                    continue
+
+                if low[index] == order[index]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == index:
+                            break
+                    components.append(sorted(component))
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[index])
+        return components
+
+    def get_absorbing_probabilities(self):
+        """
+        The same as markov.Chain.get_absorbing_probabilities, but without
+        inverting I - Q over every transient state.  The transient states are
+        solved one strongly connected component at a time, starting from the
+        components next to the absorbing states, so each solve only involves
+        the few states that can transition back to each other.  In a match
+        chain that is the cycle of misses at one ball count.
+        """
+        successors = self._successors()
+        absorbing = [index for index in range(len(successors))
+                     if not successors[index]]
+        # The chance of ending in each absorbing state, by state index
+        ends = {}
+        for index in absorbing:
+            ends[index] = {index: sympy.S.One}
+
+        for component in self._components(successors):
+            if len(component) == 1 and component[0] in ends:
+                continue
+            members = set(component)
+
+            # Each state ends where its transitions lead, in proportion to
+            # their chances, because the chance of staying put only delays it
+            inside = []
+            outside = []
+            for index in component:
+                inside.append([(to_index, chance)
+                               for (to_index, chance) in successors[index]
+                               if to_index in members])
+                outside.append([(to_index, chance)
+                                for (to_index, chance) in successors[index]
+                                if to_index not in members])
+            if not any(outside):
+                raise ValueError("The matrix is not an absorbing matrix")
+
+            # Solve for the chance of leaving the component by each of the
+            # transitions out of it, then follow them to the absorbing states
+            exits = sorted(set(to_index for edges in outside
+                               for (to_index, chance) in edges))
+            exit_position = dict((index, i) for (i, index) in enumerate(exits))
+            rhs = sympy.zeros(len(component), len(exits))
+            for (row, edges) in enumerate(outside):
+                for (to_index, chance) in edges:
+                    rhs[row, exit_position[to_index]] += chance
+
+            if len(component) == 1:
+                solution = rhs / sum(chance for (to_index, chance)
+                                     in successors[component[0]])
+            else:
+                position = dict((index, i) for (i, index)
+                                in enumerate(component))
+                system = sympy.zeros(len(component), len(component))
+                for (row, index) in enumerate(component):
+                    system[row, row] = sum(chance for (to_index, chance)
+                                           in successors[index])
+                    for (to_index, chance) in inside[row]:
+                        system[row, position[to_index]] -= chance
+                solution = system.LUsolve(rhs)
+
+            for (row, index) in enumerate(component):
+                chances = {}
+                for (col, exit_index) in enumerate(exits):
+                    for (end, end_chance) in ends[exit_index].items():
+                        chances[end] = (chances.get(end, 0) +
+                                        solution[row, col] * end_chance)
+                ends[index] = chances
+
+        result = {}
+        for index in sorted(ends):
+            if index in absorbing:
+                continue
+            result[self.state_list[index]] = dict(
+                (self.state_list[end], ends[index].get(end, sympy.S.Zero))
+                for end in absorbing)
+        return result
+
+    def get_absorbing_probabilities_array(self):
+        probabilities = self.get_absorbing_probabilities()
+        transient_states = sorted(probabilities, key=lambda s: s.index)
+        absorbing_states = sorted((state for state in self.states
+                                   if state not in probabilities),
+                                  key=lambda s: s.index)
+        probs = sympy.Matrix(len(transient_states), len(absorbing_states),
+                             lambda t, a: probabilities[transient_states[t]]
+                                                       [absorbing_states[a]])
+        return (transient_states, absorbing_states, probs)
+
     def steady_state(self, start_state=None):
         # Initialize the probabilities for transisions to the same state
         matrix = self._fill_in_diagonal_transistions(self.matrix)
 
-        # Subtract the identity matrix
-        matrix = matrix - self._eye(matrix.rows)
-
-        # Add a row at the bottom of the matrix for the equation that all
-        # variable probabilities must add up to 1
-        matrix = matrix.row_insert(matrix.rows, sympy.ones(1, matrix.cols))
-
-        # Add a column for the target values
-        matrix = matrix.col_insert(matrix.cols, sympy.zeros(matrix.rows, 1))
-        matrix[matrix.rows-1, matrix.cols-1] = 1
+        # Subtract the identity matrix, add a row at the bottom of the matrix
+        # for the equation that all variable probabilities must add up to 1
+        # and a column for the target values
+        size = matrix.rows
+        elements = self._elements(matrix)
+        for i in range(size):
+            elements[(i, i)] = elements.get((i, i), 0) - 1
+            elements[(size, i)] = 1
+        elements[(size, size)] = 1
+        matrix = sympy.Matrix(SparseMatrix(size + 1, size + 1, elements))
 
         symbols = []
         for col in range(self._matrix_size(self.matrix)):
@@ -67,3 +240,21 @@ class Chain(markov.Chain):
             result[state] = solution[symbols[state_index]]
             
         return result
+
+    def absorption_distribution(self, start_state=None):
+        if start_state is None:
+            start_state = dict((state, sympy.Rational(1, len(self.states)))
+                               for state in self.states)
+        elif not isinstance(start_state, dict):
+            start_state = {start_state: 1}
+
+        probabilities = self.get_absorbing_probabilities()
+        result = dict((state, 0) for state in self.states)
+        for (start, chance) in start_state.items():
+            if start in probabilities:
+                for (end, end_chance) in probabilities[start].items():
+                    result[end] += chance * end_chance
+            else:
+                result[start] += chance
+
+        return result
@@ -0,0 +1,125 @@
+import analyzer.files as files
+import simplejson as json
+import numpy as np
+import hashlib
+import os
+
+ATTRIBUTES = ('sink', 'foul_end')
+
+# The smallest variance fitted to a posterior, which keeps the Beta proper
+# when every draw of a trace was the same
+MIN_VARIANCE = 1e-12
+
+# The largest alpha + beta fitted to a posterior.  A constant or stuck trace
+# has next to no variance and would otherwise become a prior so
+# concentrated that no later run could move it.  The concentration counts
+# roughly how many shots the prior is worth.
+MAX_CONCENTRATION = 1000.
+
+# The smallest alpha and beta fitted to a posterior.  Below 1 the Beta piles
+# its mass up against 0 or 1, so a chance that the draws put near an end
+# would become a prior that a later run can't move away from.
+MIN_PARAMETER = 1.
+
+# The fraction of the iterations discarded by default when a run starts from
+# the posterior of an earlier one.  The players start at their posterior
+# means, so they only need a short burn-in.
+BURN_FRACTION = 0.1
+
+def beta_parameters(mean, variance):
+    """
+    Return the (alpha, beta) of the Beta distribution with the mean and
+    variance.  The variance is clipped to the range a Beta can have, alpha +
+    beta is capped at MAX_CONCENTRATION and alpha and beta are raised to
+    MIN_PARAMETER if they fall below it.
+    """
+    if not 0 < mean < 1:
+        raise ValueError("The mean of a Beta must be between 0 and 1 but " +
+                         "was " + str(mean))
+    limit = mean * (1 - mean)
+    variance = min(max(variance, MIN_VARIANCE), limit * (1 - 1e-6))
+    scale = min(limit / variance - 1, MAX_CONCENTRATION)
+    return (max(mean * scale, MIN_PARAMETER),
+            max((1 - mean) * scale, MIN_PARAMETER))
+
+def empty():
+    """
+    Return the summary of a posterior before any matches
+    """
+    return {'matches': 0, 'players': {}}
+
+def matches_hash(matches_json):
+    """
+    Return a hash of the matches, as loaded from their JSON file, that
+    doesn't depend on how the file is laid out
+    """
+    return hashlib.sha1(json.dumps(matches_json, sort_keys=True)).hexdigest()
+
+def new_matches(summary, matches_json):
+    """
+    Return the matches after the ones the summary covers, after checking that
+    the matches before them are the ones it was made from.  A ValueError is
+    raised if they aren't, which happens when matches were changed, removed
+    or inserted instead of only added at the end.  Summaries saved without a
+    hash of their matches can only be checked for having fewer matches.
+    """
+    covered = summary['matches']
+    if len(matches_json) < covered:
+        raise ValueError("The posterior covers " + str(covered) +
+                         " matches, but there are only " +
+                         str(len(matches_json)))
+    expected = summary.get('matches_hash')
+    if expected is not None and \
+       matches_hash(matches_json[:covered]) != expected:
+        raise ValueError("The first " + str(covered) + " matches aren't " +
+                         "the ones the posterior covers, so it can't be " +
+                         "updated.  Matches can only be added at the end.")
+    return matches_json[covered:]
+
+def update(summary, num_matches, player_draws, digest=None):
+    """
+    Return a new summary of the posterior after num_matches matches in
+    total.  player_draws holds the posterior draws of each player's chances
+    as player_draws[name][attribute].  Each one is summarized by its mean
+    and the Beta fitted to its mean and variance.  Players without draws
+    keep their earlier summary.  digest is the matches_hash of all
+    num_matches matches, which new_matches checks later matches against.
+    """
+    players = dict(summary['players'])
+    for (name, draws) in player_draws.items():
+        player = {}
+        for attribute in ATTRIBUTES:
+            values = np.asarray(draws[attribute], dtype=np.float64)
+            mean = float(values.mean())
+            (alpha, beta) = beta_parameters(mean, float(values.var()))
+            player[attribute] = {'mean': mean, 'alpha': alpha, 'beta': beta}
+        players[name] = player
+    return {'matches': num_matches, 'matches_hash': digest,
+            'players': players}
+
+def player_arguments(summary, name):
+    """
+    Return the keyword arguments of analyze.new_player that start the player
+    at its posterior mean with its fitted Beta as the prior, or no arguments
+    for a player that isn't in the summary
+    """
+    player = summary['players'].get(name)
+    if player is None:
+        return {}
+    sink = player['sink']
+    foul_end = player['foul_end']
+    return {'sink': sink['mean'], 'foul': foul_end['mean'],
+            'sink_prior': (sink['alpha'], sink['beta']),
+            'foul_prior': (foul_end['alpha'], foul_end['beta'])}
+
+def load(path):
+    """
+    Read a summary saved by save, or return an empty one if there isn't one
+    """
+    if not os.path.exists(path):
+        return empty()
+    with open(path) as summary_file:
+        return json.loads(summary_file.read())
+
+def save(path, summary):
+    files.replace_file(path, json.dumps(summary, indent=4, sort_keys=True))
@@ -0,0 +1,409 @@
+import analyzer.diagnostics as diagnostics
+import analyzer.traces as traces
+import pymc as pm
+import numpy as np
+import scipy.optimize as optimize
+import scipy.special as special
+import collections
+import functools
+import multiprocessing
+import os
+import time
+
+STEP_METHODS = ['metropolis', 'adaptive-metropolis']
+
+# The initial width of the proposals for a player chance, before the step
+# methods tune it.  pymc scales it to the current value by default, which is
+# far too wide for an array of sink chances around 0.5, since every element
+# has to be accepted at once, and far too narrow for foul_end chances
+# starting near 0.
+PROPOSAL_SD = 0.05
+
+# The version of pymc whose private sampler attributes resume sets up.  It
+# can't go through MCMC.sample, which starts a new chain from iteration 0.
+RESUME_PYMC_VERSION = '2.3.8'
+
+def player_stochastics(nodes):
+    """
+    Return the unobserved stochastics among the nodes, which are the player
+    parameters the step methods move
+    """
+    return [node for node in nodes
+            if isinstance(node, pm.Stochastic) and not node.observed]
+
+def use_step_method(model, step_method, stochastics, delay=1000,
+                    interval=200):
+    """
+    Assign step_method to the stochastics of the model.  With 'metropolis'
+    each stochastic is updated on its own, as pymc does by default.  With
+    'adaptive-metropolis' all of them are updated together by a single
+    AdaptiveMetropolis, so a proposal only costs one likelihood evaluation.
+    It starts adapting its proposal covariance after delay iterations and
+    updates it every interval iterations.
+
+    Either way the proposals start PROPOSAL_SD wide, divided by the square
+    root of the number of chances that move together.
+    """
+    if step_method == 'metropolis':
+        for stochastic in stochastics:
+            size = np.size(stochastic.value)
+            model.use_step_method(pm.Metropolis, stochastic,
+                                  proposal_sd=np.ones(np.shape(
+                                      stochastic.value)) *
+                                  PROPOSAL_SD / np.sqrt(size))
+    elif step_method == 'adaptive-metropolis':
+        size = sum(np.size(stochastic.value) for stochastic in stochastics)
+        model.use_step_method(pm.AdaptiveMetropolis, list(stochastics),
+                              cov=np.eye(size) * PROPOSAL_SD ** 2 / size,
+                              delay=delay, interval=interval,
+                              shrink_if_necessary=True)
+        # pymc leaves the running mean out of the state it saves, so a
+        # resumed run would restart it from zero
+        for step_method in model.step_method_dict[stochastics[0]]:
+            if isinstance(step_method, pm.AdaptiveMetropolis) and \
+               'chain_mean' not in step_method._state:
+                step_method._state.append('chain_mean')
+    else:
+        raise ValueError("The step method must be one of " +
+                         ", ".join(STEP_METHODS) + " but was " +
+                         str(step_method))
+
+def record_only(nodes, recorded):
+    """
+    Only keep traces of the stochastics and deterministics among the nodes
+    that are in recorded.  It must be called before the MCMC is created.
+    """
+    recorded = set(recorded)
+    for node in nodes:
+        if isinstance(node, (pm.Stochastic, pm.Deterministic)):
+            node.keep_trace = node in recorded
+
+def drop_tuning_tallies(model, keep=()):
+    """
+    Stop the model from tallying the tuning information of its step methods,
+    such as each Metropolis' adaptive_scale_factor, apart from the names in
+    keep.  It assigns the step methods that haven't been assigned yet, so
+    call it after choosing them.
+    """
+    model.assign_step_methods()
+    keep = set(keep)
+    for step_method in model.step_methods:
+        for info in step_method._tuning_info:
+            name = step_method._id + '_' + info
+            if name not in keep:
+                model._funs_to_tally.pop(name, None)
+
+def build_model(nodes, player_nodes, step_method='metropolis', delay=1000,
+                interval=200, record=None, trace_dir=None, chunk_size=1000,
+                record_diagnostics=False):
+    """
+    Create an MCMC over the nodes that moves the player parameters in
+    player_nodes with step_method.  Only the nodes in record are traced, the
+    player stochastics unless it is given.  The model's deviance and the
+    step methods' tuning information are only traced with
+    record_diagnostics.  The traces are kept in
+    memory, or streamed to trace_dir in chunks of chunk_size draws with
+    analyzer.traces if it is given.
+    """
+    if record is None:
+        record = player_stochastics(player_nodes)
+    record_only(nodes, record)
+    if trace_dir is None:
+        model = pm.MCMC(nodes, calc_deviance=record_diagnostics)
+    else:
+        model = pm.MCMC(nodes, calc_deviance=record_diagnostics, db=traces,
+                        dbname=trace_dir, dbchunk=chunk_size)
+    use_step_method(model, step_method, player_stochastics(player_nodes),
+                    delay, interval)
+    if not record_diagnostics:
+        drop_tuning_tallies(model)
+    return model
+
+def resume(nodes, player_nodes, trace_dir, step_method='metropolis',
+           delay=1000, interval=200, checkpoint_interval=None,
+           chunk_size=1000, progress_bar=True):
+    """
+    Continue the run that checkpointed itself to trace_dir, which was
+    sampled by a model from build_model with a trace_dir and a save_interval.
+    The nodes must be built the same way as for that run.  The player
+    values, step method tuning, numpy's random state and traces are restored
+    from the checkpoint and the rest of its iterations are sampled,
+    checkpointing every checkpoint_interval iterations and saving the traces
+    in chunks of chunk_size draws.  Return the model.
+
+    It only works with pymc RESUME_PYMC_VERSION, and raises a RuntimeError
+    with any other version.
+    """
+    if pm.__version__ != RESUME_PYMC_VERSION:
+        raise RuntimeError("Resuming a run needs pymc " +
+                           RESUME_PYMC_VERSION + " but pymc " +
+                           pm.__version__ + " is installed")
+    db = traces.load(trace_dir, chunk_size)
+    state = db.getstate()
+    if not state:
+        raise ValueError("There is no checkpoint in " + str(trace_dir))
+    recorded = set(db.trace_names[state['chain']])
+    record_only(nodes, [node for node in nodes if node.__name__ in recorded])
+
+    model = pm.MCMC(nodes, calc_deviance='deviance' in recorded, db=db)
+    # MCMC restores the sampler's state from the database before it sets the
+    # iteration counts to their defaults, so restore it again
+    model.restore_sampler_state()
+    use_step_method(model, step_method, player_stochastics(player_nodes),
+                    delay, interval)
+    drop_tuning_tallies(model, recorded)
+    db.connect_model(model)
+    db._reopen()
+    for variable in model._variables_to_tally:
+        variable.trace = db._traces[variable.__name__]
+
+    # The rest of what MCMC.sample sets up before sampling, as in lines
+    # 247-283 of pymc/MCMC.py and 221-242 of pymc/Model.py in
+    # RESUME_PYMC_VERSION.  Calling MCMC.sample itself would start the
+    # iterations over from 0, reset the tuning and draw new values.
+    model._n_tally = model._iter - model._burn
+    model._tuning = model._tune_throughout or \
+                    model._current_iter < model._burn
+    model._save_interval = checkpoint_interval
+    model.max_trace_length = max(int(np.round(
+        (1.0 * model._iter - model._burn) / model._thin, 0)), 1)
+    model._cur_trace_index = max([db._traces[name].length(state['chain'])
+                                  for name in recorded] or [0])
+    model.verbose = 0
+    model.pbar = None
+    if progress_bar:
+        model.pbar = pm.progressbar.progress_bar(model._iter)
+
+    np.random.set_state(state['random'])
+    model._loop()
+    model._finalize()
+    return model
+
+def _allowed(nodes):
+    """
+    Return True if none of the Potentials in the nodes forbid the current
+    values
+    """
+    for node in nodes:
+        if isinstance(node, pm.Potential):
+            try:
+                node.logp
+            except pm.ZeroProbability:
+                return False
+    return True
+
+def disperse_initial_values(player_nodes, attempts=10):
+    """
+    Move the player parameters to a random draw from their priors, so that
+    separate chains start apart.  If the draw breaks one of the players'
+    Potentials, the move is halved until it doesn't, and after attempts
+    halvings the parameters are left where they were.
+    """
+    stochastics = player_stochastics(player_nodes)
+    initial = [np.copy(stochastic.value) for stochastic in stochastics]
+    draws = [np.copy(stochastic.random()) for stochastic in stochastics]
+    for attempt in range(attempts):
+        scale = 0.5 ** attempt
+        for (stochastic, start, draw) in zip(stochastics, initial, draws):
+            stochastic.value = start + (draw - start) * scale
+        if _allowed(player_nodes):
+            return
+    for (stochastic, start) in zip(stochastics, initial):
+        stochastic.value = start
+
+def find_map(nodes, player_nodes, method='Powell', maxiter=None):
+    """
+    Move the player parameters in player_nodes to the maximum of the joint
+    log-posterior of the model over the nodes, found with scipy's optimizer
+    method.  The chances are optimized on the logit scale so the optimizer
+    can't leave the unit interval.  Any other unobserved stochastics, such as
+    latent orders, are held where they are, so marginalize the orders
+    instead.  The parameters are left at the maximum, so an MCMC built
+    afterwards starts from it.  Return the log-posterior there.
+    """
+    model = pm.Model(nodes)
+    stochastics = player_stochastics(player_nodes)
+    shapes = [np.shape(stochastic.value) for stochastic in stochastics]
+    sizes = [int(np.prod(shape)) for shape in shapes]
+
+    def set_values(logits):
+        values = special.expit(logits)
+        start = 0
+        for (stochastic, shape, size) in zip(stochastics, shapes, sizes):
+            stochastic.value = values[start:start + size].reshape(shape)
+            start += size
+
+    def negative_logp(logits):
+        set_values(logits)
+        try:
+            return -model.logp
+        except pm.ZeroProbability:
+            return np.inf
+
+    start = np.concatenate([np.ravel(stochastic.value)
+                            for stochastic in stochastics])
+    result = optimize.minimize(negative_logp, special.logit(start),
+                               method=method,
+                               options={'maxiter': maxiter})
+    set_values(result.x)
+    return -result.fun
+
+def sample_chain(build, seed, iter, burn=0, thin=1, step_method='metropolis',
+                 delay=1000, interval=200, tune_interval=1000,
+                 disperse=True, trace_dir=None, chunk_size=1000):
+    """
+    Build a model with build, which returns the nodes of the model and the
+    player nodes among them, and sample a chain from it with numpy's random
+    numbers seeded with seed.  With disperse, the chain starts from random
+    initial values.  pymc doesn't run the step methods in a fixed order, so
+    the seed gives each chain its own random numbers but doesn't make a chain
+    exactly repeatable.  Only the player stochastics are traced, in memory
+    or in trace_dir as by build_model.  Return a dict of their traces by
+    name.
+    """
+    np.random.seed(seed)
+    (nodes, player_nodes) = build()
+    if disperse:
+        disperse_initial_values(player_nodes)
+    model = build_model(nodes, player_nodes, step_method, delay, interval,
+                        trace_dir=trace_dir, chunk_size=chunk_size)
+    model.sample(iter=iter, burn=burn, thin=thin,
+                 tune_interval=tune_interval, progress_bar=False)
+    return dict((stochastic.__name__,
+                 np.asarray(model.trace(stochastic.__name__)[:]))
+                for stochastic in player_stochastics(player_nodes))
+
+def _sample_chain_with_seed(seed, build, kwargs):
+    return sample_chain(build, seed, **kwargs)
+
+def _sample_chain_in_dir(seed, build, trace_dir, first_seed, kwargs):
+    chain_dir = os.path.join(trace_dir, 'chain_%d' % (seed - first_seed))
+    return sample_chain(build, seed, trace_dir=chain_dir, **kwargs)
+
+def sample_chains(build, chains, seed=None, processes=None, **kwargs):
+    """
+    Sample independent chains with sample_chain in a pool of processes, one
+    per chain unless processes is given.  build must be picklable, such as a
+    module level function.  Each chain gets its own seed, counting up from
+    seed or a random one.  With a trace_dir keyword, each chain streams its
+    traces to its own chain_<i> directory in it.  Return a dict of the
+    traces of each player stochastic by name, shaped chains x draws,
+    followed by the variable's own shape.
+    """
+    if seed is None:
+        seed = np.random.randint(2 ** 30)
+    seeds = [seed + chain for chain in range(chains)]
+    trace_dir = kwargs.pop('trace_dir', None)
+    if trace_dir is None:
+        sample = functools.partial(_sample_chain_with_seed, build=build,
+                                   kwargs=kwargs)
+    else:
+        sample = functools.partial(_sample_chain_in_dir, build=build,
+                                   trace_dir=trace_dir, first_seed=seed,
+                                   kwargs=kwargs)
+    if chains == 1:
+        results = map(sample, seeds)
+    else:
+        pool = multiprocessing.Pool(processes or chains)
+        try:
+            results = pool.map(sample, seeds)
+        finally:
+            pool.close()
+            pool.join()
+
+    return merge_traces(results)
+
+def merge_traces(chain_traces):
+    """
+    Stack the traces of several chains, each a dict of traces by name, into a
+    single dict of chains x draws arrays
+    """
+    names = chain_traces[0].keys()
+    return dict((name, np.array([traces[name] for traces in chain_traces]))
+                for name in names)
+
+AdaptiveRun = collections.namedtuple('AdaptiveRun',
+                                     ['traces', 'burn', 'iterations',
+                                      'converged', 'effective_sample_sizes',
+                                      'r_hats'])
+
+BURN_IN_FRACTIONS = (0., 0.1, 0.2, 0.3, 0.4, 0.5)
+
+def find_burn_in(traces, max_z=2., fractions=BURN_IN_FRACTIONS):
+    """
+    Return how many of the first draws to discard from the traces, a dict of
+    single chain traces by name.  It is the smallest of the fractions of the
+    draws after which every Geweke z-score is within max_z, or None if there
+    isn't one.
+    """
+    length = min(len(trace) for trace in traces.values())
+    for fraction in fractions:
+        burn = int(fraction * length)
+        try:
+            settled = all(np.all(np.abs(diagnostics.geweke(trace[burn:]))
+                                 <= max_z)
+                          for trace in traces.values())
+        except ValueError:
+            return None
+        if settled:
+            return burn
+    return None
+
+def sample_until_converged(model, player_nodes, block_size=500, min_ess=400,
+                           max_r_hat=1.1, max_iter=100000, time_budget=None,
+                           tune_interval=1000):
+    """
+    Sample the model in blocks of block_size iterations until the traces of
+    the player stochastics have converged, max_iter iterations have been
+    sampled or time_budget seconds have passed.  After every block the
+    burn-in is found with find_burn_in, and the draws after it have converged
+    once every parameter has an effective sample size of at least min_ess
+    and a split chain R-hat of at most max_r_hat.  The last block is
+    shortened so that no more than max_iter iterations are sampled.
+
+    pymc counts the tune_interval from the start of each call to sample, so
+    the step methods are tuned every tune_interval iterations within a block
+    and again before every block after the first, at least once per block.
+
+    Return an AdaptiveRun with the traces after the burn-in, the burn-in,
+    the iterations sampled, whether it converged and the last diagnostics.
+    """
+    start = time.time()
+    stochastics = player_stochastics(player_nodes)
+    iterations = 0
+    while True:
+        if iterations > 0:
+            model.tune()
+        size = min(block_size, max_iter - iterations)
+        model.sample(iter=size, tune_interval=min(tune_interval, size),
+                     progress_bar=False)
+        iterations += size
+        traces = dict((stochastic.__name__,
+                       np.asarray(model.trace(stochastic.__name__,
+                                              chain=None)[:]))
+                      for stochastic in stochastics)
+
+        burn = find_burn_in(traces)
+        kept_from = burn if burn is not None else \
+                    len(traces.values()[0]) // 2
+        kept = dict((name, trace[kept_from:])
+                    for (name, trace) in traces.items())
+        try:
+            sample_sizes = dict((name, diagnostics.effective_sample_size(
+                                     diagnostics.split_chains(trace)))
+                                for (name, trace) in kept.items())
+            r_hats = dict((name, diagnostics.gelman_rubin(
+                               diagnostics.split_chains(trace)))
+                          for (name, trace) in kept.items())
+            converged = burn is not None and \
+                all(np.all(ess >= min_ess) for ess in sample_sizes.values()) \
+                and all(np.all(r_hat <= max_r_hat) for r_hat in r_hats.values())
+        except ValueError:
+            # Not enough draws for the diagnostics yet
+            (sample_sizes, r_hats, converged) = ({}, {}, False)
+
+        out_of_time = time_budget is not None and \
+                      time.time() - start >= time_budget
+        if converged or iterations >= max_iter or out_of_time:
+            return AdaptiveRun(kept, burn, iterations, converged,
+                               sample_sizes, r_hats)
@@ -112,6 +112,16 @@ class AbstractChainTest(object):
         chain.set_transition(ht, empty, trans)
         self.assertEqual(True, chain.is_absorbing())
 
+    def test_is_absorbing_long_path(self):
+        chain = self._createChain()
+        states = chain.new_states(range(50))
+        trans = self._createDummyTransitionValue()
+        for (state, next_state) in zip(states[1:], states[:-1]):
+            chain.set_transition(state, next_state, trans)
+        self.assertEqual(True, chain.is_absorbing())
+        chain.set_transition(states[0], states[-1], trans)
+        self.assertEqual(False, chain.is_absorbing())
+
     def test_is_absorbing_false(self):
         chain = self._createChain()
         one = chain.new_state('one')
@@ -121,6 +131,23 @@ class AbstractChainTest(object):
         chain.set_transition(two, one, trans)
         self.assertEqual(False, chain.is_absorbing())
         
+    def test_is_absorbing_false_closed_loop(self):
+        chain = self._createChain()
+        (start, end, one, two) = chain.new_states(['start', 'end', 'one',
+                                                   'two'])
+        trans = self._createDummyTransitionValue()
+        chain.set_transition(start, end, trans)
+        chain.set_transition(start, one, trans)
+        chain.set_transition(one, two, trans)
+        chain.set_transition(two, one, trans)
+        self.assertEqual(False, chain.is_absorbing())
+        (absorbing, transient, unknown) = chain._analyze_for_absorbing()
+        self.assertEqual(set([end]), absorbing)
+        self.assertEqual(set([start]), transient)
+        self.assertEqual(set([one, two]), unknown)
+        with self.assertRaises(ValueError):
+            chain.get_absorbing_probabilities()
+
     def test_get_absorbing_probabilities(self):
         chain = self._createChain()
         empty = chain.new_state('empty')
@@ -137,3 +164,93 @@ class AbstractChainTest(object):
         self.assertEqual(0.25, probabilities[empty][tt])
         self.assertEqual(0.50, probabilities[t][tt])
         self.assertEqual(0.50, probabilities[t][h])
+
+    def test_new_states(self):
+        chain = self._createChain()
+        first = chain.new_state('first')
+        (second, third) = chain.new_states(['second', 'third'])
+        self.assertEquals((3,3), chain.matrix.shape)
+        self.assertEqual(1, chain.states[second])
+        self.assertEqual(2, chain.states[third])
+        self.assertEqual(third, chain.get_state('third'))
+
+    def test_new_states_duplicate_labels(self):
+        chain = self._createChain()
+        chain.new_state('label1')
+        with self.assertRaises(ValueError):
+            chain.new_states(['label2', 'label1'])
+        with self.assertRaises(ValueError):
+            chain.new_states(['label3', 'label3'])
+        self.assertEquals((1,1), chain.matrix.shape)
+
+    def test_with_states(self):
+        chain = self._createChain().with_states(['one', 'two'])
+        self.assertEquals((2,2), chain.matrix.shape)
+        self.assertEqual(1, chain.states[chain.get_state('two')])
+
+    def test_set_transitions(self):
+        chain = self._createChain()
+        (start, end1, end2) = chain.new_states(['start', 'end1', 'end2'])
+        trans = self._createDummyTransitionValue()
+        chain.set_transitions([0, 0], [1, 2], [trans, trans])
+        self.assertEqual(trans, chain.get_transition(start, end1))
+        self.assertEqual(trans, chain.get_transition(start, end2))
+
+    def test_set_transitions_same_state(self):
+        chain = self._createChain()
+        chain.new_states(['one', 'two'])
+        trans = self._createDummyTransitionValue()
+        with self.assertRaises(Exception):
+            chain.set_transitions([0, 1], [1, 1], [trans, trans])
+
+    def test_absorption_distribution(self):
+        chain = self._createChain()
+        empty = chain.new_state('empty')
+        h = chain.new_state('h')
+        t = chain.new_state('t')
+        tt = chain.new_state('tt')
+        flip = self._chanceOfCoinFlip()
+        chain.set_transition(empty, h, flip)
+        chain.set_transition(empty, t, flip)
+        chain.set_transition(t, tt, flip)
+        chain.set_transition(t, h, flip)
+        distribution = chain.absorption_distribution(empty)
+        self.assertAlmostEqual(0.75, float(distribution[h]))
+        self.assertAlmostEqual(0.25, float(distribution[tt]))
+        self.assertAlmostEqual(0.0, float(distribution[empty]))
+        self.assertAlmostEqual(0.0, float(distribution[t]))
+
+    def test_get_absorbing_probabilities_array(self):
+        chain = self._createChain()
+        (empty, h, t, tt) = chain.new_states(['empty', 'h', 't', 'tt'])
+        flip = self._chanceOfCoinFlip()
+        chain.set_transition(empty, h, flip)
+        chain.set_transition(empty, t, flip)
+        chain.set_transition(t, tt, flip)
+        chain.set_transition(t, h, flip)
+        (transient, absorbing, probs) = \
+            chain.get_absorbing_probabilities_array()
+        self.assertEqual([empty, t], transient)
+        self.assertEqual([h, tt], absorbing)
+        self.assertEqual((2, 2), probs.shape)
+        self.assertAlmostEqual(0.75, float(probs[0, 0]))
+        self.assertAlmostEqual(0.25, float(probs[0, 1]))
+        self.assertAlmostEqual(0.5, float(probs[1, 0]))
+        self.assertAlmostEqual(0.5, float(probs[1, 1]))
+
+    def test_find_state_by_index(self):
+        chain = self._createChain()
+        (one, two) = chain.new_states(['one', 'two'])
+        self.assertEqual(two, chain.find_state_by_index(1))
+        self.assertEqual(None, chain.find_state_by_index(2))
+
+    def test_empty_copy_new_state(self):
+        chain = self._createChain()
+        (one, two) = chain.new_states(['one', 'two'])
+        copy = chain.empty_copy()
+        self.assertEqual(two, copy.get_state('two'))
+        three = copy.new_state('three')
+        self.assertEqual(three, copy.find_state_by_index(2))
+        self.assertEqual(None, chain.get_state('three'))
+        self.assertEqual(2, len(chain.states))
+        self.assertEqual((2, 2), chain.matrix.shape)
@@ -1,6 +1,10 @@
 import unittest
+import numpy as np
+import math
 import sympy
+import pymc as pm
 import analyzer.analyze as analyze
+import analyzer.compiled as compiled
 import analyzer.markov_symbolic as symbolicMarkov
 
 class TestReorder(unittest.TestCase):
@@ -27,6 +31,61 @@ class TestReorder(unittest.TestCase):
         with self.assertRaises(ValueError):
             analyze.reorder(['a','b','c','d'], 0, 8)
 
+class TestOrderCycle(unittest.TestCase):
+    def test_order_cycle_matches_reorder(self):
+        players = ['a','b','c','d']
+        for order in range(8):
+            (reordered, winning_team) = analyze.reorder(players, 0, order)
+            (cycle, start, cycle_winning_team) = analyze.order_cycle(4, 0,
+                                                                     order)
+            cycle_players = [players[i] for i in cycle]
+            self.assertEqual('a', cycle_players[0])
+            self.assertEqual(reordered,
+                             cycle_players[start:] + cycle_players[:start])
+            if start % 2 == 0:
+                self.assertEqual(winning_team, cycle_winning_team)
+            else:
+                self.assertNotEqual(winning_team, cycle_winning_team)
+
+    def test_two_cycles_for_four_players(self):
+        cycles = set(analyze.order_cycle(4, 0, order)[0] for order in range(8))
+        self.assertEqual(set([(0,1,2,3), (0,3,2,1)]), cycles)
+
+class TestEvalOrderings(unittest.TestCase):
+    players = [{'sink': 0.5, 'foul_end': 0.05},
+               {'sink': 0.4, 'foul_end': 0.02},
+               {'sink': 0.3, 'foul_end': 0.05},
+               {'sink': 0.6, 'foul_end': 0.01}]
+
+    def assert_orderings_match(self, evaluator):
+        for winning_team in (0, 1):
+            for foul_end in (False, True):
+                chances = evaluator.eval_orderings(self.players, winning_team,
+                                                   range(8), foul_end)
+                for order in range(8):
+                    expected = evaluator.eval_with_order(self.players,
+                                                         winning_team, order,
+                                                         foul_end)
+                    self.assertAlmostEqual(expected, chances[order])
+                self.assertAlmostEqual(
+                    chances.mean(),
+                    evaluator.eval_unordered(self.players, winning_team,
+                                             foul_end))
+
+    def test_markov(self):
+        self.assert_orderings_match(analyze.NumericMarkovMatchEvaluator())
+
+    def test_ball_count(self):
+        self.assert_orderings_match(analyze.BallCountMatchEvaluator())
+
+    def test_base_eval_starts(self):
+        evaluator = analyze.BallCountMatchEvaluator()
+        expected = evaluator.eval_starts(self.players, 1, False)
+        chances = analyze.MatchEvaluator.eval_starts(evaluator, self.players,
+                                                     1, False)
+        for (e, c) in zip(expected, chances):
+            self.assertAlmostEqual(e, c)
+
 class TestMatchEvalMarkovUnordered(unittest.TestCase):
     def setUp(self):
         self.markov_analyzer = analyze.NumericMarkovMatchEvaluator()
@@ -110,6 +169,590 @@ class TestBuildMarkovChain(unittest.TestCase):
         self.assertAlmostEqual(p2_wins_val, probs[p1_state][p2_wins]) 
         
 
+class TestChainTemplate(unittest.TestCase):
+    def test_template_is_shared(self):
+        template = analyze.chain_template(4)
+        self.assertTrue(template is analyze.chain_template(4))
+        self.assertFalse(template is analyze.chain_template(2))
+
+    def test_template_edges(self):
+        template = analyze.chain_template(2, ballsPerTeam=3)
+        self.assertEqual(2*3*3, len(template.miss_from))
+        self.assertEqual(2*3*3, len(template.sink_from))
+        self.assertEqual(2*3*3, len(template.foul_end_from))
+        self.assertEqual((0, 2, 2), template.labels[template.start_index])
+        with self.assertRaises(ValueError):
+            template.sink_to[0] = 0
+
+    def test_numeric_transitions_match_generic(self):
+        evaluator = analyze.NumericMarkovMatchEvaluator()
+        players = [{'sink': 0.5, 'foul_end': 0.1},
+                   {'sink': 0.25, 'foul_end': 0.2}]
+        chain = evaluator.build_chain(players, ballsPerTeam=3)
+        generic_chain = evaluator._build_uninitialized_chain(2, ballsPerTeam=3)
+        analyze.MarkovMatchEvaluator._set_state_transitions(
+            evaluator, players, generic_chain, ballsPerTeam=3)
+        self.assertTrue((chain.matrix == generic_chain.matrix).all())
+
+    def test_collapsed_end_states(self):
+        template = analyze.chain_template(2, ballsPerTeam=3,
+                                          collapse_end_states=True)
+        self.assertEqual(4 + 2*3*3, len(template.labels))
+        self.assertEqual((1, 'foul-win'),
+                         template.labels[template.outcome_states(1, True)[0]])
+        full_template = analyze.chain_template(2, ballsPerTeam=3)
+        self.assertEqual(3*3, len(full_template.outcome_states(0, True)))
+        self.assertEqual(3, len(full_template.outcome_states(1, False)))
+
+    def test_collapsed_chain_matches_full_chain(self):
+        evaluator = analyze.NumericMarkovMatchEvaluator()
+        players = [{'sink': 0.5, 'foul_end': 0.1},
+                   {'sink': 0.25, 'foul_end': 0.2}]
+        chain = evaluator.build_chain(players)
+        collapsed = evaluator.build_chain(players, collapse_end_states=True)
+        start = chain.get_state( (0,7,7) )
+        distribution = chain.absorption_distribution(start)
+        collapsed_distribution = collapsed.absorption_distribution(
+            collapsed.get_state( (0,7,7) ))
+        wins = sum(distribution[chain.get_state( (1, 'win', a, 0) )]
+                   for a in range(8))
+        self.assertAlmostEqual(wins, collapsed_distribution[
+            collapsed.get_state( (1, 'win') )])
+
+    def test_chains_do_not_share_transitions(self):
+        evaluator = analyze.NumericMarkovMatchEvaluator()
+        chain1 = evaluator.build_chain([{'sink': 0.5, 'foul_end': 0.1},
+                                        {'sink': 0.5, 'foul_end': 0.1}])
+        chain2 = evaluator.build_chain([{'sink': 0.25, 'foul_end': 0.1},
+                                        {'sink': 0.25, 'foul_end': 0.1}])
+        p1_state = chain1.get_state( (0,0,0) )
+        p1_wins = chain1.get_state( (0, 'win', 0, 0) )
+        self.assertAlmostEqual(0.5, chain1.get_transition(p1_state, p1_wins))
+        self.assertAlmostEqual(0.25, chain2.get_transition(p1_state, p1_wins))
+
+class TestMatchEvalMarkov(unittest.TestCase):
+    def setUp(self):
+        self.markov_analyzer = analyze.NumericMarkovMatchEvaluator()
+
+    def test_eval_matches_steady_state(self):
+        players = [{'sink': 0.5, 'foul_end': 0.1},
+                   {'sink': 0.25, 'foul_end': 0.2}]
+        chain = self.markov_analyzer.build_chain(players)
+        steady = chain.steady_state(chain.get_state( (0,7,7) ))
+        for winning_team in (0, 1):
+            for foul_end in (False, True):
+                template = analyze.chain_template(2)
+                end_states = template.outcome_states(winning_team, foul_end)
+                expected = sum(steady[chain.get_state(template.labels[index])]
+                               for index in end_states)
+                actual = self.markov_analyzer.eval(players, winning_team,
+                                                   foul_end)
+                self.assertAlmostEqual(expected, actual)
+
+    def test_eval_reuses_chain(self):
+        players = [{'sink': 0.5, 'foul_end': 0.1},
+                   {'sink': 0.25, 'foul_end': 0.2}]
+        others = [{'sink': 0.3, 'foul_end': 0.05},
+                  {'sink': 0.6, 'foul_end': 0.01}]
+        first = self.markov_analyzer.eval(players, 0, False)
+        (chain,) = self.markov_analyzer._eval_chains.values()
+        matrix = chain.matrix
+        other = self.markov_analyzer.eval(others, 0, False)
+        self.assertIs(matrix, chain.matrix)
+        self.assertAlmostEqual(first, self.markov_analyzer.eval(players, 0,
+                                                                False))
+        self.assertAlmostEqual(other, self.markov_analyzer.eval_starts(
+            others, 0, False)[0])
+        self.assertIs(matrix, chain.matrix)
+
+    def test_eval_reuses_workspaces(self):
+        players = [{'sink': 0.5, 'foul_end': 0.01},
+                   {'sink': 0.4, 'foul_end': 0.02}]
+        others = [{'sink': 0.3, 'foul_end': 0.05},
+                  {'sink': 0.6, 'foul_end': 0.01}]
+        first = self.markov_analyzer.eval_starts(players, 0, False)
+        (chain,) = self.markov_analyzer._eval_chains.values()
+        buffers = dict((name, chain._workspaces[name])
+                       for name in ('filled', 'system', 'r', 'rhs'))
+        expected = list(first)
+        self.markov_analyzer.eval_starts(others, 0, False)
+        for (name, buffer) in buffers.items():
+            self.assertIs(buffer, chain._workspaces[name])
+        self.assertEqual(expected, list(first))
+
+    def test_eval_full_end_states(self):
+        full_analyzer = analyze.NumericMarkovMatchEvaluator(
+            collapse_end_states=False)
+        players = [{'sink': 0.5, 'foul_end': 0.1},
+                   {'sink': 0.25, 'foul_end': 0.2}]
+        for foul_end in (False, True):
+            self.assertAlmostEqual(full_analyzer.eval(players, 1, foul_end),
+                                   self.markov_analyzer.eval(players, 1,
+                                                             foul_end))
+
+    def test_eval_near_zero_sink(self):
+        players = [{'sink': 1e-6, 'foul_end': 1e-6},
+                   {'sink': 1e-6, 'foul_end': 1e-6}]
+        total = 0
+        for winning_team in (0, 1):
+            for foul_end in (False, True):
+                total += self.markov_analyzer.eval(players, winning_team,
+                                                   foul_end)
+        self.assertAlmostEqual(1.0, total)
+
+class TestMatchEvalBallCount(unittest.TestCase):
+    def setUp(self):
+        self.markov_analyzer = analyze.NumericMarkovMatchEvaluator()
+        self.ball_count_analyzer = analyze.BallCountMatchEvaluator()
+
+    def assert_matches_markov(self, players):
+        for winning_team in (0, 1):
+            for foul_end in (False, True):
+                expected = self.markov_analyzer.eval(players, winning_team,
+                                                     foul_end)
+                actual = self.ball_count_analyzer.eval(players, winning_team,
+                                                       foul_end)
+                self.assertAlmostEqual(expected, actual)
+
+    def test_match_never_ends(self):
+        players = [{'sink': 0., 'foul_end': 0.},
+                   {'sink': 0., 'foul_end': 0.}]
+        for evaluator in (self.markov_analyzer, self.ball_count_analyzer,
+                          compiled.CompiledMatchEvaluator(3)):
+            with self.assertRaises(ValueError):
+                evaluator.eval(players, 0, False)
+            with self.assertRaises(ValueError):
+                evaluator.eval_batch([[0., 0.]], [[0., 0.]], [0], [0],
+                                     [False])
+
+    def test_invalid_chances(self):
+        for invalid in ({'sink': 0.8, 'foul_end': 0.3},
+                        {'sink': float('nan'), 'foul_end': 0.1},
+                        {'sink': 0.5, 'foul_end': -0.1}):
+            players = [invalid, {'sink': 0.5, 'foul_end': 0.1}]
+            for evaluator in (self.markov_analyzer, self.ball_count_analyzer,
+                              compiled.CompiledMatchEvaluator(3)):
+                with self.assertRaises(Exception):
+                    evaluator.eval(players, 0, False)
+                with self.assertRaises(Exception):
+                    evaluator.eval_batch([[invalid['sink'], 0.5]],
+                                         [[invalid['foul_end'], 0.1]],
+                                         [0], [0], [False])
+
+    def test_two_players(self):
+        self.assert_matches_markov([{'sink': 0.5, 'foul_end': 0.1},
+                                    {'sink': 0.25, 'foul_end': 0.2}])
+
+    def test_four_players(self):
+        self.assert_matches_markov([{'sink': 0.5, 'foul_end': 0.05},
+                                    {'sink': 0.4, 'foul_end': 0.02},
+                                    {'sink': 0.3, 'foul_end': 0.05},
+                                    {'sink': 0.6, 'foul_end': 0.01}])
+
+    def test_pymc_players(self):
+        players = [analyze.new_player('p1', 0.75),
+                   analyze.new_player('p2', 0.5)]
+        self.assert_matches_markov(players)
+
+    def test_unordered_even(self):
+        players = [{'sink': 0.5, 'foul_end': 0.1}] * 4
+        chance_of_win = self.ball_count_analyzer.eval_unordered(players, 0,
+                                                                False)
+        chance_of_foul_win = self.ball_count_analyzer.eval_unordered(players,
+                                                                     0, True)
+        self.assertAlmostEqual(0.5, chance_of_win + chance_of_foul_win)
+
+    def test_symbolic(self):
+        sink = sympy.Symbol('sink')
+        foul_end = sympy.Symbol('foul_end')
+        outcome = analyze.ball_count_outcome([sink, sink],
+                                             [foul_end, foul_end],
+                                             0, False, ballsPerTeam=2)
+        expected = analyze.BallCountMatchEvaluator(2).eval(
+            [{'sink': 0.5, 'foul_end': 0.1}] * 2, 0, False)
+        self.assertAlmostEqual(expected,
+                               outcome[0].subs({sink: 0.5, foul_end: 0.1}))
+
+class TestEvalBatch(unittest.TestCase):
+    sink = [[0.5, 0.4, 0.3, 0.6],
+            [0.2, 0.7, 0.5, 0.5],
+            [0.5, 0.4, 0.3, 0.6]]
+    foul = [[0.05, 0.02, 0.05, 0.01],
+            [0.0, 0.1, 0.02, 0.03],
+            [0.05, 0.02, 0.05, 0.01]]
+    winning_team = [0, 1, 1]
+    order = [0, 5, 3]
+    foul_end = [False, True, False]
+
+    def assert_batch_matches(self, evaluator):
+        chances = evaluator.eval_batch(self.sink, self.foul,
+                                       self.winning_team, self.order,
+                                       self.foul_end)
+        self.assertEqual(3, len(chances))
+        for match in range(3):
+            players = [{'sink': self.sink[match][i],
+                        'foul_end': self.foul[match][i]} for i in range(4)]
+            expected = evaluator.eval_with_order(players,
+                                                 self.winning_team[match],
+                                                 self.order[match],
+                                                 self.foul_end[match])
+            self.assertAlmostEqual(expected, chances[match])
+
+    def test_markov(self):
+        self.assert_batch_matches(analyze.NumericMarkovMatchEvaluator())
+
+    def test_markov_full_end_states(self):
+        self.assert_batch_matches(analyze.NumericMarkovMatchEvaluator(
+            collapse_end_states=False))
+
+    def test_markov_chunks(self):
+        evaluator = analyze.NumericMarkovMatchEvaluator()
+        chances = evaluator.eval_batch(self.sink, self.foul,
+                                       self.winning_team, self.order,
+                                       self.foul_end, chunk_size=2)
+        expected = evaluator.eval_batch(self.sink, self.foul,
+                                        self.winning_team, self.order,
+                                        self.foul_end)
+        for (e, c) in zip(expected, chances):
+            self.assertAlmostEqual(e, c)
+
+    def test_ball_count(self):
+        self.assert_batch_matches(analyze.BallCountMatchEvaluator())
+
+    def test_invalid_order(self):
+        evaluator = analyze.BallCountMatchEvaluator()
+        with self.assertRaises(ValueError):
+            evaluator.eval_batch([[0.5, 0.5]], [[0.0, 0.0]], [0], [2], [False])
+
+    def test_eval_matches(self):
+        evaluator = analyze.BallCountMatchEvaluator()
+        singles = [{'sink': 0.5, 'foul_end': 0.1},
+                   {'sink': 0.25, 'foul_end': 0.2}]
+        doubles = [{'sink': 0.5, 'foul_end': 0.05},
+                   {'sink': 0.4, 'foul_end': 0.02},
+                   {'sink': 0.3, 'foul_end': 0.05},
+                   {'sink': 0.6, 'foul_end': 0.01}]
+        chances = analyze.eval_matches(evaluator, [singles, doubles, singles],
+                                       [0, 1, 1], [False, False, True],
+                                       [range(2), range(8), [1]])
+        self.assertAlmostEqual(
+            evaluator.eval_partial_ordered(singles, 0, False), chances[0])
+        self.assertAlmostEqual(
+            evaluator.eval_unordered(doubles, 1, False), chances[1])
+        self.assertAlmostEqual(
+            evaluator.eval_with_order(singles, 1, 1, True), chances[2])
+
+class TestAllMatchesBatch(unittest.TestCase):
+    def test_batch_matches_individual(self):
+        players = [analyze.new_player('p%i' % i, 0.3 + 0.1 * i)
+                   for i in range(4)]
+        matches = [analyze.Match(players, 0, "total"),
+                   analyze.Match(players[:2], 1, "partial", True),
+                   analyze.Match(players, 1, "partial")]
+        evaluator = analyze.BallCountMatchEvaluator()
+        match_vars = analyze.all_matches(matches, evaluator)
+        (batch_var,) = analyze.all_matches(matches, evaluator, batch=True)
+        self.assertEqual(3, len(batch_var.value))
+        for (match_var, chance) in zip(match_vars, batch_var.value):
+            self.assertAlmostEqual(match_var.value, chance)
+
+        (outcome,) = analyze.outcomes([batch_var])
+        self.assertEqual(3, len(outcome.value))
+
+class TestMatchLikelihood(unittest.TestCase):
+    def setUp(self):
+        self.players = [analyze.new_player('p%i' % i, 0.3 + 0.1 * i)
+                        for i in range(4)]
+        self.evaluator = analyze.BallCountMatchEvaluator()
+
+    def test_matches_individual(self):
+        matches = [analyze.Match(self.players, 0, "total"),
+                   analyze.Match(self.players[:2], 1, "partial", True),
+                   analyze.Match(self.players, 1, "unordered")]
+        (orders, likelihood) = analyze.match_likelihood(matches,
+                                                        self.evaluator)
+        self.assertEqual(2, len(orders.value))
+        orders.value = [1, 5]
+        expected = sum(math.log(self.evaluator.eval_with_order(
+                           match.players, match.winning_team, order,
+                           match.foul_end))
+                       for (match, order) in zip(matches, [0, 1, 5]))
+        self.assertAlmostEqual(expected, likelihood.logp)
+
+    def test_order_gibbs(self):
+        matches = [analyze.Match(self.players[:2], 1, "partial", True),
+                   analyze.Match(self.players, 1, "unordered")]
+        (orders, likelihood) = analyze.match_likelihood(matches,
+                                                        self.evaluator)
+        table = orders.order_chances()
+        self.assertEqual((2, 8), table.shape)
+        for (row, match) in zip(table, matches):
+            for order in range(len(analyze.match_orderings(match))):
+                self.assertAlmostEqual(self.evaluator.eval_with_order(
+                    match.players, match.winning_team, order,
+                    match.foul_end), row[order])
+        self.assertTrue(np.all(table[0, 2:] == 0))
+
+        step = pm.StepMethods.assign_method(orders)
+        self.assertTrue(isinstance(step, analyze.MatchOrderGibbs))
+        # The players don't move, so neither do the chances
+        orders.order_chances = lambda: table
+        np.random.seed(3)
+        counts = np.zeros(table.shape)
+        for i in range(2000):
+            step.step()
+            counts[[0, 1], orders.value] += 1
+        expected = table / table.sum(axis=1)[:, np.newaxis]
+        self.assertTrue(np.allclose(expected, counts / 2000, atol=0.05))
+
+    def test_order_chances_only_evaluate_latent_matches(self):
+        matches = [analyze.Match(self.players, 0, "total"),
+                   analyze.Match(self.players[:2], 1, "partial", True),
+                   analyze.Match(self.players, 1, "unordered")]
+        batches = []
+        class RecordingMatchEvaluator(analyze.BallCountMatchEvaluator):
+            def eval_batch(self, sink, foul, *args):
+                batches.append(len(sink))
+                return analyze.BallCountMatchEvaluator.eval_batch(
+                    self, sink, foul, *args)
+        (orders, likelihood) = analyze.match_likelihood(
+            matches, RecordingMatchEvaluator())
+        del batches[:]
+        table = orders.order_chances()
+        # A single batch for each number of players, with every order of
+        # the two latent matches and none of the totally ordered one
+        self.assertEqual([2, 8], sorted(batches))
+        self.assertAlmostEqual(self.evaluator.eval_with_order(
+            self.players, 1, 5, False), table[1, 5])
+
+    def test_total_orders(self):
+        matches = [analyze.Match(self.players, 0, "total"),
+                   analyze.Match(self.players, 1, "total")]
+        (likelihood,) = analyze.match_likelihood(matches, self.evaluator)
+        expected = sum(math.log(self.evaluator.eval_with_order(
+                           match.players, match.winning_team, 0, False))
+                       for match in matches)
+        self.assertAlmostEqual(expected, likelihood.logp)
+
+class TestMarginalizeOrders(unittest.TestCase):
+    def setUp(self):
+        self.players = [analyze.new_player('p%i' % i, 0.3 + 0.1 * i)
+                        for i in range(4)]
+        self.matches = [analyze.Match(self.players, 0, "total"),
+                        analyze.Match(self.players[:2], 1, "partial", True),
+                        analyze.Match(self.players, 1, "unordered")]
+        self.evaluator = analyze.BallCountMatchEvaluator()
+        self.expected = [
+            self.evaluator.eval_with_order(self.players, 0, 0, False),
+            self.evaluator.eval_partial_ordered(self.players[:2], 1, True),
+            self.evaluator.eval_unordered(self.players, 1, False)]
+
+    def test_all_matches(self):
+        match_vars = analyze.all_matches(self.matches, self.evaluator,
+                                         marginalize_orders=True)
+        for (match_var, chance) in zip(match_vars, self.expected):
+            self.assertAlmostEqual(chance, match_var.value)
+            self.assertFalse(any(isinstance(parent, pm.Stochastic) and
+                                 parent.__name__.endswith('_order')
+                                 for parent in match_var.extended_parents))
+
+    def test_all_matches_batch(self):
+        (batch_var,) = analyze.all_matches(self.matches, self.evaluator,
+                                           batch=True,
+                                           marginalize_orders=True)
+        for (chance, expected) in zip(batch_var.value, self.expected):
+            self.assertAlmostEqual(expected, chance)
+
+    def test_match_likelihood(self):
+        (likelihood,) = analyze.match_likelihood(self.matches, self.evaluator,
+                                                 marginalize_orders=True)
+        self.assertAlmostEqual(sum(map(math.log, self.expected)),
+                               likelihood.logp)
+
+class TestPlayerPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = analyze.PlayerPool(['a', 'b', 'c', 'd'])
+        self.pool.sink.value = [0.3, 0.4, 0.5, 0.6]
+        self.pool.foul_end.value = [0.01, 0.02, 0.03, 0.04]
+        self.players = [self.pool.player(i) for i in range(4)]
+        self.evaluator = analyze.BallCountMatchEvaluator()
+
+    def test_balance(self):
+        self.assertEqual(0.0, self.pool.balance.logp)
+        self.pool.foul_end.value = [0.01, 0.02, 0.6, 0.04]
+        with self.assertRaises(pm.ZeroProbability):
+            self.pool.balance.logp
+
+    def test_indexed_matches(self):
+        indexed = analyze.IndexedMatches([[0, 1, 2, 3], [2, 1]], [0, 1],
+                                         [False, True], [[0, 1], [1]])
+        chances = indexed.eval(self.evaluator, self.pool.sink.value,
+                               self.pool.foul_end.value)
+        expected = analyze.eval_matches(self.evaluator,
+                                        [self.players,
+                                         [self.players[2], self.players[1]]],
+                                        [0, 1], [False, True], [[0, 1], [1]])
+        for (e, a) in zip(expected, chances):
+            self.assertAlmostEqual(e, a)
+
+    def test_match_likelihood(self):
+        pool_matches = [analyze.Match([0, 1, 2, 3], 0, "total"),
+                        analyze.Match([2, 1], 1, "partial", True)]
+        matches = [analyze.Match(self.players, 0, "total"),
+                   analyze.Match([self.players[2], self.players[1]], 1,
+                                 "partial", True)]
+        for marginalize_orders in (False, True):
+            expected = analyze.match_likelihood(matches, self.evaluator,
+                                                marginalize_orders)
+            actual = analyze.match_likelihood(pool_matches, self.evaluator,
+                                              marginalize_orders,
+                                              pool=self.pool)
+            self.assertEqual(len(expected), len(actual))
+            self.assertAlmostEqual(expected[-1].logp, actual[-1].logp)
+
+class CountingMatchEvaluator(analyze.BallCountMatchEvaluator):
+    def __init__(self):
+        analyze.BallCountMatchEvaluator.__init__(self)
+        self.calls = 0
+
+    def eval_starts(self, players, winning_team, foul_end):
+        self.calls += 1
+        return analyze.BallCountMatchEvaluator.eval_starts(self, players,
+                                                           winning_team,
+                                                           foul_end)
+
+class TestCachedMatchEvaluator(unittest.TestCase):
+    players = [{'sink': 0.5, 'foul_end': 0.1},
+               {'sink': 0.25, 'foul_end': 0.2}]
+
+    def test_hits_and_misses(self):
+        inner = CountingMatchEvaluator()
+        evaluator = analyze.CachedMatchEvaluator(inner)
+        first = evaluator.eval_with_order(self.players, 0, 1, False)
+        second = evaluator.eval_with_order(self.players, 0, 1, False)
+        self.assertEqual(first, second)
+        self.assertEqual(inner.eval_with_order(self.players, 0, 1, False),
+                         first)
+        self.assertEqual(1, evaluator.cache_info().hits)
+        self.assertEqual(1, evaluator.cache_info().misses)
+
+    def test_unordered_is_cached(self):
+        inner = CountingMatchEvaluator()
+        evaluator = analyze.CachedMatchEvaluator(inner)
+        first = evaluator.eval_partial_ordered(self.players, 0, True)
+        calls = inner.calls
+        second = evaluator.eval_partial_ordered(self.players, 0, True)
+        self.assertEqual(first, second)
+        self.assertEqual(calls, inner.calls)
+
+    def test_marginalized_matches_are_cached(self):
+        inner = CountingMatchEvaluator()
+        evaluator = analyze.CachedMatchEvaluator(inner)
+        players = [analyze.new_player('p%i' % i, 0.3 + 0.1 * i)
+                   for i in range(2)]
+        match = analyze.Match(players, 0, "partial")
+        match_vars = analyze.all_matches([match, match], evaluator,
+                                         marginalize_orders=True)
+        self.assertEqual(match_vars[0].value, match_vars[1].value)
+        self.assertEqual(1, inner.calls)
+        self.assertEqual(1, evaluator.cache_info().hits)
+
+    def test_eval_batch(self):
+        inner = analyze.BallCountMatchEvaluator()
+        evaluator = analyze.CachedMatchEvaluator(inner, quantum=1e-3)
+        sink = [[0.5, 0.25], [0.3, 0.6], [0.5, 0.25]]
+        foul = [[0.1, 0.2], [0.05, 0.1], [0.1, 0.2]]
+        args = ([0, 1, 0], [1, 0, 1], [False, True, False])
+        expected = inner.eval_batch(sink, foul, *args)
+        self.assertTrue(np.allclose(expected,
+                                    evaluator.eval_batch(sink, foul, *args)))
+        self.assertEqual(1, evaluator.cache_info().hits)
+        self.assertEqual(2, evaluator.cache_info().misses)
+
+        nearby = np.array(sink) + 1e-5
+        self.assertTrue(np.allclose(expected,
+                                    evaluator.eval_batch(nearby, foul, *args)))
+        self.assertEqual(4, evaluator.cache_info().hits)
+        self.assertEqual(2, evaluator.cache_info().misses)
+
+    def test_different_values_miss(self):
+        evaluator = analyze.CachedMatchEvaluator(CountingMatchEvaluator())
+        evaluator.eval(self.players, 0, False)
+        other_players = [{'sink': 0.5, 'foul_end': 0.1},
+                         {'sink': 0.25, 'foul_end': 0.2000001}]
+        evaluator.eval(other_players, 0, False)
+        evaluator.eval(self.players, 1, False)
+        evaluator.eval(self.players, 0, True)
+        self.assertEqual(0, evaluator.cache_info().hits)
+        self.assertEqual(4, evaluator.cache_info().misses)
+
+    def test_quantum(self):
+        evaluator = analyze.CachedMatchEvaluator(CountingMatchEvaluator(),
+                                                 quantum=1e-3)
+        evaluator.eval(self.players, 0, False)
+        other_players = [{'sink': 0.5, 'foul_end': 0.1},
+                         {'sink': 0.25, 'foul_end': 0.2000001}]
+        evaluator.eval(other_players, 0, False)
+        self.assertEqual(1, evaluator.cache_info().hits)
+
+    def test_quantum_halves_round_up(self):
+        evaluator = analyze.CachedMatchEvaluator(CountingMatchEvaluator(),
+                                                 quantum=0.5)
+        values = [0.25, 0.75, 1.25]
+        self.assertEqual([1, 2, 3], map(evaluator._key_value, values))
+        self.assertEqual([1, 2, 3],
+                         list(evaluator._quantize(np.array(values))))
+
+    def test_least_recently_used_is_evicted(self):
+        evaluator = analyze.CachedMatchEvaluator(CountingMatchEvaluator(),
+                                                 maxsize=2)
+        evaluator.eval(self.players, 0, False)
+        evaluator.eval(self.players, 1, False)
+        evaluator.eval(self.players, 0, False)
+        evaluator.eval(self.players, 0, True)
+        self.assertEqual(2, evaluator.cache_info().currsize)
+        evaluator.eval(self.players, 0, False)
+        self.assertEqual(2, evaluator.cache_info().hits)
+        evaluator.eval(self.players, 1, False)
+        self.assertEqual(2, evaluator.cache_info().hits)
+
+    def test_cache_clear(self):
+        evaluator = analyze.CachedMatchEvaluator(CountingMatchEvaluator())
+        evaluator.eval(self.players, 0, False)
+        evaluator.cache_clear()
+        self.assertEqual((0, 0, 10000, 0), tuple(evaluator.cache_info()))
+
+class TestMatchEvalSparseMarkov(unittest.TestCase):
+    def setUp(self):
+        self.markov_analyzer = analyze.NumericMarkovMatchEvaluator()
+        self.sparse_analyzer = analyze.SparseMarkovMatchEvaluator()
+
+    def test_matches_dense(self):
+        players = [{'sink': 0.5, 'foul_end': 0.05},
+                   {'sink': 0.4, 'foul_end': 0.02},
+                   {'sink': 0.3, 'foul_end': 0.05},
+                   {'sink': 0.6, 'foul_end': 0.01}]
+        for winning_team in (0, 1):
+            for foul_end in (False, True):
+                expected = self.markov_analyzer.eval_starts(players,
+                                                            winning_team,
+                                                            foul_end)
+                actual = self.sparse_analyzer.eval_starts(players,
+                                                          winning_team,
+                                                          foul_end)
+                for (e, a) in zip(expected, actual):
+                    self.assertAlmostEqual(e, a)
+
+    def test_eval_batch(self):
+        sink = [[0.5, 0.25], [0.3, 0.6]]
+        foul = [[0.1, 0.2], [0.05, 0.01]]
+        expected = self.markov_analyzer.eval_batch(sink, foul, [0, 1], [0, 1],
+                                                   [False, True])
+        actual = self.sparse_analyzer.eval_batch(sink, foul, [0, 1], [0, 1],
+                                                 [False, True])
+        for (e, a) in zip(expected, actual):
+            self.assertAlmostEqual(e, a)
+
 class TestBuildSymbolicMarkovChain(unittest.TestCase):
     def setUp(self):
         self.analyzer = analyze.NumericMarkovMatchEvaluator()
@@ -0,0 +1,110 @@
+import unittest
+import numpy as np
+import os
+import shutil
+import tempfile
+import analyzer.analyze as analyze
+import analyzer.compiled as compiled
+
+class TestCompiledMatchEvaluator(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.ball_count_analyzer = analyze.BallCountMatchEvaluator(3)
+        self.compiled_analyzer = compiled.CompiledMatchEvaluator(3,
+                                                                 self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def assert_matches_ball_count(self, players):
+        for winning_team in (0, 1):
+            for foul_end in (False, True):
+                expected = self.ball_count_analyzer.eval_starts(
+                    players, winning_team, foul_end)
+                actual = self.compiled_analyzer.eval_starts(
+                    players, winning_team, foul_end)
+                for (e, a) in zip(expected, actual):
+                    self.assertAlmostEqual(e, a)
+
+    def test_two_players(self):
+        self.assert_matches_ball_count([{'sink': 0.5, 'foul_end': 0.1},
+                                        {'sink': 0.25, 'foul_end': 0.2}])
+
+    def test_four_players(self):
+        self.assert_matches_ball_count([{'sink': 0.5, 'foul_end': 0.05},
+                                        {'sink': 0.4, 'foul_end': 0.02},
+                                        {'sink': 0.3, 'foul_end': 0.05},
+                                        {'sink': 0.6, 'foul_end': 0.01}])
+
+    def test_eval_batch(self):
+        sink = np.array([[0.5, 0.4, 0.3, 0.6], [0.2, 0.3, 0.4, 0.5]])
+        foul = np.array([[0.05, 0.02, 0.05, 0.01], [0.1, 0.0, 0.05, 0.02]])
+        winning_team = np.array([0, 1])
+        order = np.array([1, 5])
+        foul_end = np.array([False, True])
+        expected = self.ball_count_analyzer.eval_batch(sink, foul,
+                                                       winning_team, order,
+                                                       foul_end)
+        actual = self.compiled_analyzer.eval_batch(sink, foul, winning_team,
+                                                   order, foul_end)
+        np.testing.assert_allclose(expected, actual)
+
+    def test_kernel_saved(self):
+        players = [{'sink': 0.5, 'foul_end': 0.1},
+                   {'sink': 0.25, 'foul_end': 0.2}]
+        expected = self.compiled_analyzer.eval(players, 0, False)
+        path = compiled._kernel_path(self.cache_dir, 2, 3)
+        self.assertTrue(os.path.exists(path))
+
+        # A saved kernel is loaded instead of derived again
+        with open(path) as kernel_file:
+            source = kernel_file.read().partition('\n')[2]
+        with open(path, 'w') as kernel_file:
+            kernel_file.write(compiled._kernel_file(
+                source + 'KERNEL_LOADED = True\n'))
+        kernel = compiled.load_kernel(2, 3, self.cache_dir)
+        self.assertTrue(kernel.__globals__['KERNEL_LOADED'])
+        self.assertAlmostEqual(expected, kernel([0.5, 0.25], [0.1, 0.2])[0][0])
+
+    def test_changed_kernel_derived(self):
+        players = [{'sink': 0.5, 'foul_end': 0.1},
+                   {'sink': 0.25, 'foul_end': 0.2}]
+        expected = self.compiled_analyzer.eval(players, 0, False)
+        path = compiled._kernel_path(self.cache_dir, 2, 3)
+        with open(path) as kernel_file:
+            saved = kernel_file.read()
+
+        # A kernel that doesn't match its hashes is derived again and saved
+        # over the changed one
+        with open(path, 'a') as kernel_file:
+            kernel_file.write('KERNEL_LOADED = True\n')
+        kernel = compiled.load_kernel(2, 3, self.cache_dir)
+        self.assertFalse('KERNEL_LOADED' in kernel.__globals__)
+        self.assertAlmostEqual(expected, kernel([0.5, 0.25], [0.1, 0.2])[0][0])
+        with open(path) as kernel_file:
+            self.assertEqual(saved, kernel_file.read())
+
+    def test_kernel_mode(self):
+        cache_dir = os.path.join(self.cache_dir, 'mode')
+        umask = os.umask(0022)
+        try:
+            compiled.load_kernel(2, 3, cache_dir)
+        finally:
+            os.umask(umask)
+        path = compiled._kernel_path(cache_dir, 2, 3)
+        self.assertEqual(0644, os.stat(path).st_mode & 0777)
+
+    def test_kernel_path_hashes_source(self):
+        path = compiled._kernel_path(self.cache_dir, 2, 3)
+        self.assertTrue(compiled.kernel_hash() in os.path.basename(path))
+
+    def test_not_cached_by_default(self):
+        analyzer = compiled.CompiledMatchEvaluator(3)
+        self.assertEqual(None, analyzer.cache_dir)
+
+    def test_no_cache_dir(self):
+        analyzer = compiled.CompiledMatchEvaluator(3, None)
+        players = [{'sink': 0.5, 'foul_end': 0.1},
+                   {'sink': 0.25, 'foul_end': 0.2}]
+        self.assertAlmostEqual(self.ball_count_analyzer.eval(players, 1, True),
+                               analyzer.eval(players, 1, True))
@@ -0,0 +1,72 @@
+import unittest
+import numpy as np
+import analyzer.diagnostics as diagnostics
+
+class TestGelmanRubin(unittest.TestCase):
+    def test_agreeing_chains(self):
+        chains = np.random.RandomState(1).normal(size=(4, 1000))
+        self.assertAlmostEqual(1.0, diagnostics.gelman_rubin(chains),
+                               places=2)
+
+    def test_disagreeing_chains(self):
+        chains = np.random.RandomState(2).normal(size=(4, 1000))
+        chains[0] += 5
+        self.assertGreater(diagnostics.gelman_rubin(chains), 1.5)
+
+    def test_array_variable(self):
+        chains = np.random.RandomState(3).normal(size=(3, 500, 2))
+        chains[0, :, 1] += 5
+        r_hat = diagnostics.gelman_rubin(chains)
+        self.assertEqual((2,), r_hat.shape)
+        self.assertLess(r_hat[0], 1.1)
+        self.assertGreater(r_hat[1], 1.5)
+
+    def test_one_chain(self):
+        with self.assertRaises(ValueError):
+            diagnostics.gelman_rubin(np.zeros((1, 100)))
+
+class TestEffectiveSampleSize(unittest.TestCase):
+    def test_independent_draws(self):
+        chains = np.random.RandomState(4).normal(size=(4, 1000))
+        ess = diagnostics.effective_sample_size(chains)
+        self.assertGreater(ess, 3000)
+        self.assertLess(ess, 5000)
+
+    def test_correlated_draws(self):
+        # An AR(1) process with a coefficient of 0.9 has an effective sample
+        # size of about (1 - 0.9) / (1 + 0.9) of the draws
+        random = np.random.RandomState(5)
+        noise = random.normal(size=(4, 5000))
+        chains = np.zeros((4, 5000))
+        for t in range(1, 5000):
+            chains[:, t] = 0.9 * chains[:, t - 1] + noise[:, t]
+        ess = diagnostics.effective_sample_size(chains)
+        self.assertGreater(ess, 0.5 * 20000 / 19)
+        self.assertLess(ess, 1.5 * 20000 / 19)
+
+    def test_array_variable(self):
+        chains = np.random.RandomState(6).normal(size=(2, 200, 3))
+        self.assertEqual((3,), diagnostics.effective_sample_size(chains).shape)
+
+class TestSplitChains(unittest.TestCase):
+    def test_split(self):
+        chains = diagnostics.split_chains(np.arange(7))
+        np.testing.assert_array_equal([[1, 2, 3], [4, 5, 6]], chains)
+
+    def test_array_variable(self):
+        chains = diagnostics.split_chains(np.zeros((10, 3)), 5)
+        self.assertEqual((5, 2, 3), chains.shape)
+
+class TestGeweke(unittest.TestCase):
+    def test_settled(self):
+        trace = np.random.RandomState(7).normal(size=2000)
+        self.assertLess(abs(diagnostics.geweke(trace)), 3)
+
+    def test_drifting(self):
+        random = np.random.RandomState(8)
+        trace = random.normal(size=2000) + np.linspace(5, 0, 2000)
+        self.assertGreater(abs(diagnostics.geweke(trace)), 3)
+
+    def test_too_short(self):
+        with self.assertRaises(ValueError):
+            diagnostics.geweke(np.zeros(5))
@@ -0,0 +1,39 @@
+import unittest
+import os
+import shutil
+import tempfile
+import analyzer.files as files
+
+class TestFiles(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'file.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replace_file(self):
+        files.replace_file(self.path, 'old')
+        files.replace_file(self.path, 'new')
+        with open(self.path) as replaced:
+            self.assertEqual('new', replaced.read())
+        self.assertEqual(['file.txt'], os.listdir(self.directory))
+
+    def test_file_mode(self):
+        umask = os.umask(0027)
+        try:
+            self.assertEqual(0640, files.file_mode(self.path))
+            files.replace_file(self.path, 'new')
+        finally:
+            os.umask(umask)
+        self.assertEqual(0640, os.stat(self.path).st_mode & 0777)
+        os.chmod(self.path, 0600)
+        self.assertEqual(0600, files.file_mode(self.path))
+
+    def test_failed_write_keeps_file(self):
+        files.replace_file(self.path, 'old')
+        self.assertRaises(UnicodeEncodeError, files.replace_file, self.path,
+                          u'\xe9')
+        with open(self.path) as kept:
+            self.assertEqual('old', kept.read())
+        self.assertEqual(['file.txt'], os.listdir(self.directory))
@@ -1,6 +1,8 @@
 import unittest
 import analyzer.analyze as analyze
 import analyzer.loader as loader
+import analyzer.posterior as posterior
+import numpy as np
 
 player_lookup = {}
 player_lookup['a'] = 'a'
@@ -114,3 +116,46 @@ class TestJsonToMatches(unittest.TestCase):
         self.assertEqual(matches[0].players[0], matches[1].players[1])
         # player a does not equal player b
         self.assertNotEqual(matches[0].players[0], matches[0].players[1])
+
+    def test_summary(self):
+        summary = posterior.update(posterior.empty(), 3,
+                                   {'a': {'sink': [0.6, 0.7, 0.8],
+                                          'foul_end': [0.01, 0.02, 0.03]}})
+        matches_json = [{'winners': ['a'], 'losers': ['b']}]
+        matches = loader.json_to_matches(matches_json, summary)
+        (a, b) = matches[0].players
+        self.assertAlmostEqual(0.7, a['sink'].value)
+        self.assertAlmostEqual(0.02, a['foul_end'].value)
+        self.assertEqual(summary['players']['a']['sink']['alpha'],
+                         a['sink'].parents['alpha'])
+        self.assertEqual(0.5, b['sink'].value)
+        self.assertEqual(3, b['sink'].parents['alpha'])
+
+class TestJsonToPoolMatches(unittest.TestCase):
+    def test_two_matches(self):
+        matches_json = [{'winners': ['a', 'c'], 'losers': ['b', 'd'],
+                         'ordered': True},
+                        {'players': ['d', 'a'], 'winning-team': 1}]
+        (pool, matches) = loader.json_to_pool_matches(matches_json)
+        self.assertEqual(['a', 'b', 'c', 'd'], pool.names)
+        self.assertEqual([0, 1, 2, 3], matches[0].players)
+        self.assertEqual([3, 0], matches[1].players)
+        self.assertEqual((4,), pool.sink.value.shape)
+
+    def test_summary(self):
+        summary = posterior.update(posterior.empty(), 3,
+                                   {'b': {'sink': [0.6, 0.7, 0.8],
+                                          'foul_end': [0.01, 0.02, 0.03]}})
+        matches_json = [{'winners': ['a'], 'losers': ['b']}]
+        (pool, matches) = loader.json_to_pool_matches(matches_json, summary)
+        # a isn't in the summary, so gets the same defaults as a new player
+        (default_alpha, default_beta) = analyze.DEFAULT_PRIOR
+        self.assertTrue(np.allclose([analyze.DEFAULT_SINK, 0.7],
+                                    pool.sink.value))
+        (alpha, beta) = posterior.beta_parameters(0.7, np.var([0.6, 0.7, 0.8]))
+        self.assertTrue(np.allclose([default_alpha, alpha],
+                                    pool.sink.parents['alpha']))
+        self.assertTrue(np.allclose([default_beta, beta],
+                                    pool.sink.parents['beta']))
+        self.assertTrue(np.allclose([analyze.DEFAULT_FOUL, 0.02],
+                                    pool.foul_end.value))
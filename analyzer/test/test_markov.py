@@ -1,5 +1,6 @@
 import analyzer.markov as markov
 import unittest
+import numpy as np
 import abc_markov
 
 class ChainTest(abc_markov.AbstractChainTest, unittest.TestCase):
@@ -36,17 +37,107 @@ class ChainTest(abc_markov.AbstractChainTest, unittest.TestCase):
         self.assertAlmostEqual(0.625, results[suburban])
         self.assertAlmostEqual(0.375, results[city])
         
-    def test_swap_indicies(self):
-        chain = markov.Chain()
-        one = chain.new_state('one')
-        two = chain.new_state('two')
-        chain.set_transition(one, two, 0.12)
-        chain.set_transition(two, one, 0.21)
-        chain.matrix = chain._fill_in_diagonal_transistions(chain.matrix)
-        before0x0 = chain.matrix[0,0]
-        before1x1 = chain.matrix[1,1]
-        chain._swap_indices(chain.matrix, 0, 1)
-        # The old 0x0 value should now be at 1x1
-        self.assertEqual(before0x0, chain.matrix[1,1])
-        # The old 1x1 value should now be at 0x0
-        self.assertEqual(before1x1, chain.matrix[0,0])
+    def test_column_greater_than_one(self):
+        chain = markov.Chain()
+        (start, one, two) = chain.new_states(['start', 'one', 'two'])
+        chain.set_transition(start, one, 0.75)
+        chain.set_transition(start, two, 0.5)
+        with self.assertRaisesRegexp(Exception, "from state start"):
+            chain.steady_state()
+
+    def test_workspaces_reused(self):
+        chain = markov.Chain()
+        (city, suburban) = chain.new_states(['city', 'suburban'])
+        chain.set_transition(city, suburban, 0.4)
+        chain.set_transition(suburban, city, 0.3)
+        self.assertFalse(isinstance(chain.matrix, np.matrix))
+        first = chain.steady_state(city)
+        filled = chain._workspaces['filled']
+        state = chain._workspaces['state']
+        second = chain.steady_state(city)
+        self.assertIs(filled, chain._workspaces['filled'])
+        self.assertIs(state, chain._workspaces['state'])
+        self.assertEqual(first, second)
+        self.assertEqual(0., chain.matrix[0, 0])
+
+    def test_copies_have_own_workspaces(self):
+        chain = markov.Chain()
+        (start, win, lose) = chain.new_states(['start', 'win', 'lose'])
+        chain.set_transition(start, win, 0.25)
+        chain.set_transition(start, lose, 0.5)
+        copy = chain.empty_copy()
+        copy.set_transition(start, win, 0.5)
+        copy.set_transition(start, lose, 0.25)
+        first = chain.absorption_vector(start.index)
+        second = copy.absorption_vector(start.index)
+        self.assertIsNot(chain._workspaces, copy._workspaces)
+        self.assertAlmostEqual(1/3., first[win.index])
+        self.assertAlmostEqual(2/3., second[win.index])
+        chain.absorption_vector(start.index)
+        self.assertAlmostEqual(1/3., first[win.index])
+        self.assertAlmostEqual(2/3., second[win.index])
+
+    def test_replace_transitions(self):
+        chain = markov.Chain()
+        (one, two, three) = chain.new_states(['one', 'two', 'three'])
+        chain.set_known_transitions([0, 1], [1, 0], [0.5, 0.25])
+        matrix = chain.matrix
+        chain.replace_transitions([0], [2], [0.75])
+        self.assertIs(matrix, chain.matrix)
+        self.assertEqual(0, chain.get_transition(one, two))
+        self.assertEqual(0, chain.get_transition(two, one))
+        self.assertEqual(0.75, chain.get_transition(one, three))
+        with self.assertRaises(Exception):
+            chain.replace_transitions([0], [2], [1.5])
+        self.assertEqual(0.75, chain.get_transition(one, three))
+
+    def test_set_transitions_invalid_chance(self):
+        chain = markov.Chain()
+        (one, two) = chain.new_states(['one', 'two'])
+        with self.assertRaises(Exception):
+            chain.set_transitions([0, 1], [1, 0], [0.5, -0.1])
+        self.assertEqual(0, chain.get_transition(one, two))
+
+    def test_nan_chance(self):
+        chain = markov.Chain()
+        (one, two) = chain.new_states(['one', 'two'])
+        with self.assertRaises(Exception):
+            chain.set_transition(one, two, float('nan'))
+        with self.assertRaises(Exception):
+            chain.set_transitions([0, 1], [1, 0], [0.5, float('nan')])
+        self.assertEqual(0, chain.get_transition(one, two))
+
+    def test_absorption_distribution_matches_steady_state(self):
+        chain = markov.Chain()
+        (start, middle, win, lose) = chain.new_states(['start', 'middle',
+                                                       'win', 'lose'])
+        chain.set_transition(start, middle, 0.999)
+        chain.set_transition(start, win, 0.0005)
+        chain.set_transition(middle, start, 0.999)
+        chain.set_transition(middle, lose, 0.001)
+        steady = chain.steady_state(start)
+        distribution = chain.absorption_distribution(start)
+        self.assertAlmostEqual(steady[win], distribution[win], places=5)
+        self.assertAlmostEqual(steady[lose], distribution[lose], places=5)
+        self.assertAlmostEqual(1.0, distribution[win] + distribution[lose])
+
+    def test_absorption_distribution_not_absorbing(self):
+        chain = markov.Chain()
+        (one, two, three) = chain.new_states(['one', 'two', 'three'])
+        chain.set_transition(one, two, 1.0)
+        chain.set_transition(two, one, 1.0)
+        with self.assertRaises(ValueError):
+            chain.absorption_distribution(one)
+        with self.assertRaises(ValueError):
+            chain.absorption_distribution(one, check=True)
+
+    def test_absorption_vector_only_walks_chain_with_check(self):
+        chain = markov.Chain()
+        (start, win) = chain.new_states(['start', 'win'])
+        chain.set_transition(start, win, 0.5)
+        def walk():
+            raise AssertionError("The chain was walked")
+        chain._reachability = walk
+        self.assertAlmostEqual(1.0, chain.absorption_vector(0)[1])
+        with self.assertRaises(AssertionError):
+            chain.absorption_vector(0, check=True)
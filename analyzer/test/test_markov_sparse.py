@@ -0,0 +1,86 @@
+import analyzer.markov as markov
+import analyzer.markov_sparse as markov_sparse
+import scipy.sparse as sps
+import unittest
+import abc_markov
+
+class SparseChainTest(abc_markov.AbstractChainTest, unittest.TestCase):
+
+    def _createChain(self):
+        return markov_sparse.Chain()
+
+    def _createDummyTransitionValue(self):
+        return 0.5
+
+    def _chanceOfCoinFlip(self):
+        return 0.5
+
+    def test_steady_state(self):
+        chain = markov_sparse.Chain()
+        city = chain.new_state()
+        suburban = chain.new_state()
+        chain.set_transition(city, suburban, 0.4)
+        chain.set_transition(suburban, city, 0.3)
+        results = chain.steady_state()
+        self.assertAlmostEqual(0.57142857, results[suburban])
+        self.assertAlmostEqual(0.42857143, results[city])
+
+    def test_set_transitions_invalid_chance(self):
+        chain = markov_sparse.Chain()
+        chain.new_states(['one', 'two'])
+        with self.assertRaises(Exception):
+            chain.set_transitions([0], [1], [1.5])
+
+    def test_set_transitions_nan_chance(self):
+        chain = markov_sparse.Chain()
+        chain.new_states(['one', 'two'])
+        with self.assertRaises(Exception):
+            chain.set_transitions([0], [1], [float('nan')])
+
+    def test_absorption_distribution_not_absorbing(self):
+        chain = markov_sparse.Chain()
+        (one, two, three) = chain.new_states(['one', 'two', 'three'])
+        chain.set_transition(one, two, 0.5)
+        chain.set_transition(two, one, 0.5)
+        with self.assertRaises(ValueError):
+            chain.absorption_distribution(one)
+
+    def test_matches_dense(self):
+        labels = ['a', 'b', 'c', 'd', 'e']
+        dense = markov.Chain.with_states(labels)
+        sparse = markov_sparse.Chain.with_states(labels)
+        for chain in (dense, sparse):
+            chain.set_transitions([0, 0, 1, 1, 2, 2],
+                                  [1, 3, 0, 2, 4, 3],
+                                  [0.5, 0.25, 0.3, 0.6, 0.1, 0.2])
+
+        dense_probs = dense.get_absorbing_probabilities()
+        sparse_probs = sparse.get_absorbing_probabilities()
+        for label in ['a', 'b', 'c']:
+            for end in ['d', 'e']:
+                self.assertAlmostEqual(
+                    dense_probs[dense.get_state(label)][dense.get_state(end)],
+                    sparse_probs[sparse.get_state(label)][sparse.get_state(end)])
+
+        dense_distribution = dense.absorption_distribution()
+        sparse_distribution = sparse.absorption_distribution()
+        for label in labels:
+            self.assertAlmostEqual(dense_distribution[dense.get_state(label)],
+                                   sparse_distribution[sparse.get_state(label)])
+
+    def test_replace_transitions(self):
+        labels = ['a', 'b', 'c', 'd']
+        dense = markov.Chain.with_states(labels)
+        sparse = markov_sparse.Chain.with_states(labels)
+        for chain in (dense, sparse):
+            chain.set_transitions([0, 1], [2, 3], [0.5, 0.5])
+            chain.replace_transitions([0, 0, 1], [1, 3, 2], [0.5, 0.25, 0.3])
+        self.assertTrue(sps.isspmatrix_csc(sparse.matrix))
+        self.assertTrue((dense.matrix == sparse.matrix.toarray()).all())
+
+        # Single transitions can still be set afterwards
+        for chain in (dense, sparse):
+            chain.set_transition(chain.get_state('b'), chain.get_state('d'),
+                                 0.1)
+        self.assertTrue(sps.isspmatrix_lil(sparse.matrix))
+        self.assertTrue((dense.matrix == sparse.matrix.toarray()).all())
@@ -0,0 +1,133 @@
+import unittest
+import numpy as np
+import os
+import shutil
+import tempfile
+import analyzer.posterior as posterior
+
+class TestBetaParameters(unittest.TestCase):
+    def test_moments(self):
+        (alpha, beta) = posterior.beta_parameters(0.3, 0.01)
+        mean = alpha / (alpha + beta)
+        variance = alpha * beta / ((alpha + beta) ** 2 * (alpha + beta + 1))
+        self.assertAlmostEqual(0.3, mean)
+        self.assertAlmostEqual(0.01, variance)
+
+    def test_constant_draws(self):
+        (alpha, beta) = posterior.beta_parameters(0.3, 0.)
+        self.assertTrue(np.isfinite(alpha) and alpha > 0)
+        self.assertTrue(np.isfinite(beta) and beta > 0)
+
+    def test_too_wide(self):
+        (alpha, beta) = posterior.beta_parameters(0.5, 1.)
+        self.assertTrue(alpha > 0 and beta > 0)
+
+    def test_parameters_at_least_one(self):
+        (alpha, beta) = posterior.beta_parameters(0.3, 0.2)
+        self.assertEqual(1., min(alpha, beta))
+
+    def test_mean_out_of_range(self):
+        with self.assertRaises(ValueError):
+            posterior.beta_parameters(0., 0.01)
+
+class TestSummary(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(2)
+        self.draws = {'a': {'sink': np.random.beta(6, 4, 5000),
+                            'foul_end': np.random.beta(1, 50, 5000)}}
+
+    def test_update(self):
+        summary = posterior.update(posterior.empty(), 10, self.draws)
+        self.assertEqual(10, summary['matches'])
+        sink = summary['players']['a']['sink']
+        self.assertAlmostEqual(0.6, sink['mean'], places=2)
+        self.assertAlmostEqual(6, sink['alpha'], delta=0.5)
+        self.assertAlmostEqual(4, sink['beta'], delta=0.5)
+
+    def test_update_near_constant(self):
+        draws = np.full(1000, 1e-10)
+        draws[500:] += np.linspace(0, 1e-4, 500)
+        summary = posterior.update(posterior.empty(), 10,
+                                   {'a': {'sink': self.draws['a']['sink'],
+                                          'foul_end': draws}})
+        foul_end = summary['players']['a']['foul_end']
+        self.assertEqual(1., foul_end['alpha'])
+        self.assertTrue(foul_end['beta'] > 1.)
+
+    def test_update_constant(self):
+        summary = posterior.update(posterior.empty(), 10,
+                                   {'a': {'sink': np.full(100, 0.5),
+                                          'foul_end': np.full(100, 0.01)}})
+        for attribute in posterior.ATTRIBUTES:
+            fitted = summary['players']['a'][attribute]
+            concentration = fitted['alpha'] + fitted['beta']
+            self.assertTrue(concentration <= posterior.MAX_CONCENTRATION + 1)
+            self.assertAlmostEqual(fitted['mean'], fitted['alpha'] /
+                                   concentration, places=2)
+
+    def test_update_keeps_other_players(self):
+        summary = posterior.update(posterior.empty(), 10, self.draws)
+        draws = {'b': self.draws['a']}
+        summary = posterior.update(summary, 12, draws)
+        self.assertEqual(set(['a', 'b']), set(summary['players']))
+        self.assertEqual(12, summary['matches'])
+
+    def test_matches_hash_ignores_layout(self):
+        self.assertEqual(posterior.matches_hash([{'a': 1, 'b': [2, 3]}]),
+                         posterior.matches_hash([{'b': [2, 3], 'a': 1}]))
+        self.assertNotEqual(posterior.matches_hash([{'a': 1}]),
+                            posterior.matches_hash([{'a': 2}]))
+
+    def test_new_matches(self):
+        matches = [{'winner': 'a'}, {'winner': 'b'}, {'winner': 'c'}]
+        summary = posterior.update(posterior.empty(), 2, self.draws,
+                                   posterior.matches_hash(matches[:2]))
+        self.assertEqual(matches[2:], posterior.new_matches(summary, matches))
+        self.assertEqual([], posterior.new_matches(summary, matches[:2]))
+        with self.assertRaises(ValueError):
+            posterior.new_matches(summary, matches[:1])
+        with self.assertRaises(ValueError):
+            posterior.new_matches(summary, matches[1:])
+
+    def test_new_matches_without_hash(self):
+        matches = [{'winner': 'a'}, {'winner': 'b'}]
+        summary = posterior.update(posterior.empty(), 1, self.draws)
+        del summary['matches_hash']
+        self.assertEqual(matches[1:], posterior.new_matches(summary, matches))
+        self.assertEqual(matches, posterior.new_matches(posterior.empty(),
+                                                        matches))
+
+    def test_player_arguments(self):
+        summary = posterior.update(posterior.empty(), 10, self.draws)
+        arguments = posterior.player_arguments(summary, 'a')
+        sink = summary['players']['a']['sink']
+        self.assertEqual(sink['mean'], arguments['sink'])
+        self.assertEqual((sink['alpha'], sink['beta']),
+                         arguments['sink_prior'])
+        self.assertEqual({}, posterior.player_arguments(summary, 'b'))
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'posterior.json')
+            self.assertEqual(posterior.empty(), posterior.load(path))
+            summary = posterior.update(posterior.empty(), 10, self.draws)
+            posterior.save(path, summary)
+            self.assertEqual(summary, posterior.load(path))
+            self.assertEqual(['posterior.json'], os.listdir(directory))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_save_keeps_mode(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'posterior.json')
+            posterior.save(path, posterior.empty())
+            umask = os.umask(0)
+            os.umask(umask)
+            self.assertEqual(0666 & ~umask, os.stat(path).st_mode & 0777)
+            os.chmod(path, 0640)
+            posterior.save(path, posterior.empty())
+            self.assertEqual(0640, os.stat(path).st_mode & 0777)
+        finally:
+            shutil.rmtree(directory)
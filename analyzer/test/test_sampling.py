@@ -0,0 +1,336 @@
+import unittest
+import os
+import shutil
+import tempfile
+import pymc as pm
+import numpy as np
+import analyzer.analyze as analyze
+import analyzer.sampling as sampling
+import analyzer.traces as traces
+
+class TestBuildModel(unittest.TestCase):
+    def setUp(self):
+        self.pool = analyze.PlayerPool(['a', 'b'], sink=0.4, foul=0.01)
+        matches = [analyze.Match([0, 1], 0, "total"),
+                   analyze.Match([1, 0], 1, "partial")]
+        self.likelihood = analyze.match_likelihood(
+            matches, analyze.BallCountMatchEvaluator(),
+            marginalize_orders=True, pool=self.pool)
+        self.nodes = self.pool.nodes() + self.likelihood
+
+    def test_player_stochastics(self):
+        self.assertEqual(set([self.pool.sink, self.pool.foul_end]),
+                         set(sampling.player_stochastics(self.nodes)))
+
+    def test_metropolis(self):
+        model = sampling.build_model(self.nodes, self.pool.nodes())
+        for stochastic in (self.pool.sink, self.pool.foul_end):
+            (step_method,) = model.step_method_dict[stochastic]
+            self.assertTrue(isinstance(step_method, pm.Metropolis))
+            self.assertEqual([stochastic], list(step_method.stochastics))
+
+    def test_adaptive_metropolis(self):
+        model = sampling.build_model(self.nodes, self.pool.nodes(),
+                                     'adaptive-metropolis', delay=10,
+                                     interval=5)
+        (sink_method,) = model.step_method_dict[self.pool.sink]
+        (foul_method,) = model.step_method_dict[self.pool.foul_end]
+        self.assertTrue(sink_method is foul_method)
+        self.assertTrue(isinstance(sink_method, pm.AdaptiveMetropolis))
+        self.assertEqual(10, sink_method.delay)
+        self.assertEqual(5, sink_method.interval)
+        model.sample(30, progress_bar=False)
+        self.assertEqual(30, len(model.trace('players_sink')[:]))
+
+    def test_record_players(self):
+        matches = [analyze.Match([0, 1], 0, "none")]
+        likelihood = analyze.match_likelihood(
+            matches, analyze.BallCountMatchEvaluator(), pool=self.pool)
+        nodes = self.pool.nodes() + likelihood
+        self.assertTrue('match_orders' in [node.__name__ for node in nodes])
+        model = sampling.build_model(nodes, self.pool.nodes())
+        model.sample(5, progress_bar=False)
+        self.assertEqual(5, len(model.trace('players_sink')[:]))
+        with self.assertRaises(KeyError):
+            model.trace('match_orders')
+
+    def test_record(self):
+        model = sampling.build_model(self.nodes, self.pool.nodes(),
+                                     record=[self.pool.sink])
+        model.sample(5, progress_bar=False)
+        self.assertEqual(5, len(model.trace('players_sink')[:]))
+        with self.assertRaises(KeyError):
+            model.trace('players_foul_end')
+
+    def test_no_tuning_traces(self):
+        trace_dir = tempfile.mkdtemp()
+        try:
+            model = sampling.build_model(self.nodes, self.pool.nodes(),
+                                         trace_dir=trace_dir)
+            model.sample(5, progress_bar=False)
+            self.assertEqual(set(['players_sink', 'players_foul_end']),
+                             set(name.split('.')[0]
+                                 for name in os.listdir(trace_dir)
+                                 if name.endswith('.npy')))
+        finally:
+            shutil.rmtree(trace_dir)
+
+    def test_record_diagnostics(self):
+        model = sampling.build_model(self.nodes, self.pool.nodes(),
+                                     record_diagnostics=True)
+        model.sample(5, progress_bar=False)
+        self.assertEqual(5, len(model.trace('deviance')[:]))
+        self.assertEqual(5, len(model.trace(
+            'Metropolis_players_sink_adaptive_scale_factor')[:]))
+
+    def test_unknown_step_method(self):
+        with self.assertRaises(ValueError):
+            sampling.build_model(self.nodes, self.pool.nodes(), 'gibbs')
+
+def build_two_players():
+    pool = analyze.PlayerPool(['a', 'b'], sink=0.4, foul=0.01)
+    matches = [analyze.Match([0, 1], 0, "total"),
+               analyze.Match([1, 0], 1, "partial")]
+    likelihood = analyze.match_likelihood(
+        matches, analyze.BallCountMatchEvaluator(),
+        marginalize_orders=True, pool=pool)
+    return (pool.nodes() + likelihood, pool.nodes())
+
+class TestSampleChains(unittest.TestCase):
+    def test_disperse_initial_values(self):
+        (nodes, player_nodes) = build_two_players()
+        sink = player_nodes[0]
+        sampling.disperse_initial_values(player_nodes)
+        self.assertFalse(np.allclose(0.4, sink.value))
+        self.assertTrue(sampling._allowed(player_nodes))
+
+    def test_disperse_initial_values_seed(self):
+        values = []
+        for attempt in range(2):
+            np.random.seed(1)
+            (nodes, player_nodes) = build_two_players()
+            sampling.disperse_initial_values(player_nodes)
+            values.append(player_nodes[0].value)
+        np.testing.assert_array_equal(values[0], values[1])
+
+    def test_sample_chain(self):
+        traces = sampling.sample_chain(build_two_players, 1, 20)
+        self.assertEqual(set(['players_sink', 'players_foul_end']),
+                         set(traces))
+        self.assertEqual((20, 2), traces['players_sink'].shape)
+
+    def test_sample_chains_trace_dir(self):
+        trace_dir = tempfile.mkdtemp()
+        try:
+            traces = sampling.sample_chains(build_two_players, 2, seed=3,
+                                            iter=20, trace_dir=trace_dir,
+                                            chunk_size=6)
+            self.assertEqual((2, 20, 2), traces['players_sink'].shape)
+            self.assertEqual(['chain_0', 'chain_1'],
+                             sorted(os.listdir(trace_dir)))
+        finally:
+            shutil.rmtree(trace_dir)
+
+    def test_sample_chains(self):
+        traces = sampling.sample_chains(build_two_players, 2, seed=3, iter=20)
+        self.assertEqual((2, 20, 2), traces['players_sink'].shape)
+        self.assertFalse(np.array_equal(traces['players_sink'][0],
+                                        traces['players_sink'][1]))
+
+class TestFindMap(unittest.TestCase):
+    def test_beta_mode(self):
+        x = pm.Beta('x', 3, 5, value=0.5)
+        y = pm.Beta('y', 2, 2, value=np.array([0.1, 0.8]))
+        logp = sampling.find_map([x, y], [x, y])
+        self.assertAlmostEqual(1. / 3, x.value, places=3)
+        self.assertTrue(np.allclose([0.5, 0.5], y.value, atol=1e-3))
+        self.assertAlmostEqual(pm.Model([x, y]).logp, logp)
+
+    def test_players(self):
+        (nodes, player_nodes) = build_two_players()
+        start = pm.Model(nodes).logp
+        logp = sampling.find_map(nodes, player_nodes)
+        self.assertTrue(logp > start)
+        self.assertTrue(sampling._allowed(player_nodes))
+
+class TestPoolMixing(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(5)
+        self.pool = analyze.PlayerPool(['p%d' % i for i in range(6)])
+        matches = [analyze.Match([i % 6, (i + 1 + i // 6) % 6], i % 2,
+                                 "total", i % 5 == 0)
+                   for i in range(24)]
+        self.nodes = self.pool.nodes() + analyze.match_likelihood(
+            matches, analyze.BallCountMatchEvaluator(),
+            marginalize_orders=True, pool=self.pool)
+
+    def assert_moves(self, model):
+        model.sample(200, tune_interval=1000, progress_bar=False)
+        for name in ('players_sink', 'players_foul_end'):
+            trace = model.trace(name)[:]
+            self.assertTrue(len(np.unique(trace[:, 0])) > 10)
+
+    def test_metropolis(self):
+        model = sampling.build_model(self.nodes, self.pool.nodes())
+        self.assert_moves(model)
+        (step_method,) = model.step_method_dict[self.pool.sink]
+        self.assertTrue(step_method.accepted > 0)
+
+    def test_adaptive_metropolis(self):
+        model = sampling.build_model(self.nodes, self.pool.nodes(),
+                                     'adaptive-metropolis', delay=50,
+                                     interval=25)
+        self.assert_moves(model)
+
+def build_crashing(crash_after=None):
+    """
+    A model that raises an error once it has been evaluated crash_after
+    times, like a run that was stopped
+    """
+    x = pm.Normal('x', 0, 1, value=0.)
+    evaluations = [0]
+    @pm.potential
+    def crash(x=x):
+        evaluations[0] += 1
+        if crash_after is not None and evaluations[0] > crash_after:
+            raise RuntimeError("Stopped")
+        return 0.
+    return ([x, crash], [x])
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def sample(self, trace_dir, crash_after=None):
+        np.random.seed(4)
+        (nodes, player_nodes) = build_crashing(crash_after)
+        model = sampling.build_model(nodes, player_nodes,
+                                     trace_dir=trace_dir, chunk_size=7)
+        model.sample(200, tune_interval=50, save_interval=30,
+                     progress_bar=False)
+        return model
+
+    def test_resume(self):
+        full = self.sample(os.path.join(self.dir, 'full')).trace('x')[:]
+
+        stopped = os.path.join(self.dir, 'stopped')
+        with self.assertRaises(RuntimeError):
+            self.sample(stopped, crash_after=120)
+        checkpoint = traces.load(stopped).getstate()
+        self.assertTrue(0 < checkpoint['sampler']['_current_iter'] < 200)
+        (nodes, player_nodes) = build_crashing()
+        model = sampling.resume(nodes, player_nodes, stopped,
+                                checkpoint_interval=30, progress_bar=False)
+        self.assertEqual(200, model._current_iter)
+        self.assertTrue(np.array_equal(full, model.trace('x')[:]))
+
+    def test_resume_finished(self):
+        full = self.sample(self.dir).trace('x')[:]
+        (nodes, player_nodes) = build_crashing()
+        model = sampling.resume(nodes, player_nodes, self.dir,
+                                progress_bar=False)
+        self.assertTrue(np.array_equal(full, model.trace('x')[:]))
+
+    def test_other_pymc_version(self):
+        (nodes, player_nodes) = build_crashing()
+        version = pm.__version__
+        pm.__version__ = '2.3.6'
+        try:
+            with self.assertRaisesRegexp(RuntimeError, '2.3.8'):
+                sampling.resume(nodes, player_nodes, self.dir,
+                                progress_bar=False)
+        finally:
+            pm.__version__ = version
+
+    def test_no_checkpoint(self):
+        (nodes, player_nodes) = build_crashing()
+        with self.assertRaises(ValueError):
+            sampling.resume(nodes, player_nodes, self.dir)
+
+class TestSampleUntilConverged(unittest.TestCase):
+    def test_find_burn_in(self):
+        random = np.random.RandomState(9)
+        settled = random.normal(size=1000)
+        drifting = random.normal(size=1000)
+        drifting[:300] += np.linspace(20, 0, 300)
+        self.assertEqual(0, sampling.find_burn_in({'a': settled}))
+        burn = sampling.find_burn_in({'a': settled, 'b': drifting})
+        self.assertTrue(burn >= 200)
+
+    def test_find_burn_in_stuck(self):
+        self.assertEqual(None, sampling.find_burn_in({'a': np.zeros(100)}))
+
+    def test_max_iter(self):
+        (nodes, player_nodes) = build_two_players()
+        model = sampling.build_model(nodes, player_nodes)
+        run = sampling.sample_until_converged(model, player_nodes,
+                                              block_size=50, min_ess=1e9,
+                                              max_iter=100)
+        self.assertEqual(100, run.iterations)
+        self.assertFalse(run.converged)
+        burn = run.burn if run.burn is not None else 50
+        self.assertEqual(100 - burn, len(run.traces['players_sink']))
+
+    def test_last_block_shortened(self):
+        x = pm.Normal('x', 0, 1, value=0.)
+        model = sampling.build_model([x], [x])
+        run = sampling.sample_until_converged(model, [x], block_size=300,
+                                              min_ess=1e9, max_iter=500)
+        self.assertEqual(500, run.iterations)
+        self.assertEqual(500, len(model.trace('x', chain=None)[:]))
+
+    def test_tuned_between_blocks(self):
+        np.random.seed(10)
+        x = pm.Normal('x', 0, 1, value=0.)
+        model = sampling.build_model([x], [x])
+        (step_method,) = model.step_method_dict[x]
+        factors = []
+        sample = model.sample
+        def sample_block(*args, **kwargs):
+            factors.append(np.copy(step_method.adaptive_scale_factor))
+            sample(*args, **kwargs)
+        model.sample = sample_block
+        sampling.sample_until_converged(model, [x], block_size=500,
+                                        min_ess=1e9, max_iter=1500,
+                                        tune_interval=1000)
+        self.assertEqual(3, len(factors))
+        self.assertNotEqual(factors[0], factors[1])
+        self.assertNotEqual(factors[1], factors[2])
+
+    def test_burn_in_of_zero_keeps_every_draw(self):
+        np.random.seed(10)
+        x = pm.Normal('x', 0, 1, value=0.)
+        model = sampling.build_model([x], [x])
+        run = sampling.sample_until_converged(model, [x], block_size=500,
+                                              min_ess=1e9, max_iter=500)
+        self.assertEqual(0, run.burn)
+        self.assertEqual(500, len(run.traces['x']))
+
+    def test_converges(self):
+        np.random.seed(10)
+        x = pm.Normal('x', 0, 1, value=0.)
+        model = sampling.build_model([x], [x])
+        run = sampling.sample_until_converged(model, [x], block_size=500,
+                                              min_ess=100, max_iter=20000)
+        self.assertTrue(run.converged)
+        self.assertTrue(run.effective_sample_sizes['x'] >= 100)
+        self.assertTrue(run.r_hats['x'] <= 1.1)
+        self.assertTrue(run.iterations < 20000)
+
+    def test_time_budget(self):
+        x = pm.Normal('x', 0, 1, value=0.)
+        model = sampling.build_model([x], [x])
+        run = sampling.sample_until_converged(model, [x], block_size=100,
+                                              min_ess=1e9, time_budget=0)
+        self.assertEqual(100, run.iterations)
+
+    def test_time_budget_left(self):
+        x = pm.Normal('x', 0, 1, value=0.)
+        model = sampling.build_model([x], [x])
+        run = sampling.sample_until_converged(model, [x], block_size=100,
+                                              min_ess=1e9, max_iter=1000,
+                                              time_budget=3600)
+        self.assertEqual(1000, run.iterations)
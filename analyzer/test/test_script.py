@@ -0,0 +1,23 @@
+import unittest
+import os
+import subprocess
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+script = os.path.join(root, 'bin', 'analyze')
+two_players = os.path.join(root, 'samples', '2-players.json')
+
+def run(*args):
+    process = subprocess.Popen([sys.executable, script] + list(args),
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    (out, err) = process.communicate()
+    return (process.returncode, out, err)
+
+class TestArguments(unittest.TestCase):
+    def test_map_with_adaptive(self):
+        (code, out, err) = run('--map', '--adaptive', two_players)
+        self.assertEqual(2, code)
+        self.assertTrue('--adaptive' in err)
+        self.assertFalse('Traceback' in err)
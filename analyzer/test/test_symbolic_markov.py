@@ -76,3 +76,30 @@ class SymbolicChainTest(abc_markov.AbstractChainTest, unittest.TestCase):
         self.assertEqual(sympy.Rational(9,28), results[democrat].subs(vars))
         self.assertEqual(sympy.Rational(15,28), results[republican].subs(vars))
         self.assertEqual(sympy.Rational(1,7), results[independent].subs(vars))
+
+    def test_get_absorbing_probabilities_cycle(self):
+        chain = markov.Chain()
+        (a, b, a_end, b_end) = chain.new_states(['a', 'b', 'a_end', 'b_end'])
+        miss = sympy.Symbol("miss")
+        sink = sympy.Symbol("sink")
+        chain.set_transition(a, b, miss)
+        chain.set_transition(b, a, miss)
+        chain.set_transition(a, a_end, sink)
+        chain.set_transition(b, b_end, sink)
+        probabilities = chain.get_absorbing_probabilities()
+        vals = {miss: sympy.Rational(1, 2), sink: sympy.Rational(1, 4)}
+        self.assertEqual(sympy.Rational(3, 5),
+                         sympy.simplify(probabilities[a][a_end].subs(vals)))
+        self.assertEqual(sympy.Rational(2, 5),
+                         sympy.simplify(probabilities[a][b_end].subs(vals)))
+        self.assertEqual(sympy.Rational(2, 5),
+                         sympy.simplify(probabilities[b][a_end].subs(vals)))
+
+    def test_get_absorbing_probabilities_not_absorbing(self):
+        chain = markov.Chain()
+        (one, two, three) = chain.new_states(['one', 'two', 'three'])
+        trans = sympy.Symbol("trans")
+        chain.set_transition(one, two, trans)
+        chain.set_transition(two, one, trans)
+        with self.assertRaises(Exception):
+            chain.get_absorbing_probabilities()
@@ -0,0 +1,85 @@
+import unittest
+import pymc as pm
+import numpy as np
+import os
+import shutil
+import tempfile
+import analyzer.traces as traces
+
+class TestChunkedTraces(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.x = pm.Normal('x', 0, 1, value=0.)
+        self.y = pm.Normal('y', np.zeros(2), 1, value=np.zeros(2))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def sample(self, iter, dbname=None):
+        model = pm.MCMC([self.x, self.y], db=traces,
+                        dbname=dbname or self.dir, dbchunk=7)
+        model.sample(iter, progress_bar=False)
+        return model
+
+    def sample_checkpointed(self, iter, save_interval):
+        model = pm.MCMC([self.x, self.y], db=traces, dbname=self.dir,
+                        dbchunk=7)
+        model.sample(iter, save_interval=save_interval, progress_bar=False)
+        return model
+
+    def x_files(self):
+        return sorted(name for name in os.listdir(self.dir)
+                      if name.startswith('x.chain0.'))
+
+    def test_chunks(self):
+        model = self.sample(30)
+        self.assertEqual(['x.chain0.chunk%d.npy' % chunk
+                          for chunk in range(4)] + ['x.chain0.tail.npy'],
+                         self.x_files())
+        for name in self.x_files():
+            expected = 2 if 'tail' in name else 7
+            self.assertEqual(expected,
+                             len(np.load(os.path.join(self.dir, name))))
+        self.assertEqual((30,), model.trace('x')[:].shape)
+        self.assertEqual((30, 2), model.trace('y')[:].shape)
+        self.assertEqual(30, model.trace('x').length())
+
+    def test_checkpoints_keep_chunks_full(self):
+        model = self.sample_checkpointed(30, 3)
+        self.assertEqual(5, len(self.x_files()))
+        db = traces.load(self.dir)
+        self.assertTrue(np.array_equal(model.trace('x')[:],
+                                       db.trace('x')[:]))
+
+    def test_values(self):
+        model = self.sample(20)
+        trace = model.trace('x')[:]
+        self.assertEqual(trace[-1], self.x.value)
+        self.assertTrue(np.allclose(trace[5:10], model.trace('x')[5:10]))
+        self.assertTrue(np.allclose(trace[::3],
+                                    model.trace('x').gettrace(thin=3)))
+
+    def test_chains(self):
+        model = self.sample(10)
+        model.sample(5, progress_bar=False)
+        self.assertEqual((5,), model.trace('x')[:].shape)
+        self.assertEqual((10,), model.trace('x', chain=0)[:].shape)
+        self.assertEqual((15,), model.trace('x', chain=None)[:].shape)
+
+    def test_load(self):
+        model = self.sample(10)
+        model.sample(5, progress_bar=False)
+        db = traces.load(self.dir)
+        self.assertEqual(2, db.chains)
+        self.assertTrue(np.allclose(model.trace('y', chain=None)[:],
+                                    db.trace('y', chain=None)[:]))
+
+    def test_new_database_removes_chunks(self):
+        self.sample(10)
+        self.sample(3)
+        self.assertEqual(1, traces.load(self.dir).chains)
+        self.assertEqual((3,), traces.load(self.dir).trace('x')[:].shape)
+
+    def test_chunk_size(self):
+        with self.assertRaises(ValueError):
+            traces.Database(self.dir, dbchunk=0)
@@ -0,0 +1,293 @@
+"""
+A pymc database backend that streams the traces to disk in chunks.
+
+Every trace keeps at most chunk_size draws in memory.  When they fill up
+they are saved as a .npy file in the database's directory, named after the
+trace, the chain and the chunk, so long runs don't grow the memory they use.
+Every chunk holds chunk_size draws; the draws left over when a chain ends
+are saved to a tail file of the trace and chain instead.  Reading a trace
+memory maps the chunks and joins them with the tail.  Use it by passing the
+module as the db of a pymc.MCMC with the directory as dbname:
+
+    pm.MCMC(nodes, db=analyzer.traces, dbname='traces', dbchunk=1000)
+
+Whenever pymc saves the sampler's state, such as every save_interval
+iterations of MCMC.sample, the state is written to a checkpoint file with
+the number of chunks of each trace, the draws it hasn't saved in a chunk
+yet and numpy's random state, so that load can pick the run up where the
+checkpoint left it.
+"""
+
+from pymc.database import base
+import numpy as np
+import cPickle as pickle
+import glob
+import os
+import re
+import tempfile
+
+__all__ = ['Trace', 'Database', 'load']
+
+CHUNK_PATTERN = re.compile(r'^(.+)\.chain(\d+)\.chunk(\d+)\.npy$')
+TAIL_PATTERN = re.compile(r'^(.+)\.chain(\d+)\.tail\.npy$')
+CHECKPOINT = 'checkpoint.pickle'
+
+class Trace(base.Trace):
+    """
+    A trace that buffers draws in memory and saves them in chunks
+    """
+
+    def __init__(self, name, getfunc=None, db=None):
+        self._buffer = {}
+        self._buffered = {}
+        self._chunks = {}
+        self._length = {}
+        base.Trace.__init__(self, name=name, getfunc=getfunc, db=db)
+
+    def _chunk_path(self, chain, chunk):
+        return os.path.join(self.db.dbname, '%s.chain%d.chunk%d.npy' %
+                            (self.name, chain, chunk))
+
+    def _tail_path(self, chain):
+        return os.path.join(self.db.dbname, '%s.chain%d.tail.npy' %
+                            (self.name, chain))
+
+    def _initialize(self, chain, length):
+        if self._getfunc is None:
+            self._getfunc = self.db.model._funs_to_tally[self.name]
+        self._initialize_buffer(chain)
+        self._buffered[chain] = 0
+        self._chunks[chain] = []
+        self._length[chain] = 0
+
+    def _initialize_buffer(self, chain):
+        value = np.asarray(self._getfunc())
+        self._buffer[chain] = np.zeros((self.db.chunk_size,) + value.shape,
+                                       value.dtype)
+
+    def _fill_buffer(self, chain, draws):
+        """
+        Put draws that weren't saved in a chunk back in the chain's buffer
+        """
+        self._buffer[chain] = np.zeros((self.db.chunk_size,) +
+                                       draws.shape[1:], draws.dtype)
+        self._buffer[chain][:len(draws)] = draws
+        self._buffered[chain] = len(draws)
+
+    def _tail(self, chain):
+        """
+        Return the draws of the chain that aren't saved in a chunk
+        """
+        if chain not in self._buffer:
+            return None
+        return self._buffer[chain][:self._buffered[chain]]
+
+    def tally(self, chain):
+        self._buffer[chain][self._buffered[chain]] = self._getfunc()
+        self._buffered[chain] += 1
+        self._length[chain] += 1
+        if self._buffered[chain] == len(self._buffer[chain]):
+            self._flush(chain)
+
+    def _flush(self, chain):
+        """
+        Save the full buffer of the chain as its next chunk
+        """
+        path = self._chunk_path(chain, len(self._chunks[chain]))
+        np.save(path, self._buffer[chain])
+        self._chunks[chain].append(path)
+        self._buffered[chain] = 0
+
+    def _finalize(self, chain):
+        """
+        Save the draws of the chain that don't fill a chunk to its tail file
+        """
+        tail = self._tail(chain)
+        if tail is None:
+            return
+        path = self._tail_path(chain)
+        # np.save adds .npy to names that don't end with it
+        temp_path = path[:-len('.npy')] + '.tmp.npy'
+        np.save(temp_path, tail)
+        os.rename(temp_path, path)
+
+    def _reopen(self, chain):
+        """
+        Get ready to append draws to a chain loaded from disk
+        """
+        if chain not in self._buffer:
+            self._initialize_buffer(chain)
+            self._buffered[chain] = 0
+
+    def truncate(self, index, chain):
+        self._length[chain] = min(index, self._length[chain])
+
+    def _chain_values(self, chain):
+        chunks = [np.load(path, mmap_mode='r')
+                  for path in self._chunks[chain]]
+        tail = self._tail(chain)
+        if tail is not None:
+            chunks.append(tail)
+        if len(chunks) == 0:
+            return np.zeros((0,))
+        return np.concatenate(chunks)[:self._length[chain]]
+
+    def _chain_index(self, chain):
+        if chain < 0:
+            chain = range(self.db.chains)[chain]
+        return chain
+
+    def _values(self, chain):
+        if chain is None:
+            return np.concatenate([self._chain_values(c)
+                                   for c in sorted(self._chunks)])
+        return self._chain_values(self._chain_index(chain))
+
+    def gettrace(self, burn=0, thin=1, chain=-1, slicing=None):
+        if slicing is None:
+            slicing = slice(burn, None, thin)
+        return self._values(chain)[slicing]
+
+    __call__ = gettrace
+
+    def __getitem__(self, index):
+        return self._values(self._chain)[index]
+
+    def length(self, chain=-1):
+        if chain is None:
+            return sum(self._length.values())
+        return self._length[self._chain_index(chain)]
+
+class Database(base.Database):
+    """
+    A database keeping each trace in chunks of dbchunk draws in the
+    directory dbname.  With dbmode 'w' the chunks of an earlier database in
+    the directory are removed, with 'a' they are left alone.
+    """
+
+    def __init__(self, dbname, dbchunk=1000, dbmode='w'):
+        if dbchunk < 1:
+            raise ValueError("The chunk size must be at least 1 but was " +
+                             str(dbchunk))
+        self.__name__ = 'chunked'
+        self.__Trace__ = Trace
+        self.dbname = dbname
+        self.chunk_size = dbchunk
+        self.trace_names = []
+        self._traces = {}
+        self.chains = 0
+        if not os.path.isdir(dbname):
+            os.makedirs(dbname)
+        elif dbmode == 'w':
+            for path in _chunk_paths(dbname) + _tail_paths(dbname):
+                os.remove(path)
+            if os.path.exists(os.path.join(dbname, CHECKPOINT)):
+                os.remove(os.path.join(dbname, CHECKPOINT))
+
+    def _finalize(self, chain=-1):
+        if self.chains > 0:
+            base.Database._finalize(self, chain)
+
+    def savestate(self, state):
+        """
+        Write a checkpoint of the state with the number of chunks in each
+        trace of the last chain, the draws that aren't in a chunk yet and
+        numpy's random state.  pymc saves the state while sampling after an
+        iteration is tallied but before it is counted, so the checkpoint
+        counts it.
+        """
+        chain = self.chains - 1
+        state = dict(state)
+        state['sampler'] = dict(state['sampler'])
+        if state['sampler'].get('status') == 'running':
+            state['sampler']['_current_iter'] += 1
+        state['chain'] = chain
+        state['chunks'] = dict((name, len(self._traces[name]._chunks[chain]))
+                               for name in self.trace_names[chain])
+        state['tails'] = dict((name, np.copy(self._traces[name]._tail(chain)))
+                              for name in self.trace_names[chain])
+        state['random'] = np.random.get_state()
+        self._state_ = state
+
+        # Write to a temporary file first so that being stopped while writing
+        # leaves the last checkpoint in place
+        (fd, temp_path) = tempfile.mkstemp(dir=self.dbname, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as checkpoint_file:
+            pickle.dump(state, checkpoint_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, os.path.join(self.dbname, CHECKPOINT))
+
+    def _reopen(self):
+        """
+        Get ready to append draws to the last chain of a loaded database
+        """
+        chain = self.chains - 1
+        for name in self.trace_names[chain]:
+            self._traces[name]._reopen(chain)
+
+def _chunk_paths(dbname):
+    return [path for path in glob.glob(os.path.join(dbname, '*.npy'))
+            if CHUNK_PATTERN.match(os.path.basename(path))]
+
+def _tail_paths(dbname):
+    return [path for path in glob.glob(os.path.join(dbname, '*.npy'))
+            if TAIL_PATTERN.match(os.path.basename(path))]
+
+def load(dbname, dbchunk=1000):
+    """
+    Return a Database with the traces saved in the directory dbname, for
+    reading them after the run that wrote them has ended or resuming it.  If
+    there is a checkpoint, its state is restored, any chunks saved after it
+    are removed and the draws it holds are put back in the buffers of its
+    chain, in place of that chain's tail files.
+    """
+    db = Database(dbname, dbchunk, dbmode='a')
+    checkpoint_path = os.path.join(dbname, CHECKPOINT)
+    state = None
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'rb') as checkpoint_file:
+            state = pickle.load(checkpoint_file)
+        db._state_ = state
+
+    chains = {}
+    for path in _chunk_paths(dbname):
+        match = CHUNK_PATTERN.match(os.path.basename(path))
+        (name, chain, chunk) = (match.group(1), int(match.group(2)),
+                                int(match.group(3)))
+        if state is not None and chain == state['chain'] and \
+           chunk >= state['chunks'].get(name, 0):
+            os.remove(path)
+            continue
+        chains.setdefault(name, {}).setdefault(chain, []).append((chunk,
+                                                                  path))
+
+    tails = {}
+    for path in _tail_paths(dbname):
+        match = TAIL_PATTERN.match(os.path.basename(path))
+        (name, chain) = (match.group(1), int(match.group(2)))
+        if state is not None and chain == state['chain']:
+            continue
+        tails.setdefault(name, {})[chain] = np.load(path)
+        chains.setdefault(name, {}).setdefault(chain, [])
+
+    if state is not None:
+        # A trace may not have any chunks yet at the checkpoint
+        for (name, tail) in state['tails'].items():
+            tails.setdefault(name, {})[state['chain']] = tail
+            chains.setdefault(name, {}).setdefault(state['chain'], [])
+
+    for (name, chunks_by_chain) in chains.items():
+        trace = Trace(name, db=db)
+        for (chain, chunks) in chunks_by_chain.items():
+            trace._chunks[chain] = [path for (_, path) in sorted(chunks)]
+            trace._buffered[chain] = 0
+            trace._length[chain] = sum(len(np.load(path, mmap_mode='r'))
+                                       for path in trace._chunks[chain])
+            if chain in tails.get(name, {}):
+                trace._fill_buffer(chain, tails[name][chain])
+                trace._length[chain] += trace._buffered[chain]
+        db._traces[name] = trace
+        db.chains = max(db.chains, max(chunks_by_chain) + 1)
+    db.trace_names = [[name for name in db._traces
+                       if chain in db._traces[name]._chunks]
+                      for chain in range(db.chains)]
+    return db